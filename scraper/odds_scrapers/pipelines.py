@@ -47,6 +47,31 @@ class RedisListPipeLine:
         return item
 
 
+class RedisStreamPipeLine(RedisListPipeLine):
+    """
+    Appends items to redis stream with the name of REDIS_LIST setting, capped by REDIS_STREAM_MAXLEN
+    """
+    def __init__(self, redis_settings, stream_maxlen):
+        super().__init__(redis_settings)
+        self.stream_maxlen = stream_maxlen
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(crawler.settings.getdict("REDIS_SETTINGS"), crawler.settings.getint("REDIS_STREAM_MAXLEN"))
+        crawler.signals.connect(pipeline.spider_opened, signals.spider_opened)
+        crawler.signals.connect(pipeline.spider_closed, signals.spider_closed)
+        return pipeline
+
+    def process_item(self, item, spider):
+        stream = spider.custom_settings.get('REDIS_LIST')
+        if isinstance(stream, str):
+            data = dict(item)
+            spider.logger.info(data)
+            self.redis_client.xadd(stream, {'data': json.dumps(data)}, maxlen=self.stream_maxlen, approximate=True)
+            spider.logger.debug('Added event to redis stream %s' % stream)
+        return item
+
+
 class PostgresPipeline:
     def __init__(self, db_settings):
         self.db_settings = db_settings
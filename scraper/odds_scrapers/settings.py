@@ -23,6 +23,12 @@ REDIS_SETTINGS = {
    'DB': 1,
    'PASSWORD': os.environ.get('REDIS_PASSWORD', '')
 }
+# lists or streams, the same setting of web
+REDIS_TRANSPORT = os.environ.get('REDIS_TRANSPORT', 'lists')
+REDIS_STREAM_MAXLEN = 100_000
+REDIS_PIPELINE = 'odds_scrapers.pipelines.%s' % (
+    'RedisStreamPipeLine' if REDIS_TRANSPORT == 'streams' else 'RedisListPipeLine'
+)
 
 SCRAPY_SPLASH_HOST = os.environ.get('SCRAPY_SPLASH_HOST', 'localhost')
 SCRAPY_SPLASH_PORT = int(os.environ.get('SCRAPY_SPLASH_PORT', 8050))
@@ -6,7 +6,7 @@ from typing import Any
 import scrapy
 from scrapy.loader import ItemLoader
 
-from odds_scrapers.settings import MAPS_DIR
+from odds_scrapers.settings import MAPS_DIR, REDIS_PIPELINE
 from odds_scrapers.items import Bookmaker
 from odds_scrapers.utils import load_json_file, get_response_json, get_url_times, get_category_by_id
 from odds_scrapers.constants import BET99_EVENTS_LIST_URL, BET99_EVENT_URL, BET99_SUBCATEGORIES_URL, \
@@ -146,6 +146,9 @@ class Bet99Spider(scrapy.Spider):
     custom_settings = {
         'LOG_LEVEL': 'INFO',
         'REDIS_LIST': 'bookmaker_events',
+        'ITEM_PIPELINES': {
+            REDIS_PIPELINE: 301,
+        },
     }
     BET99_SUBCATEGORIES = load_json_file(os.path.join(MAPS_DIR, 'bet99_subcategories_to_parse.json'))
     TIME_FORMAT = '%Y-%m-%dT%H:%M:00.000Z'
@@ -6,7 +6,7 @@ import scrapy
 from scrapy.loader import ItemLoader
 from scrapy_splash import SplashRequest
 
-from odds_scrapers.settings import MAPS_DIR
+from odds_scrapers.settings import MAPS_DIR, REDIS_PIPELINE
 from odds_scrapers.items import Exchange
 from odds_scrapers.utils import load_json_file, get_category_by_id
 from odds_scrapers.constants import SMARKETS_BASE_URL, SMARKETS_SUBCATEGORIES_XPATH, SMARKETS_PAGE_ADDITIONS_TABS, \
@@ -19,7 +19,7 @@ class SmarketsSpider(scrapy.Spider):
         'LOG_LEVEL': 'INFO',
         'REDIS_LIST': 'exchange_events',
         'ITEM_PIPELINES': {
-            'odds_scrapers.pipelines.RedisListPipeLine': 301,
+            REDIS_PIPELINE: 301,
         },
         'DOWNLOAD_FAIL_ON_DATALOSS': False,
         'DOWNLOADER_MIDDLEWARES': {
@@ -0,0 +1,119 @@
+"""
+Matching benchmark: python -m benchmarks --sizes 1000 10000 --backends sequence tfidf --corpus recorded.json
+"""
+import argparse
+import json
+import logging
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+
+from pandas import DataFrame
+
+from benchmarks.corpora import Corpus, generate_synthetic_corpus, load_recorded_corpus
+from matching.matchers import SimilarityExchangeMatcher
+from matching.normalizers import normalize_team_name
+from matching.scorers import SEQUENCE_SCORER, TFIDF_SCORER
+
+
+FULL_SCAN_BACKEND = 'full'  # sequence scorer without blocking index, quadratic, only for small corpora
+TFIDF_SAME_CATEGORY_BACKEND = 'tfidf-category'  # tfidf candidates only of the exchange event category
+BACKENDS = (SEQUENCE_SCORER, TFIDF_SCORER, TFIDF_SAME_CATEGORY_BACKEND, FULL_SCAN_BACKEND)
+
+
+@dataclass
+class BenchmarkResult:
+    corpus: str
+    backend: str
+    exchange_events: int
+    bookmaker_events: int
+    wall_seconds: float
+    scored_pairs: int  # team pairs scored by sequence ratio
+    pruned_pairs: int  # team pairs dropped by length and quick ratio bounds before scoring
+    scored_pairs_per_second: float
+    peak_memory_mb: float | None
+    precision: float
+    recall: float
+
+
+def _make_matcher(corpus: Corpus, backend: str) -> SimilarityExchangeMatcher:
+    matcher = SimilarityExchangeMatcher(
+        bm_events_df=DataFrame(corpus.bookmaker_events),
+        use_blocking=backend != FULL_SCAN_BACKEND,
+        scorer=TFIDF_SCORER if backend in (TFIDF_SCORER, TFIDF_SAME_CATEGORY_BACKEND) else SEQUENCE_SCORER,
+        tfidf_same_category=backend == TFIDF_SAME_CATEGORY_BACKEND
+    )
+    matcher.logger.setLevel(logging.WARNING)  # debug logs of every event
+    return matcher
+
+
+def _match(corpus: Corpus, backend: str) -> tuple[SimilarityExchangeMatcher, dict[tuple[str, bool], str]]:
+    # names normalized by the previous backend would make the next one look faster
+    normalize_team_name.cache_clear()
+    matcher = _make_matcher(corpus, backend)
+    found = {
+        (exc_event['match_name'], exc_event['bet'] == 'Draw'): matched_data['bm_event_data']['match_name']
+        for exc_event, matched_data in matcher.make_batch_matching(corpus.exchange_events)
+    }
+    return matcher, found
+
+
+def run_benchmark(corpus: Corpus, backend: str, measure_memory: bool = True) -> BenchmarkResult:
+    started = time.perf_counter()
+    matcher, found = _match(corpus, backend)
+    wall_seconds = time.perf_counter() - started
+
+    peak_memory_mb = None
+    if measure_memory:
+        # separate pass, because tracing slows down matching
+        tracemalloc.start()
+        _match(corpus, backend)
+        peak_memory_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+
+    true_positives = sum(1 for key, bm_match_name in found.items() if corpus.pairs.get(key) == bm_match_name)
+    scored_pairs = matcher.pruned_pairs[matcher.RATIO_STAGE]
+    pruned_pairs = sum(matcher.pruned_pairs.values()) - scored_pairs
+    return BenchmarkResult(
+        corpus=corpus.name,
+        backend=backend,
+        exchange_events=len(corpus.exchange_events),
+        bookmaker_events=len(corpus.bookmaker_events),
+        wall_seconds=round(wall_seconds, 3),
+        scored_pairs=scored_pairs,
+        pruned_pairs=pruned_pairs,
+        scored_pairs_per_second=round(scored_pairs / wall_seconds, 1) if wall_seconds else 0.0,
+        peak_memory_mb=round(peak_memory_mb, 1) if peak_memory_mb is not None else None,
+        precision=round(true_positives / len(found), 4) if found else 0.0,
+        recall=round(true_positives / len(corpus.pairs), 4) if corpus.pairs else 0.0
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Matching benchmark')
+    parser.add_argument('--sizes', nargs='*', type=int, default=[1000, 10000, 50000],
+                        help='fixtures count of synthetic corpora')
+    parser.add_argument('--corpus', nargs='*', default=[], help='paths of recorded corpora')
+    parser.add_argument('--backends', nargs='*', default=[SEQUENCE_SCORER, TFIDF_SCORER], choices=BACKENDS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory pass')
+    parser.add_argument('--output', help='path of json file with results')
+    args = parser.parse_args()
+
+    corpora = [generate_synthetic_corpus(size, seed=args.seed) for size in args.sizes]
+    corpora.extend(load_recorded_corpus(path) for path in args.corpus)
+
+    results = []
+    for corpus in corpora:
+        for backend in args.backends:
+            result = run_benchmark(corpus, backend, measure_memory=not args.no_memory)
+            print(' | '.join(f'{key}={value}' for key, value in asdict(result).items()))
+            results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump([asdict(result) for result in results], file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import json
+import random
+from dataclasses import dataclass, field
+from typing import Any
+
+
+ACCENTS = {'a': 'á', 'e': 'é', 'i': 'í', 'o': 'ö', 'u': 'ü', 'n': 'ñ', 'c': 'ç'}
+SYLLABLES = tuple(consonant + vowel + ending for consonant in 'bcdfgklmnprstvz' for vowel in 'aeiou'
+                  for ending in ('', 'l', 'n', 'r', 's'))
+PREFIXES = ('Real', 'Sporting', 'Dynamo', 'Racing', 'Olympic', 'Union', 'Inter')
+CATEGORIES = ('Soccer', 'Hockey', 'Basketball', 'Tennis')
+
+
+@dataclass
+class Corpus:
+    name: str
+    exchange_events: list[dict[str, Any]]
+    bookmaker_events: list[dict[str, Any]]
+    # labeled pairs (exchange match name, exchange bet is draw): bookmaker match name
+    pairs: dict[tuple[str, bool], str] = field(default_factory=dict)
+
+
+def _team_name(rnd: random.Random) -> str:
+    name = ''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))).title()
+    if rnd.random() < 0.3:
+        name = '%s %s' % (rnd.choice(PREFIXES), name)
+    return name
+
+
+def add_noise(team_name: str, rnd: random.Random) -> str:
+    """
+    Noise of team names between sites: suffixes like "FC" and "(Res)", accents, words reordering and typos
+    """
+    if rnd.random() < 0.2:
+        team_name = '%s %s' % (team_name, rnd.choice(('FC', '(Res)', 'City', 'United')))
+
+    if rnd.random() < 0.1:
+        team_name = 'FC %s' % team_name
+
+    if rnd.random() < 0.2:
+        team_name = ''.join(ACCENTS.get(char, char) if rnd.random() < 0.5 else char for char in team_name)
+
+    words = team_name.split()
+    if len(words) > 1 and rnd.random() < 0.1:
+        team_name = ' '.join(words[1:] + words[:1])
+
+    if len(team_name) > 4 and rnd.random() < 0.2:
+        position = rnd.randrange(len(team_name))
+        team_name = team_name[:position] + rnd.choice('aeiou') + team_name[position + 1:]
+    return team_name
+
+
+def _events(first_team: str, second_team: str, category: str, with_draw: bool, **fields) -> list[dict[str, Any]]:
+    bets = [first_team, second_team] + (['Draw'] if with_draw else [])
+    return [
+        dict(first_team=first_team, second_team=second_team, match_name=f'{first_team} vs {second_team}',
+             category=category, bet=bet, **fields)
+        for bet in bets
+    ]
+
+
+def generate_synthetic_corpus(size: int, seed: int = 0, matched_share: float = 0.7) -> Corpus:
+    """
+    Exchange and bookmaker events of about `size` fixtures per side, matched_share of fixtures are on both sides
+    """
+    rnd = random.Random(seed)
+    # sorted, because order of set depends on PYTHONHASHSEED and corpus must be the same for the seed
+    teams = sorted({_team_name(rnd) for _ in range(max(size // 2, 10))})
+    exchange_events, bookmaker_events, pairs = [], [], {}
+
+    for fixture in range(size):
+        category = rnd.choice(CATEGORIES)
+        first_team, second_team = rnd.sample(teams, 2)
+        with_draw = category == 'Soccer'
+        bm_first, bm_second = add_noise(first_team, rnd), add_noise(second_team, rnd)
+        bm_events = _events(bm_first, bm_second, category, with_draw, bookmaker='bet99', odds=1.5)
+        # match names are unique, because the same teams can meet in different fixtures of corpus
+        for event in bm_events:
+            event['match_name'] = f"{event['match_name']} #{fixture}"
+        bookmaker_events.extend(bm_events)
+
+        if rnd.random() < matched_share:
+            exc_first, exc_second = add_noise(first_team, rnd), add_noise(second_team, rnd)
+            exc_events = _events(exc_first, exc_second, category, with_draw, exchange='smarkets', lay=1.6)
+            for event in exc_events:
+                event['match_name'] = f"{event['match_name']} #{fixture}"
+                pairs[(event['match_name'], event['bet'] == 'Draw')] = bm_events[0]['match_name']
+            exchange_events.extend(exc_events)
+
+    # exchange fixtures which are not on bookmaker
+    for fixture in range(size, size + int(size * (1 - matched_share))):
+        first_team, second_team = rnd.sample(teams, 2)
+        category = rnd.choice(CATEGORIES)
+        exc_events = _events(add_noise(first_team, rnd), add_noise(second_team, rnd), category, category == 'Soccer',
+                             exchange='smarkets', lay=1.6)
+        for event in exc_events:
+            event['match_name'] = f"{event['match_name']} #{fixture}"
+        exchange_events.extend(exc_events)
+
+    rnd.shuffle(exchange_events)
+    rnd.shuffle(bookmaker_events)
+    return Corpus(name=f'synthetic-{size}', exchange_events=exchange_events, bookmaker_events=bookmaker_events,
+                  pairs=pairs)
+
+
+def load_recorded_corpus(path: str) -> Corpus:
+    """
+    Anonymized recorded corpus, json file:
+    {"exchange_events": [...], "bookmaker_events": [...], "pairs": [[exchange match name, is draw, bookmaker match name]]}
+    """
+    with open(path) as file:
+        data = json.load(file)
+
+    return Corpus(
+        name=path,
+        exchange_events=data['exchange_events'],
+        bookmaker_events=data['bookmaker_events'],
+        pairs={(exc_match_name, is_draw): bm_match_name for exc_match_name, is_draw, bm_match_name in data['pairs']}
+    )
@@ -31,6 +31,22 @@ GOOGLE_MIN_BACKOFF_TIME = 30
 GOOGLE_MAX_BACKOFF_TIME = 300  # 5 min
 CREDENTIALS_JSON = os.path.join(STATIC, 'credentials.json')
 SPREADSHEET_ID = '1B6ubDsstHlzdFxjSHsmWzp3sgl7nmZMgnl9hTFjjQss'
+# queue - diff writes by background sheet writer (python -m queues --consumer sheets), pair run only publishes rows,
+# diff - only changed cells and new rows by shadow copy of sheet, append - new rows after the last written row
+SHEETS_WRITE_MODE = os.environ.get('SHEETS_WRITE_MODE', 'queue')
+SHEET_WRITES_LIST_PREFIX = 'sheet_writes'  # redis list of row upserts per spreadsheet
+SHEET_WRITES_BATCH_SIZE = 100  # sheet writer flushes when it has so many upserts
+SHEET_WRITES_MAX_WAIT_SECONDS = 5  # or when this time passed since the first upsert of batch
+SHEET_WRITER_IDLE_SECONDS = 5
+SHEET_WRITES_MAX_ATTEMPTS = 5  # upsert which failed so many times is moved to the dead letter list
+SHEET_SHADOW_TTL_SECONDS = 6 * 60 * 60  # shadow copy of sheet in redis
+GOOGLE_METADATA_TTL_SECONDS = 60  # sheets titles, ids and grid sizes are cached by spreadsheet client
+# token buckets in redis shared by workers, below sheets api quota of 300 requests per minute per project
+# and 60 per minute per user (service account)
+GOOGLE_PROJECT_REQUESTS_PER_MINUTE = int(os.environ.get('GOOGLE_PROJECT_REQUESTS_PER_MINUTE', 270))
+GOOGLE_USER_REQUESTS_PER_MINUTE = int(os.environ.get('GOOGLE_USER_REQUESTS_PER_MINUTE', 54))
+GOOGLE_RATE_LIMIT_BURST = 5  # requests sent at once after idle time
+GOOGLE_RATE_LIMIT_MAX_WAIT_SECONDS = 120  # request is sent without token after it
 
 # Logging
 LOG_LEVEL = logging.NOTSET
@@ -45,12 +61,57 @@ POSTGRES_USER = os.environ.get('POSTGRES_USER', 'postgres')
 POSTGRES_PASSWORD = os.environ.get('POSTGRES_PASSWORD', '')
 POSTGRES_HOST = os.environ.get('POSTGRES_HOST', 'localhost')
 POSTGRES_PORT = int(os.environ.get('POSTGRES_PORT', 5432))
+DB_POOL_MAX_CONNECTIONS = int(os.environ.get('DB_POOL_MAX_CONNECTIONS', 8))  # per process
+DB_POOL_STALE_SECONDS = int(os.environ.get('DB_POOL_STALE_SECONDS', 300))  # connections older are reopened
+DB_POOL_WAIT_SECONDS = 10  # waiting for a free connection when pool is exhausted
+DB_POOL_HEALTH_CHECK_SECONDS = 30  # connection idle longer is checked by SELECT 1 before it is reused
+PARTITIONS_DAYS_AHEAD = 7  # daily partitions of events are created in advance
+PARTITIONS_RETENTION_DAYS = int(os.environ.get('PARTITIONS_RETENTION_DAYS', 30))
+PARTITIONS_DETACH = os.environ.get('PARTITIONS_DETACH', 'false').lower() == 'true'  # detach old instead of drop
 
 # REDIS
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
 REDIS_PASSWORD = os.environ.get("REDIS_PASSWORD", "pwdlocal")
 REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
 REDIS_URL = f'redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/0'
+EXCHANGE_EVENTS_LIST = 'exchange_events'  # REDIS_LIST of exchange spiders
+BOOKMAKER_EVENTS_LIST = 'bookmaker_events'  # REDIS_LIST of bookmaker spiders
+MATCHES_SAVE_LIST_NAME = 'matched_events_to_save'
+REDIS_DRAIN_CHUNK_SIZE = 5000  # items popped from redis list and copied to postgres at once
+REDIS_IN_FLIGHT_TTL_SECONDS = 120  # popped items counter of list expires when drainer died before saving them
+MATCHES_CONSUMER_ENABLED = os.environ.get('MATCHES_CONSUMER_ENABLED', 'true').lower() == 'true'  # else beat task
+MATCHES_BATCH_SIZE = 500  # matches consumer flushes batch when it is full
+MATCHES_BATCH_MAX_WAIT_SECONDS = 0.5  # or when this time passed since the first item of batch
+MATCHES_CONSUMER_IDLE_SECONDS = 5  # blocking pop timeout of empty list, stop signal is checked after it
+REDIS_TRANSPORT = os.environ.get('REDIS_TRANSPORT', 'lists')  # lists or streams, the same setting of scraper
+STREAM_MAXLEN = 100_000  # approximate cap of stream length
+STREAM_GROUP = 'savers'  # consumer group of savers to postgres
+STREAM_BLOCK_MS = 5000  # blocking read timeout of stream consumer
+STREAM_CLAIM_IDLE_MS = 60 * 1000  # pending entries idle longer are redelivered to another consumer
+STREAM_MAX_DELIVERIES = 5  # entries delivered more times are acknowledged without saving
+STREAM_SAVERS = int(os.environ.get('STREAM_SAVERS', 2))  # parallel saving tasks per stream of pair launch
+STREAM_SAVING_WAIT_SECONDS = 5 * 60  # pair launch waits until streams have no pending entries
+
+# MATCHING
+# celery - chunked matching tasks, local - process pool of host (in the task process inside of prefork worker),
+# streaming - incremental matching of events while spiders are running
+MATCHING_MODE = os.environ.get('MATCHING_MODE', 'celery')
+STREAMING_POLL_SECONDS = 1
+STREAMING_MAX_MINUTES = 60  # incremental matching is stopped after it, even if spiders are not finished
+# count of tasks per run or matching processes per host, all runs of host share them in local mode
+MATCHING_WORKERS = int(os.environ.get('MATCHING_WORKERS', os.cpu_count() or 1))
+BM_SNAPSHOT_TTL_SECONDS = 30 * 60  # bookmaker events snapshot of celery matching tasks
+BM_SNAPSHOTS_CACHE_SIZE = 4  # count of parsed snapshots kept by worker process
+NORMALIZED_NAMES_CACHE_SIZE = 100_000  # max count of normalized team names kept in memory of process
+MATCHING_SCORER = os.environ.get('MATCHING_SCORER', 'sequence')  # sequence or tfidf
+TFIDF_TOP_K = int(os.environ.get('TFIDF_TOP_K', 5))  # count of candidates re-ranked by sequence ratio
+# tfidf candidates only of the exchange event category, unlike the full scan
+TFIDF_SAME_CATEGORY = os.environ.get('TFIDF_SAME_CATEGORY', 'false').lower() == 'true'
+MATCHING_BATCH_SIZE = int(os.environ.get('MATCHING_BATCH_SIZE', 2000))  # exchange events loaded and matched at once
+ALIASES_TTL_DAYS = int(os.environ.get('ALIASES_TTL_DAYS', 30))  # accepted team pairings age out after it
+ALIASES_NEGATIVE_TTL_HOURS = int(os.environ.get('ALIASES_NEGATIVE_TTL_HOURS', 24))  # pairs known not to match
+ALIASES_REDIS_TTL_SECONDS = 60 * 60
+ALIASES_MAX_NEGATIVE_ENTRIES = 1000  # pairs known not to match saved by matching of a batch
 
 # TOKENS
 API_KEYS = os.environ.get('API_KEYS', '').split(' ')
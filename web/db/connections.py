@@ -1,6 +1,14 @@
-from peewee import PostgresqlDatabase
+import time
+from collections import Counter
+from contextlib import contextmanager
 
-from config import POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT
+import psycopg2
+import redis
+from playhouse.pool import PooledPostgresqlDatabase
+
+from config import POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT, REDIS_HOST, \
+    REDIS_PORT, REDIS_PASSWORD, DB_POOL_MAX_CONNECTIONS, DB_POOL_STALE_SECONDS, DB_POOL_WAIT_SECONDS, \
+    DB_POOL_HEALTH_CHECK_SECONDS
 
 DB_PARAMS = dict(
     database=POSTGRES_DB,
@@ -10,4 +18,99 @@ DB_PARAMS = dict(
     port=POSTGRES_PORT
 )
 
-db = PostgresqlDatabase(**DB_PARAMS)
+
+class HealthCheckedPooledDatabase(PooledPostgresqlDatabase):
+    """
+    Pool of connections of process, connection which was idle in pool longer than health_check_seconds
+    is checked by SELECT 1 before it is reused. Usage counters are available by pool_metrics
+    """
+    def __init__(self, database, health_check_seconds: int = DB_POOL_HEALTH_CHECK_SECONDS, **kwargs):
+        self.health_check_seconds = health_check_seconds
+        self._returned_at = {}  # connection key: time it was returned to pool
+        self._metrics = Counter()
+        super().__init__(database, **kwargs)
+
+    def _is_closed(self, conn) -> bool:
+        # connection is taken from pool, its time of return is not needed any more
+        returned_at = self._returned_at.pop(self.conn_key(conn), None)
+        if super()._is_closed(conn):
+            return True
+
+        if returned_at is None or time.time() - returned_at < self.health_check_seconds:
+            return False
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+        except Exception:
+            self._metrics['health_check_failures'] += 1
+            try:
+                conn.close()  # pool throws away connections reported closed without closing them
+            except Exception:
+                pass
+            return True
+        return False
+
+    def _connect(self):
+        idle_keys = {self.conn_key(conn) for _, conn in self._connections}
+        conn = super()._connect()
+        self._metrics['checkouts'] += 1
+        if self.conn_key(conn) not in idle_keys:
+            self._metrics['opened'] += 1
+        return conn
+
+    def _close(self, conn, close_conn=False):
+        key = self.conn_key(conn)
+        super()._close(conn, close_conn)
+        # time of return is kept only for connections which are back in pool, not closed as stale or broken
+        if not close_conn and any(self.conn_key(pooled) == key for _, pooled in self._connections):
+            self._returned_at[key] = time.time()
+        else:
+            self._returned_at.pop(key, None)
+
+    def pool_metrics(self) -> dict[str, int]:
+        return dict(
+            max_connections=self._max_connections,
+            in_use=len(self._in_use),
+            idle=len(self._connections),
+            **self._metrics
+        )
+
+    @contextmanager
+    def raw_connection(self):
+        """
+        Pooled psycopg2 connection for pandas and raw sql, it is returned to pool after the block
+        if it was not opened before
+        """
+        opened = self.is_closed()
+        if opened:
+            self.connect()
+        try:
+            yield self.connection()
+        finally:
+            if opened:
+                self.close()
+
+
+@contextmanager
+def dedicated_connection(readonly: bool = False):
+    """
+    Connection out of pool for long reads, its transaction does not hold the pooled connection of thread
+    and is not shared with writes. Not committed transaction is rolled back on close
+    """
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        conn.set_session(readonly=readonly)
+        yield conn
+    finally:
+        conn.close()
+
+
+db = HealthCheckedPooledDatabase(
+    max_connections=DB_POOL_MAX_CONNECTIONS,
+    stale_timeout=DB_POOL_STALE_SECONDS,
+    timeout=DB_POOL_WAIT_SECONDS,
+    **DB_PARAMS
+)
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=1, password=REDIS_PASSWORD)
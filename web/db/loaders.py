@@ -0,0 +1,22 @@
+import uuid
+from typing import Any, Iterator
+
+from config import MATCHING_BATCH_SIZE
+from db.connections import dedicated_connection
+
+
+def iter_record_batches(query: str, params: tuple, batch_size: int = MATCHING_BATCH_SIZE,
+                        cursor_name: str = None) -> Iterator[list[dict[str, Any]]]:
+    """
+    Rows of parameterized query by batches from named (server-side) cursor,
+    only one batch of rows is kept in memory of process. Cursor is read by its own connection,
+    so rows written while batches are consumed are committed by the pooled one independently
+    """
+    with dedicated_connection(readonly=True) as conn:
+        # named cursor lives in transaction of the dedicated connection
+        with conn.cursor(name=cursor_name or 'loader_%s' % uuid.uuid4().hex) as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(query, params)
+            while rows := cursor.fetchmany(batch_size):
+                columns = [column.name for column in cursor.description]
+                yield [dict(zip(columns, row)) for row in rows]
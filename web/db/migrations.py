@@ -0,0 +1,98 @@
+import logging
+from dataclasses import dataclass
+
+from config import LOG_FORMAT
+from db.connections import db
+from db.models.migration import AppliedMigration
+from db.partitions import PARTITIONED_MODELS, partitioning_statements, default_partition_statements
+
+
+@dataclass(frozen=True)
+class Migration:
+    name: str
+    statements: tuple[str, ...]
+
+
+# index name: table, definition
+EVENTS_INDEXES = {
+    'exchangeevent_exchange_created_at': ('exchangeevent', '(exchange, created_at)'),
+    'bookmakerevent_bookmaker_created_at': ('bookmakerevent', '(bookmaker, created_at)'),
+    'matchesevent_exchange_bookmaker_created_at': ('matchesevent', '(exchange, bookmaker, created_at)'),
+    'matchesevent_created_at_brin': ('matchesevent', 'USING BRIN (created_at)'),
+    'exchangeevent_created_at_brin': ('exchangeevent', 'USING BRIN (created_at)'),
+    'bookmakerevent_created_at_brin': ('bookmakerevent', 'USING BRIN (created_at)'),
+}
+
+
+def _events_indexes_statements() -> tuple[str, ...]:
+    return tuple(f'CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}'
+                 for name, (table, definition) in EVENTS_INDEXES.items())
+
+
+# applied in order once, names must not be changed after migration is released
+MIGRATIONS = (
+    Migration(
+        name='0001_events_indexes',
+        statements=_events_indexes_statements()
+    ),
+    Migration(
+        name='0002_events_daily_partitions',
+        # indexes of partitioned tables are created on every partition, legacy ones are attached
+        statements=tuple(statement for model in PARTITIONED_MODELS for statement in partitioning_statements(model)) +
+        _events_indexes_statements()
+    ),
+    Migration(
+        name='0003_matches_names_indexes',
+        # anti-join of not matched events report
+        statements=(
+            'CREATE INDEX IF NOT EXISTS matchesevent_exchange_match_name_created_at '
+            'ON matchesevent (exchange_match_name, created_at)',
+            'CREATE INDEX IF NOT EXISTS matchesevent_bookmaker_match_name_created_at '
+            'ON matchesevent (bookmaker_match_name, created_at)',
+        )
+    ),
+    Migration(
+        name='0004_teamalias_updated_at_index',
+        # pruning of stale aliases
+        statements=('CREATE INDEX IF NOT EXISTS teamalias_updated_at ON teamalias (updated_at)',)
+    ),
+    Migration(
+        name='0005_events_default_partitions',
+        statements=tuple(statement for model in PARTITIONED_MODELS for statement in default_partition_statements(model))
+    ),
+)
+
+
+class Migrator:
+    """
+    Applies migrations which are not recorded in AppliedMigration table, each one in its own transaction
+    """
+    def __init__(self, migrations: tuple[Migration, ...] = MIGRATIONS):
+        self.migrations = migrations
+
+        self.logger = logging.Logger(self.__class__.__name__, level=logging.NOTSET)
+        log_format = logging.Formatter(LOG_FORMAT)
+        console = logging.StreamHandler()
+        console.setFormatter(log_format)
+        self.logger.addHandler(console)
+
+    def applied(self) -> set[str]:
+        AppliedMigration.create_table()
+        return {migration.name for migration in AppliedMigration.select(AppliedMigration.name)}
+
+    def apply(self) -> list[str]:
+        applied = self.applied()
+
+        newly_applied = []
+        for migration in self.migrations:
+            if migration.name in applied:
+                continue
+
+            with db.atomic():
+                for statement in migration.statements:
+                    db.execute_sql(statement)
+                AppliedMigration.create(name=migration.name)
+
+            self.logger.info('Applied migration %s' % migration.name)
+            newly_applied.append(migration.name)
+        return newly_applied
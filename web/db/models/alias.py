@@ -0,0 +1,23 @@
+from datetime import datetime
+
+import peewee as pw
+
+from db.models.base import BaseModel
+
+
+class TeamAlias(BaseModel):
+    """
+    Pair of normalized team names: accepted pairing (is_match) or pair known not to match
+    """
+    category = pw.CharField(default='')
+    exchange_team = pw.CharField()
+    bookmaker_team = pw.CharField()
+    similarity = pw.FloatField()
+    is_match = pw.BooleanField()
+    updated_at = pw.DateTimeField(default=datetime.utcnow)
+
+    class Meta:
+        indexes = (
+            (('category', 'exchange_team', 'bookmaker_team'), True),
+            (('updated_at',), False),
+        )
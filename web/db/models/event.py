@@ -6,6 +6,8 @@ from db.models.base import BaseModel
 
 
 class Event(BaseModel):
+    PARTITION_FIELD = 'created_at'  # tables are partitioned by day of it
+
     first_team = pw.CharField()
     second_team = pw.CharField()
     match_name = pw.TextField()
@@ -41,6 +43,8 @@ class BookmakerEvent(Event):
 
 
 class MatchesEvent(BaseModel):
+    PARTITION_FIELD = 'created_at'  # tables are partitioned by day of it
+
     category = pw.CharField()
     exchange = pw.CharField()
     exchange_match_name = pw.TextField()
@@ -0,0 +1,10 @@
+from datetime import datetime
+
+import peewee as pw
+
+from db.models.base import BaseModel
+
+
+class AppliedMigration(BaseModel):
+    name = pw.CharField(unique=True)
+    applied_at = pw.DateTimeField(default=datetime.utcnow)
@@ -1,12 +1,26 @@
+from io import StringIO
+from typing import Any
+
+import peewee as pw
+
 from db.connections import db
+from db.migrations import Migrator
+from db.partitions import PartitionManager
+from db.models.alias import TeamAlias
 from db.models.event import ExchangeEvent, BookmakerEvent, MatchesEvent
 
 
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
 def create_all_models() -> None:
     with db:
         ExchangeEvent.create_table()
         BookmakerEvent.create_table()
         MatchesEvent.create_table()
+        TeamAlias.create_table()
+        Migrator().apply()
+        PartitionManager().maintain()
 
 
 def create_exchange_event(**query) -> ExchangeEvent:
@@ -22,3 +36,34 @@ def create_bookmaker_event(**query) -> BookmakerEvent:
 def create_matches_event(**query) -> MatchesEvent:
     with db.atomic():
         return MatchesEvent.create(**query)
+
+
+def _copy_value(field: pw.Field, value: Any) -> str:
+    # text format of COPY: \N is null, backslash and separators are escaped
+    if value is None:
+        return r'\N'
+    return str(field.db_value(value)).translate(COPY_ESCAPES)
+
+
+def copy_rows_to_model(model: type[pw.Model], rows: list[dict[str, Any]]) -> int:
+    """
+    Streams rows to the model table with COPY FROM STDIN, without creating model instances.
+    Missing fields get model defaults, unknown keys are ignored
+    """
+    fields = [field for field in model._meta.sorted_fields if not isinstance(field, pw.AutoField)]
+    buffer = StringIO()
+    for row in rows:
+        values = []
+        for field in fields:
+            value = row.get(field.name)
+            if value is None and field.default is not None:
+                value = field.default() if callable(field.default) else field.default
+            values.append(_copy_value(field, value))
+        buffer.write('\t'.join(values) + '\n')
+    buffer.seek(0)
+
+    columns = ', '.join('"%s"' % field.column_name for field in fields)
+    with db.atomic():
+        cursor = db.connection().cursor()
+        cursor.copy_expert('COPY "%s" (%s) FROM STDIN' % (model._meta.table_name, columns), buffer)
+    return len(rows)
@@ -0,0 +1,174 @@
+import logging
+import re
+from datetime import date, datetime, timedelta
+
+from peewee import Model
+
+from config import LOG_FORMAT, PARTITIONS_DAYS_AHEAD, PARTITIONS_RETENTION_DAYS, PARTITIONS_DETACH
+from db.connections import db
+from db.models.event import ExchangeEvent, BookmakerEvent, MatchesEvent
+
+
+PARTITIONED_MODELS = (ExchangeEvent, BookmakerEvent, MatchesEvent)
+LEGACY_SUFFIX = '_legacy'
+DEFAULT_SUFFIX = '_default'
+PARTITION_DATE_FORMAT = '%Y%m%d'
+
+PARTITIONS_QUERY = """
+    SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+"""
+BOUND_REGEX = re.compile(r"FROM \((MINVALUE|'(?P<lower>[^']+)')\) TO \((MAXVALUE|'(?P<upper>[^']+)')\)")
+
+
+def partitioning_statements(model: type[Model]) -> tuple[str, ...]:
+    """
+    Converts table of model to partitioned by day of model.PARTITION_FIELD, existing table becomes
+    the legacy partition of all rows before tomorrow, its indexes are renamed to keep names for the new table
+    """
+    table, field = model._meta.table_name, model.PARTITION_FIELD
+    legacy = table + LEGACY_SUFFIX
+    return (
+        f'ALTER TABLE "{table}" RENAME TO "{legacy}"',
+        f"""DO $$ DECLARE index_name text; BEGIN
+            FOR index_name IN SELECT indexname FROM pg_indexes WHERE tablename = '{legacy}' LOOP
+                EXECUTE format('ALTER INDEX %I RENAME TO %I', index_name, index_name || '{LEGACY_SUFFIX}');
+            END LOOP;
+        END $$""",
+        f'CREATE TABLE "{table}" (LIKE "{legacy}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        f'PARTITION BY RANGE ("{field}")',
+        # primary key of partitioned table must include partition key
+        f'ALTER TABLE "{table}" ADD PRIMARY KEY (id, "{field}")',
+        # sequence of ids must outlive the legacy partition
+        f'ALTER SEQUENCE IF EXISTS "{table}_id_seq" OWNED BY "{table}".id',
+        f"""DO $$ BEGIN
+            EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (MINVALUE) TO (%L)',
+                           '{table}', '{legacy}', (date_trunc('day', now() AT TIME ZONE 'UTC') + interval '1 day'));
+        END $$""",
+    )
+
+
+def default_partition_statements(model: type[Model]) -> tuple[str, ...]:
+    # rows out of daily partitions (maintenance was not running) are kept instead of failing inserts
+    table = model._meta.table_name
+    return (f'CREATE TABLE IF NOT EXISTS "{table}{DEFAULT_SUFFIX}" PARTITION OF "{table}" DEFAULT',)
+
+
+class PartitionManager:
+    """
+    Maintenance of daily partitions: creates partitions for the next days_ahead days,
+    drops (or detaches) partitions with rows older than retention_days.
+    Rows of any day which got into the default partition are moved to the daily partition created for the day
+    """
+    def __init__(
+        self,
+        models: tuple[type[Model], ...] = PARTITIONED_MODELS,
+        days_ahead: int = PARTITIONS_DAYS_AHEAD,
+        retention_days: int = PARTITIONS_RETENTION_DAYS,
+        detach: bool = PARTITIONS_DETACH
+    ):
+        self.models = models
+        self.days_ahead = days_ahead
+        self.retention_days = retention_days
+        self.detach = detach
+
+        self.logger = logging.Logger(self.__class__.__name__, level=logging.NOTSET)
+        log_format = logging.Formatter(LOG_FORMAT)
+        console = logging.StreamHandler()
+        console.setFormatter(log_format)
+        self.logger.addHandler(console)
+
+    @staticmethod
+    def partition_name(table: str, day: date) -> str:
+        return '%s_p%s' % (table, day.strftime(PARTITION_DATE_FORMAT))
+
+    @staticmethod
+    def partitions(table: str) -> dict[str, tuple[datetime | None, datetime | None]]:
+        """
+        Partitions of table by name: (lower bound, upper bound), None is unbounded
+        """
+        partitions = {}
+        for name, bound in db.execute_sql(PARTITIONS_QUERY, (table,)).fetchall():
+            found = BOUND_REGEX.search(bound or '')
+            if found is None:  # default partition
+                continue
+
+            lower, upper = found.group('lower'), found.group('upper')
+            partitions[name] = (datetime.fromisoformat(lower) if lower else None,
+                                datetime.fromisoformat(upper) if upper else None)
+        return partitions
+
+    @staticmethod
+    def default_days(table: str, field: str) -> set[date]:
+        # days of rows which got into the default partition while maintenance was not running
+        rows = db.execute_sql(f'SELECT DISTINCT date_trunc(\'day\', "{field}")::date '
+                              f'FROM "{table}{DEFAULT_SUFFIX}" WHERE "{field}" IS NOT NULL').fetchall()
+        return {day for day, in rows}
+
+    def create_partitions(self, table: str, field: str, today: date) -> list[str]:
+        """
+        Creates partitions of the next days_ahead days and of the days found in the default partition
+        """
+        partitions = self.partitions(table)
+        days = {today + timedelta(days=offset) for offset in range(self.days_ahead + 1)}
+        created = []
+        for day in sorted(days | self.default_days(table, field)):
+            start, end = datetime.combine(day, datetime.min.time()), datetime.combine(day + timedelta(days=1),
+                                                                                     datetime.min.time())
+            if any((lower is None or lower < end) and (upper is None or upper > start)
+                   for lower, upper in partitions.values()):
+                continue  # the day is covered already, by daily or legacy partition
+
+            name = self.partition_name(table, day)
+            self._create_partition(table, name, field, start, end)
+            created.append(name)
+        return created
+
+    @staticmethod
+    def _create_partition(table: str, name: str, field: str, start: datetime, end: datetime) -> None:
+        # partition can't be created while the default partition has rows of its range, they are moved first
+        default, bounds = table + DEFAULT_SUFFIX, f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        db.execute_sql(f'CREATE TABLE IF NOT EXISTS "{name}" (LIKE "{table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        db.execute_sql(f'WITH moved AS (DELETE FROM "{default}" WHERE "{field}" >= %s AND "{field}" < %s '
+                       f'RETURNING *) INSERT INTO "{name}" SELECT * FROM moved', (start, end))
+        db.execute_sql(f'ALTER TABLE "{table}" ATTACH PARTITION "{name}" FOR VALUES {bounds}')
+
+    @staticmethod
+    def default_rows(table: str) -> int:
+        return db.execute_sql(f'SELECT count(*) FROM "{table}{DEFAULT_SUFFIX}"').fetchone()[0]
+
+    def remove_old_partitions(self, table: str, today: date) -> list[str]:
+        expired_before = datetime.combine(today - timedelta(days=self.retention_days), datetime.min.time())
+        removed = []
+        for name, (_, upper) in self.partitions(table).items():
+            if upper is None or upper > expired_before:
+                continue
+
+            if self.detach:
+                db.execute_sql(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+            else:
+                db.execute_sql(f'DROP TABLE "{name}"')
+            removed.append(name)
+        return removed
+
+    def maintain(self, today: date = None) -> None:
+        today = today or datetime.utcnow().date()
+        default_rows = {}
+        for model in self.models:
+            table = model._meta.table_name
+            with db.atomic():
+                created = self.create_partitions(table, model.PARTITION_FIELD, today)
+                removed = self.remove_old_partitions(table, today)
+                default_rows[table] = self.default_rows(table)
+
+            if created or removed:
+                self.logger.info('Partitions of %s, created: %s, %s: %s' % (
+                    table, created, 'detached' if self.detach else 'dropped', removed))
+
+        default_rows = {table: rows for table, rows in default_rows.items() if rows}
+        # rows out of the daily partitions range are not removed by retention and slow down queries
+        if default_rows:
+            self.logger.error('Rows in default partitions: %s' % default_rows)
+            raise RuntimeError('Rows out of daily partitions: %s' % default_rows)
@@ -1,3 +1,5 @@
+import json
+
 from apiclient import discovery
 from google.oauth2 import service_account
 
@@ -7,3 +9,12 @@ from config import SCOPES, CREDENTIALS_JSON
 def spreadsheets_service(api_version: str) -> discovery.build:
     credentials = service_account.Credentials.from_service_account_file(CREDENTIALS_JSON, scopes=SCOPES)
     return discovery.build('sheets', api_version, credentials=credentials)
+
+
+def service_account_ids() -> tuple[str, str]:
+    """
+    Google project id and email of service account, the keys of sheets api quotas
+    """
+    with open(CREDENTIALS_JSON) as file:
+        credentials = json.load(file)
+    return credentials.get('project_id', 'default'), credentials.get('client_email', 'default')
@@ -38,7 +38,7 @@ def retry_with_backoff(func):
                     raise http_error
 
                 delay = minimum_backoff_time + randint(0, 1000) / 1000.0
-                logger.warning('Error 429 backoff delay is ' + delay)
+                logger.warning('Error 429 backoff delay is %s' % delay)
                 time.sleep(delay)
                 minimum_backoff_time *= 2
 
@@ -1,19 +1,38 @@
 from logging import Logger, Formatter, StreamHandler
-from typing import Any, OrderedDict, Iterable, Callable
+from typing import Any, OrderedDict, Iterable, Callable, Mapping, Sequence
+
+import json
 
 from config import SPREADSHEET_ID, LOG_FORMAT
+from db.connections import redis_client
+from google_api.shadow import SheetShadow, SheetShadowStore
 from google_api.spreadsheets.client import SpreadSheetClient
 from google_api.spreadsheets.types import BatchBody, Dimension
 from managers.types import TableField
 
 
+DATA_FIRST_ROW = 2  # the first row is headers
+ROW_KEY_FIELDS = ('match_name', 'bet')  # stable identity of row in sheet
+
+
+def column_letter(index: int) -> str:
+    # zero based column index to A1 notation letters
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
 class SpreadSheetWriter:
-    def __init__(self, fields: OrderedDict[str, TableField]):
+    def __init__(self, fields: OrderedDict[str, TableField], spreadsheet_id: str = SPREADSHEET_ID):
         """
         headers {field on table: key in data} ex: {'Match Name': 'match_name'}
         """
         self.fields = fields
-        self.gsp_client = SpreadSheetClient(spreadsheet_id=SPREADSHEET_ID)
+        self.gsp_client = SpreadSheetClient(spreadsheet_id=spreadsheet_id)
+        self.shadows = SheetShadowStore(redis_client, spreadsheet_id)
 
         self.logger = Logger(self.__class__.__name__)
         log_format = Formatter(LOG_FORMAT)
@@ -26,15 +45,16 @@ class SpreadSheetWriter:
         self.gsp_client.write_headers(sheet_name=sheet_name,
                                       values=list(self.fields.keys()) if not headers else headers)
 
-    def rewrite_to_sheet(self, sheet_name: str, data: list[dict[str, Any]]) -> None:
-        self.logger.info('Checking sheet %s...' % sheet_name)
-        self.gsp_client.create_sheet_if_not_exists(sheet_name)
-        self.logger.info('Clearing sheet %s...' % sheet_name)
-        self.gsp_client.clear_sheet(sheet_name=sheet_name)
-        self.write_headers(sheet_name)
-        self.write_to_sheet(sheet_name, data)
+    def rewrite_to_sheet(self, sheet_name: str, data: list[dict[str, Any] | Sequence]) -> None:
+        """
+        Creating of sheet if it does not exist, clearing, headers and data are sent by one batch update
+        """
+        self.shadows.delete(sheet_name)
+        self.logger.info('Rewrite sheet %s...' % sheet_name)
+        self.gsp_client.rewrite_sheet(sheet_name, [list(self.fields.keys())] + self.convert_data_to_rows(data))
+        self.logger.info('Over rewrite sheet %s' % sheet_name)
 
-    def write_to_sheet(self, sheet_name: str, data: list[dict | OrderedDict], check_fields: bool = True,
+    def write_to_sheet(self, sheet_name: str, data: list[dict | OrderedDict | Sequence], check_fields: bool = True,
                        a1_range: str = 'A2:Z') -> None:
         self.logger.info('Write data to sheet %s...' % sheet_name)
         result = self.gsp_client.batch_update_values(
@@ -51,15 +71,19 @@ class SpreadSheetWriter:
         self.logger.debug(f"{result.get('totalUpdatedRows')} rows updated.")
         self.logger.info('Over write data to sheet %s' % sheet_name)
 
-    def convert_data_to_rows(self, data: list[dict | OrderedDict], check_fields: bool = True) -> list[list[str]]:
+    def convert_data_to_rows(self, data: list[dict | OrderedDict | Sequence],
+                             check_fields: bool = True) -> list[list[str]]:
+        """
+        Rows are dicts by keys of fields or sequences of values in order of fields
+        """
         if check_fields:
             collected_rows = []
 
             for row_data in data:
                 row = []
 
-                for _, field in self.fields.items():
-                    value = row_data.get(field.key)
+                for position, field in enumerate(self.fields.values()):
+                    value = row_data.get(field.key) if isinstance(row_data, Mapping) else row_data[position]
 
                     if value and isinstance(field.validator, Callable):
                         value = field.validator(value)
@@ -71,4 +95,127 @@ class SpreadSheetWriter:
                 collected_rows.append(row)
 
             return collected_rows
-        return [list(row.values()) for row in data]
+        return [list(row.values()) if isinstance(row, Mapping) else list(row) for row in data]
+
+    @staticmethod
+    def _changed_ranges(old_row: list[Any], new_row: list[Any]) -> list[tuple[int, int]]:
+        """
+        Runs of changed cells (first column, last column) of row
+        """
+        ranges, start = [], None
+        for column in range(max(len(old_row), len(new_row))):
+            old_value = old_row[column] if column < len(old_row) else None
+            new_value = new_row[column] if column < len(new_row) else None
+            if old_value != new_value:
+                start = column if start is None else start
+            elif start is not None:
+                ranges.append((start, column - 1))
+                start = None
+        if start is not None:
+            ranges.append((start, max(len(old_row), len(new_row)) - 1))
+        return ranges
+
+    def _ensure_rows(self, sheet_name: str, last_row: int) -> None:
+        spreadsheet_meta = self.gsp_client.get_sheet_meta(sheet_name)
+        rows_count = spreadsheet_meta.get('gridProperties', {}).get('rowCount', 1000)
+        if last_row > rows_count:
+            self.gsp_client.add_new_rows(sheet_name=sheet_name, rows_num=max(last_row - rows_count, 1000))
+
+    def upsert_to_sheet(self, sheet_name: str, data: list[dict[str, Any]], reset: bool = False,
+                        key_fields: tuple[str, ...] = ROW_KEY_FIELDS) -> int:
+        """
+        Writes only changed cells of rows which are on sheet and appends new rows by one values batch update,
+        rows are identified by key_fields, the first row of the same key wins.
+        Sheet is rewritten when its shadow copy is unknown or reset is True. Returns count of written rows
+        """
+        return self.upsert_to_sheets({sheet_name: data}, reset_sheets={sheet_name} if reset else (),
+                                     key_fields={sheet_name: key_fields})[sheet_name]
+
+    def upsert_to_sheets(self, data_by_sheets: Mapping[str, list[dict[str, Any]]], reset_sheets: Iterable[str] = (),
+                         key_fields: Mapping[str, tuple[str, ...]] = None) -> dict[str, int]:
+        """
+        Upsert of rows to several sheets, changed cells and new rows of all sheets are sent by one values batch update.
+        Returns count of written rows by sheet
+        """
+        key_fields = key_fields or {}
+        written, shadows, value_ranges = {}, {}, []
+        try:
+            for sheet_name, data in data_by_sheets.items():
+                rows_by_keys, data_by_keys = self._rows_by_keys(data, key_fields.get(sheet_name, ROW_KEY_FIELDS))
+                shadow = None if sheet_name in reset_sheets else self.shadows.get(sheet_name)
+                if shadow is None:
+                    self.rewrite_to_sheet(sheet_name, list(data_by_keys.values()))
+                    self.shadows.set(sheet_name, SheetShadow(keys=list(rows_by_keys),
+                                                             rows=list(rows_by_keys.values())))
+                    written[sheet_name] = len(rows_by_keys)
+                    continue
+
+                shadows[sheet_name] = shadow
+                sheet_ranges, written[sheet_name] = self._shadow_changes(sheet_name, shadow, rows_by_keys)
+                value_ranges.extend(sheet_ranges)
+
+            if value_ranges:
+                self.logger.info('Write %s ranges to sheets %s...' % (len(value_ranges), ', '.join(shadows)))
+                self.gsp_client.batch_update_values(body=BatchBody(data=value_ranges))
+        except Exception:
+            # state of sheets is unknown, the next write rewrites them and reads metadata again
+            for sheet_name in shadows:
+                self.shadows.delete(sheet_name)
+            self.gsp_client.invalidate_metadata()
+            raise
+
+        for sheet_name, shadow in shadows.items():
+            if written[sheet_name] and not self.shadows.set(sheet_name, shadow):
+                self.logger.warning('Shadow of sheet %s was changed by another writer, '
+                                    'the next write rewrites the sheet' % sheet_name)
+        return written
+
+    def _rows_by_keys(self, data: list[dict[str, Any]],
+                      key_fields: tuple[str, ...]) -> tuple[dict[str, list[Any]], dict[str, dict[str, Any]]]:
+        rows_by_keys, data_by_keys = {}, {}
+        for row_data, row in zip(data, self.convert_data_to_rows(data)):
+            key = json.dumps([row_data.get(key_field) for key_field in key_fields])
+            if key in rows_by_keys:
+                continue
+            # json round trip, so values are compared with the shadow in the same types
+            rows_by_keys[key] = json.loads(json.dumps(row, default=str))
+            data_by_keys[key] = row_data
+        return rows_by_keys, data_by_keys
+
+    def _shadow_changes(self, sheet_name: str, shadow: SheetShadow,
+                        rows_by_keys: dict[str, list[Any]]) -> tuple[list[dict[str, Any]], int]:
+        """
+        Value ranges of changed cells and new rows of sheet, shadow is updated by them
+        """
+        value_ranges, written = [], 0
+        first_new_position = len(shadow.rows)
+        for key, row in rows_by_keys.items():
+            position = shadow.positions.get(key)
+            if position is None:
+                shadow.append(key, row)
+                continue
+
+            changed_ranges = self._changed_ranges(shadow.rows[position], row)
+            for first_column, last_column in changed_ranges:
+                sheet_row = DATA_FIRST_ROW + position
+                value_ranges.append(dict(
+                    major_dimension=Dimension.ROWS.value,
+                    range=f'{sheet_name}!{column_letter(first_column)}{sheet_row}:'
+                          f'{column_letter(last_column)}{sheet_row}',
+                    values=[row[first_column:last_column + 1]]
+                ))
+            if changed_ranges:
+                shadow.rows[position] = row
+                written += 1
+
+        new_rows = shadow.rows[first_new_position:]
+        if new_rows:
+            first_row, last_row = DATA_FIRST_ROW + first_new_position, DATA_FIRST_ROW + len(shadow.rows) - 1
+            self._ensure_rows(sheet_name, last_row)
+            value_ranges.append(dict(
+                major_dimension=Dimension.ROWS.value,
+                range=f'{sheet_name}!A{first_row}:{column_letter(len(self.fields) - 1)}{last_row}',
+                values=new_rows
+            ))
+            written += len(new_rows)
+        return value_ranges, written
@@ -0,0 +1,134 @@
+import random
+import time
+from collections import Counter
+from logging import getLogger
+
+from redis import Redis
+
+from config import GOOGLE_PROJECT_REQUESTS_PER_MINUTE, GOOGLE_USER_REQUESTS_PER_MINUTE, \
+    GOOGLE_RATE_LIMIT_BURST, GOOGLE_RATE_LIMIT_MAX_WAIT_SECONDS
+
+
+# takes tokens from all buckets or from none of them, returns seconds to wait for the missing tokens
+TOKEN_BUCKETS_SCRIPT = """
+local now_parts = redis.call('time')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local requested = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+
+for i, key in ipairs(KEYS) do
+    local rate, capacity = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('hmget', key, 'tokens', 'updated_at')
+    local bucket_tokens = tonumber(state[1]) or capacity
+    local updated_at = tonumber(state[2]) or now
+    tokens[i] = math.min(capacity, bucket_tokens + math.max(0, now - updated_at) * rate)
+    if tokens[i] < requested then
+        wait = math.max(wait, (requested - tokens[i]) / rate)
+    end
+end
+
+if wait > 0 then
+    return tostring(wait)
+end
+
+for i, key in ipairs(KEYS) do
+    local rate, capacity = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+    redis.call('hset', key, 'tokens', tokens[i] - requested, 'updated_at', now)
+    redis.call('expire', key, math.ceil(capacity / rate) + 60)
+end
+return '0'
+"""
+
+
+class SheetsRateLimiter:
+    """
+    Token buckets in redis shared by all workers: a bucket of google project and a bucket of user (service account),
+    as sheets api quotas are counted. Request to sheets api is sent when both buckets have a token, so requests
+    are paced under the quota instead of getting 429. Wait time is counted in the process and in redis metrics
+    of spreadsheet
+    """
+    BUCKET_KEY_PREFIX = 'sheets_rate'
+    METRICS_KEY_PREFIX = 'sheets_rate_metrics'
+
+    def __init__(
+        self,
+        redis_client: Redis,
+        spreadsheet_id: str,
+        project_id: str,
+        service_account: str,
+        project_per_minute: int = GOOGLE_PROJECT_REQUESTS_PER_MINUTE,
+        user_per_minute: int = GOOGLE_USER_REQUESTS_PER_MINUTE,
+        burst: int = GOOGLE_RATE_LIMIT_BURST,
+        max_wait_seconds: float = GOOGLE_RATE_LIMIT_MAX_WAIT_SECONDS
+    ):
+        self.redis_client = redis_client
+        self.spreadsheet_id = spreadsheet_id
+        self.max_wait_seconds = max_wait_seconds
+        self.logger = getLogger(self.__class__.__name__)
+        # key: (tokens per second, capacity)
+        self.buckets = {
+            f'{self.BUCKET_KEY_PREFIX}:project:{project_id}': (project_per_minute / 60, burst),
+            # writers of all spreadsheets share quota of the service account
+            f'{self.BUCKET_KEY_PREFIX}:user:{project_id}:{service_account}': (user_per_minute / 60, burst)
+        }
+        self._metrics = Counter()
+        self._buckets_script = redis_client.register_script(TOKEN_BUCKETS_SCRIPT)
+
+    @classmethod
+    def metrics_key(cls, spreadsheet_id: str) -> str:
+        return f'{cls.METRICS_KEY_PREFIX}:{spreadsheet_id}'
+
+    def _take_token(self) -> float:
+        args = [1]
+        for rate, capacity in self.buckets.values():
+            args.extend((rate, capacity))
+        return float(self._buckets_script(keys=list(self.buckets), args=args))
+
+    def acquire(self) -> float:
+        """
+        Blocks until token is taken from all buckets and returns the waited seconds. After max_wait_seconds request
+        is let through without token, retry_with_backoff handles 429 if quota is exceeded
+        """
+        started = time.monotonic()
+        acquired, slept = False, False
+        while True:
+            wait = self._take_token()
+            if not wait:
+                acquired = True
+                break
+
+            remaining = self.max_wait_seconds - (time.monotonic() - started)
+            if remaining <= 0:
+                self.logger.warning('Sheets rate limit wait is over %s seconds' % self.max_wait_seconds)
+                break
+
+            # jitter, so waiting workers do not come back at the same moment
+            time.sleep(min(wait * (1 + random.random() / 10), remaining))
+            slept = True
+
+        waited = time.monotonic() - started if slept else 0.0
+        self._record(waited, acquired)
+        return waited
+
+    def _record(self, waited: float, acquired: bool) -> None:
+        self._metrics['requests'] += 1
+        self._metrics['wait_seconds'] += waited
+        self._metrics['waited_requests'] += int(waited > 0)
+        self._metrics['not_acquired'] += int(not acquired)
+
+        pipeline = self.redis_client.pipeline(transaction=False)
+        metrics_key = self.metrics_key(self.spreadsheet_id)
+        pipeline.hincrby(metrics_key, 'requests', 1)
+        pipeline.hincrbyfloat(metrics_key, 'wait_seconds', waited)
+        pipeline.hincrby(metrics_key, 'waited_requests', int(waited > 0))
+        pipeline.hincrby(metrics_key, 'not_acquired', int(not acquired))
+        pipeline.execute()
+
+    def metrics(self) -> dict[str, float]:
+        return dict(self._metrics)
+
+    @classmethod
+    def cluster_metrics(cls, redis_client: Redis, spreadsheet_id: str) -> dict[str, float]:
+        metrics = redis_client.hgetall(cls.metrics_key(spreadsheet_id))
+        return {key.decode(): float(value) for key, value in metrics.items()}
@@ -0,0 +1,108 @@
+import json
+from dataclasses import dataclass, field
+from typing import Any
+
+from redis import Redis
+
+from config import SHEET_SHADOW_TTL_SECONDS
+
+
+# saves shadow if it was not changed by other writers since it was read (or unconditionally for a new one),
+# a changed shadow is deleted instead, so the next write rewrites the sheet. Returns the new version or 0
+SET_SHADOW_SCRIPT = """
+local current = redis.call('hget', KEYS[1], 'version')
+if ARGV[1] ~= '' and current ~= ARGV[1] then
+    redis.call('del', KEYS[1])
+    return 0
+end
+local version = redis.call('hincrby', KEYS[2], ARGV[4], 1)
+redis.call('hset', KEYS[1], 'version', version, 'data', ARGV[2])
+redis.call('expire', KEYS[1], ARGV[3])
+return version
+"""
+
+
+@dataclass
+class SheetShadow:
+    """
+    Copy of data rows written to sheet, in order of sheet rows, and row position by row key.
+    Version is the one of shadow in redis, None for a shadow which is not read from redis
+    """
+    keys: list[str] = field(default_factory=list)
+    rows: list[list[Any]] = field(default_factory=list)
+    positions: dict[str, int] = field(default_factory=dict)
+    version: int | None = None
+
+    def __post_init__(self):
+        self.positions = {key: position for position, key in enumerate(self.keys)}
+
+    def append(self, key: str, row: list[Any]) -> None:
+        self.positions[key] = len(self.keys)
+        self.keys.append(key)
+        self.rows.append(row)
+
+    def to_json(self) -> str:
+        return json.dumps(dict(keys=self.keys, rows=self.rows))
+
+    @classmethod
+    def from_json(cls, value: str | bytes, version: int = None) -> 'SheetShadow':
+        data = json.loads(value)
+        return cls(keys=data['keys'], rows=data['rows'], version=version)
+
+
+class SheetShadowStore:
+    """
+    Shadow copies of sheets of spreadsheet in redis shared by writers, redis is the source of truth.
+    Copy in memory of process is used while its version is the current one in redis
+    """
+    KEY_PREFIX = 'sheet_shadows'  # hashes of version and data
+    VERSIONS_KEY_PREFIX = 'sheet_shadow_versions'
+
+    def __init__(self, redis_client: Redis, spreadsheet_id: str, ttl: int = SHEET_SHADOW_TTL_SECONDS):
+        self.redis_client = redis_client
+        self.spreadsheet_id = spreadsheet_id
+        self.ttl = ttl
+        # versions are not reset by deletion of shadow, so a copy in memory never matches a newer shadow
+        self.versions_key = f'{self.VERSIONS_KEY_PREFIX}:{spreadsheet_id}'
+        self._shadows = {}
+        self._set_script = redis_client.register_script(SET_SHADOW_SCRIPT)
+
+    def key(self, sheet_name: str) -> str:
+        return f'{self.KEY_PREFIX}:{self.spreadsheet_id}:{sheet_name}'
+
+    def get(self, sheet_name: str) -> SheetShadow | None:
+        version = self.redis_client.hget(self.key(sheet_name), 'version')
+        if version is None:
+            self._shadows.pop(sheet_name, None)
+            return None
+
+        shadow = self._shadows.get(sheet_name)
+        if shadow is not None and shadow.version == int(version):
+            return shadow
+
+        version, value = self.redis_client.hmget(self.key(sheet_name), 'version', 'data')
+        if version is None or value is None:
+            self._shadows.pop(sheet_name, None)
+            return None
+        shadow = self._shadows[sheet_name] = SheetShadow.from_json(value, version=int(version))
+        return shadow
+
+    def set(self, sheet_name: str, shadow: SheetShadow) -> bool:
+        """
+        False if shadow was changed by another writer since it was read, then it is deleted
+        """
+        version = int(self._set_script(
+            keys=[self.key(sheet_name), self.versions_key],
+            args=['' if shadow.version is None else shadow.version, shadow.to_json(), self.ttl, sheet_name]
+        ))
+        if not version:
+            self._shadows.pop(sheet_name, None)
+            return False
+
+        shadow.version = version
+        self._shadows[sheet_name] = shadow
+        return True
+
+    def delete(self, sheet_name: str) -> None:
+        self._shadows.pop(sheet_name, None)
+        self.redis_client.delete(self.key(sheet_name))
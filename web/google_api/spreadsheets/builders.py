@@ -0,0 +1,81 @@
+from typing import Any, Sequence
+
+from google_api.spreadsheets.types import PasteType
+
+
+class BatchUpdateRequests:
+    """
+    Builder of spreadsheets.batchUpdate body, requests are applied by google in order of adding in one round-trip
+    docs: https://developers.google.com/sheets/api/reference/rest/v4/spreadsheets/request
+    """
+    PASTE_DELIMITER = '\t'
+
+    def __init__(self):
+        self.requests: list[dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+    def add_sheet(self, title: str, sheet_id: int, row_count: int, column_count: int) -> 'BatchUpdateRequests':
+        # sheet id is set by us, so the next requests of batch can refer to the sheet which does not exist yet
+        self.requests.append({
+            'addSheet': {
+                'properties': {
+                    'sheetId': sheet_id,
+                    'title': title,
+                    'gridProperties': {'rowCount': row_count, 'columnCount': column_count}
+                }
+            }
+        })
+        return self
+
+    def resize_grid(self, sheet_id: int, row_count: int, column_count: int) -> 'BatchUpdateRequests':
+        self.requests.append({
+            'updateSheetProperties': {
+                'properties': {
+                    'sheetId': sheet_id,
+                    'gridProperties': {'rowCount': row_count, 'columnCount': column_count}
+                },
+                'fields': 'gridProperties.rowCount,gridProperties.columnCount'
+            }
+        })
+        return self
+
+    def clear_values(self, sheet_id: int, first_column: int = 0, last_column: int = None) -> 'BatchUpdateRequests':
+        """
+        Clears values of all rows in columns from first_column to last_column (zero based, inclusive), formats are kept
+        """
+        grid_range = {'sheetId': sheet_id, 'startColumnIndex': first_column}
+        if last_column is not None:
+            grid_range['endColumnIndex'] = last_column + 1
+
+        # updateCells without rows clears fields of range
+        self.requests.append({'updateCells': {'range': grid_range, 'fields': 'userEnteredValue'}})
+        return self
+
+    def paste_rows(self, sheet_id: int, rows: Sequence[Sequence[Any]], row_index: int = 0, column_index: int = 0,
+                   paste_type: PasteType = PasteType.PASTE_VALUES) -> 'BatchUpdateRequests':
+        """
+        Values are parsed by sheets as they are entered by user, like USER_ENTERED option of values api
+        """
+        assert rows, 'Nothing to paste'
+
+        self.requests.append({
+            'pasteData': {
+                'coordinate': {'sheetId': sheet_id, 'rowIndex': row_index, 'columnIndex': column_index},
+                'data': '\n'.join(self.PASTE_DELIMITER.join(self._cell_text(value) for value in row) for row in rows),
+                'delimiter': self.PASTE_DELIMITER,
+                'type': paste_type.value
+            }
+        })
+        return self
+
+    @classmethod
+    def _cell_text(cls, value: Any) -> str:
+        if value is None:
+            return ''
+        # delimiters inside of value would split it to several cells or rows
+        return str(value).replace(cls.PASTE_DELIMITER, ' ').replace('\r', ' ').replace('\n', ' ')
+
+    def dict(self) -> dict[str, Any]:
+        return {'requests': self.requests}
@@ -1,36 +1,69 @@
+import random
+import time
 from logging import getLogger
 from typing import Any
 
-from google_api.connections import spreadsheets_service
+from config import GOOGLE_METADATA_TTL_SECONDS
+from db.connections import redis_client
+from google_api.connections import spreadsheets_service, service_account_ids
 from google_api.decorators import retry_with_backoff
+from google_api.rate_limiter import SheetsRateLimiter
+from google_api.spreadsheets.builders import BatchUpdateRequests
 from google_api.spreadsheets.types import BatchBody, UpdateBody, GSBody, Dimension
 
 
 class SpreadSheetClient:
     _service = None
 
-    def __init__(self, spreadsheet_id: str, api_version: str = 'v4'):
+    def __init__(self, spreadsheet_id: str, api_version: str = 'v4', metadata_ttl: int = GOOGLE_METADATA_TTL_SECONDS):
         self.logger = getLogger(self.__class__.__name__)
         self.spreadsheet_id = spreadsheet_id
         self.api_version = api_version
+        self.metadata_ttl = metadata_ttl
+        # properties of sheets by title: sheetId, title, gridProperties...
+        self._sheets_properties: dict[str, dict[str, Any]] = {}
+        self._metadata_loaded_at = None
         self.__auth()
+        self.rate_limiter = SheetsRateLimiter(redis_client, spreadsheet_id, *service_account_ids())
 
     def __auth(self) -> None:
         self._service = spreadsheets_service(self.api_version)
 
+    def _execute(self, request) -> dict[str, Any]:
+        # every request to api takes a token of rate limiter, retries of request too
+        self.rate_limiter.acquire()
+        return request.execute()
+
+    @retry_with_backoff
+    def _load_metadata(self) -> None:
+        result = self._execute(self._service.spreadsheets().get(spreadsheetId=self.spreadsheet_id,
+                                                                fields='sheets.properties'))
+        self._sheets_properties = {sheet['properties']['title']: sheet['properties']
+                                   for sheet in result.get('sheets', [])}
+        self._metadata_loaded_at = time.monotonic()
+
+    def _metadata(self, refresh: bool = False) -> dict[str, dict[str, Any]]:
+        """
+        Cached properties of sheets, our own changes of sheets are applied to cache without reading
+        """
+        if refresh or self._metadata_loaded_at is None or \
+                time.monotonic() - self._metadata_loaded_at > self.metadata_ttl:
+            self._load_metadata()
+        return self._sheets_properties
+
+    def invalidate_metadata(self) -> None:
+        self._metadata_loaded_at = None
+
     def sheet_exists(self, sheet_name: str):
-        sheet_metadata = self._service.spreadsheets().get(spreadsheetId=self.spreadsheet_id).execute()
-        sheets = sheet_metadata.get('sheets', [])
-        if not sheets:
-            return False
-        return sheet_name in [sheet.get('properties', {}).get('title') for sheet in sheets]
+        return sheet_name in self._metadata()
 
     def create_sheet_if_not_exists(self, sheet_name: str):
         if not self.sheet_exists(sheet_name):
-            self._service.spreadsheets().batchUpdate(
+            result = self._execute(self._service.spreadsheets().batchUpdate(
                 spreadsheetId=self.spreadsheet_id,
                 body={'requests': [{'addSheet': {'properties': {'title': sheet_name}}}]}
-            ).execute()
+            ))
+            self._sheets_properties[sheet_name] = result['replies'][0]['addSheet']['properties']
 
     def write_headers(self, sheet_name: str, values: list[str]):
         self.update_values(
@@ -41,12 +74,63 @@ class SpreadSheetClient:
 
     @retry_with_backoff
     def update_values(self, body: UpdateBody) -> dict[str, Any]:
-        return self._service.spreadsheets().values().update(spreadsheetId=self.spreadsheet_id, **body.dict()).execute()
+        return self._execute(self._service.spreadsheets().values().update(spreadsheetId=self.spreadsheet_id,
+                                                                          **body.dict()))
 
     @retry_with_backoff
     def batch_update_values(self, body: BatchBody) -> dict[str, Any]:
-        return self._service.spreadsheets().values().batchUpdate(spreadsheetId=self.spreadsheet_id,
-                                                                 body=body.dict()).execute()
+        return self._execute(self._service.spreadsheets().values().batchUpdate(spreadsheetId=self.spreadsheet_id,
+                                                                               body=body.dict()))
+
+    @retry_with_backoff
+    def batch_update(self, requests: BatchUpdateRequests) -> dict[str, Any]:
+        return self._execute(self._service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id,
+                                                                      body=requests.dict()))
+
+    def _new_sheet_id(self) -> int:
+        sheet_ids = {properties['sheetId'] for properties in self._metadata().values()}
+        while True:
+            sheet_id = random.randint(1, 2 ** 31 - 1)
+            if sheet_id not in sheet_ids:
+                return sheet_id
+
+    def rewrite_sheet(self, sheet_name: str, rows: list[list[Any]], min_columns: int = 26,
+                      spare_rows: int = 1000) -> dict[str, Any]:
+        """
+        Sheet is created if it does not exist, its values are cleared, grid is grown to fit rows
+        and rows are pasted from A1 by one batchUpdate
+        """
+        assert rows, 'Rows should contain at least headers'
+
+        columns_count = max(max(len(row) for row in rows), min_columns)
+        requests = BatchUpdateRequests()
+        sheet_properties = self._metadata().get(sheet_name)
+        if sheet_properties is None:
+            sheet_properties = {
+                'sheetId': self._new_sheet_id(),
+                'title': sheet_name,
+                'gridProperties': {'rowCount': len(rows) + spare_rows, 'columnCount': columns_count}
+            }
+            requests.add_sheet(sheet_name, sheet_properties['sheetId'], len(rows) + spare_rows, columns_count)
+        else:
+            grid_properties = sheet_properties.setdefault('gridProperties', {})
+            row_count, column_count = grid_properties.get('rowCount', 1000), grid_properties.get('columnCount', 26)
+            if len(rows) > row_count or columns_count > column_count:
+                grid_properties['rowCount'] = max(row_count, len(rows) + spare_rows)
+                grid_properties['columnCount'] = max(column_count, columns_count)
+                requests.resize_grid(sheet_properties['sheetId'], grid_properties['rowCount'],
+                                     grid_properties['columnCount'])
+            requests.clear_values(sheet_properties['sheetId'], last_column=columns_count - 1)
+
+        requests.paste_rows(sheet_properties['sheetId'], rows)
+        try:
+            result = self.batch_update(requests)
+        except Exception:
+            # sheet could be partially changed
+            self.invalidate_metadata()
+            raise
+        self._sheets_properties[sheet_name] = sheet_properties
+        return result
 
     @retry_with_backoff
     def clear_sheet(self, sheet_name: str, col_ranges: str = 'A:Z') -> dict[str, Any]:
@@ -54,42 +138,45 @@ class SpreadSheetClient:
 
         clear_range = f'{sheet_name}!{col_ranges.upper()}'
         self.logger.warning("Be careful, you've run a table range cleanup: " + clear_range)
-        return self._service.spreadsheets().values().batchClear(spreadsheetId=self.spreadsheet_id,
-                                                                body={'ranges': [clear_range]}).execute()
+        return self._execute(self._service.spreadsheets().values().batchClear(spreadsheetId=self.spreadsheet_id,
+                                                                              body={'ranges': [clear_range]}))
 
     @retry_with_backoff
     def get_sheet_data(self, sheet_name: str, col_ranges: str = 'A:Z',
                        major_dimension: Dimension = Dimension.DIMENSION_UNSPECIFIED) -> list[dict[str, Any]]:
         assert ':' in col_ranges
 
-        result = self._service.spreadsheets().values().get(
+        result = self._execute(self._service.spreadsheets().values().get(
             spreadsheetId=self.spreadsheet_id,
             range=f'{sheet_name}!{col_ranges.upper()}',
             majorDimension=major_dimension.value
-        ).execute()
+        ))
         return result.get('values')
 
-    @retry_with_backoff
     def get_sheet_meta(self, sheet_name: str) -> dict:
-        result = self._service.spreadsheets().get(spreadsheetId=self.spreadsheet_id, ranges=[sheet_name]).execute()
-        sheets_meta = result.get('sheets')
-        if not sheets_meta:
+        sheet_properties = self._metadata().get(sheet_name)
+        if sheet_properties is None:
+            # sheet could be added by someone else after metadata was cached
+            sheet_properties = self._metadata(refresh=True).get(sheet_name)
+        if sheet_properties is None:
             raise ValueError('Invalid sheet_name %s' % sheet_name)
-        return sheets_meta[0]['properties']
+        return sheet_properties
 
     @retry_with_backoff
     def add_new_rows(self, sheet_name: str, rows_num: int = 1000):
-        sheet_id = self.get_sheet_meta(sheet_name)['sheetId']
-        self._service.spreadsheets().batchUpdate(
+        sheet_properties = self.get_sheet_meta(sheet_name)
+        self._execute(self._service.spreadsheets().batchUpdate(
             spreadsheetId=self.spreadsheet_id,
             body={'requests': [
                 {
                     "appendDimension": {
-                        "sheetId": sheet_id, "dimension": "ROWS", "length": rows_num
+                        "sheetId": sheet_properties['sheetId'], "dimension": "ROWS", "length": rows_num
                     }
                 }
             ]}
-        ).execute()
+        ))
+        grid_properties = sheet_properties.setdefault('gridProperties', {})
+        grid_properties['rowCount'] = grid_properties.get('rowCount', 1000) + rows_num
 
 
 if __name__ == '__main__':
@@ -26,6 +26,12 @@ class DateTimeRenderOption(Enum):
     FORMATTED_STRING = 'FORMATTED_STRING'
 
 
+class PasteType(Enum):
+    # docs: https://developers.google.com/sheets/api/reference/rest/v4/spreadsheets/request#PasteType
+    PASTE_NORMAL = 'PASTE_NORMAL'
+    PASTE_VALUES = 'PASTE_VALUES'
+
+
 class Dimension(Enum):
     # docs: https://developers.google.com/sheets/api/reference/rest/v4/Dimension
     DIMENSION_UNSPECIFIED = 'DIMENSION_UNSPECIFIED'
@@ -1,8 +1,16 @@
+from dataclasses import asdict
+
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
-from config import API_KEYS
-from tasks import pair_launch
+from config import API_KEYS, EXCHANGE_EVENTS_LIST, BOOKMAKER_EVENTS_LIST, MATCHES_SAVE_LIST_NAME, SPREADSHEET_ID
+from db.connections import db, redis_client
+from managers.constants import RUN_QUEUED_LOCK_SECONDS
+from google_api.rate_limiter import SheetsRateLimiter
+from queues.streams import stream_lag
+from queues.transport import is_streams_transport
+from matching.types import Pair
+from tasks import pair_launch, run_registry
 
 
 app = FastAPI()
@@ -20,14 +28,50 @@ async def test():
     return {"status": "ok"}
 
 
+@app.get('/api/queues/lag/', dependencies=[Depends(api_key_auth)])
+async def queues_lag():
+    if not is_streams_transport():
+        return {redis_list: dict(length=redis_client.llen(redis_list))
+                for redis_list in (EXCHANGE_EVENTS_LIST, BOOKMAKER_EVENTS_LIST, MATCHES_SAVE_LIST_NAME)}
+
+    return {stream: stream_lag(redis_client, stream)
+            for stream in (EXCHANGE_EVENTS_LIST, BOOKMAKER_EVENTS_LIST, MATCHES_SAVE_LIST_NAME)}
+
+
+@app.get('/api/db/pool/', dependencies=[Depends(api_key_auth)])
+async def db_pool():
+    return db.pool_metrics()
+
+
+@app.get('/api/sheets/rate/', dependencies=[Depends(api_key_auth)])
+async def sheets_rate():
+    # requests, waited requests and wait seconds of sheets rate limiter of all workers
+    return SheetsRateLimiter.cluster_metrics(redis_client, SPREADSHEET_ID)
+
+
 @app.get("/api/scrapingPair/bet99-smarkets/{sheet_name}", dependencies=[Depends(api_key_auth)])
 async def scraping_bet99_smarkets(sheet_name: str):
-    # TODO: add the ability to check running tasks for this pair so as not to run a task with each request
-    pair_launch.delay(
-        sheet_name=sheet_name,
-        exchange='smarkets',
-        bookmaker='bet99',
-        save_from_redis=True
-    )
-    return {"status": "ok"}
+    # request for pair which is running attaches to the current run instead of launching another one
+    run, created = run_registry.start(Pair(exchange='smarkets', bookmaker='bet99'), sheet_name,
+                                      lock_seconds=RUN_QUEUED_LOCK_SECONDS)
+    if created:
+        # task is not started after the lock of queued run expires
+        pair_launch.apply_async(
+            kwargs=dict(
+                sheet_name=sheet_name,
+                exchange='smarkets',
+                bookmaker='bet99',
+                save_from_redis=True,
+                run_id=run.run_id
+            ),
+            expires=RUN_QUEUED_LOCK_SECONDS
+        )
+    return {"status": "ok", "run_id": run.run_id, "started_at": run.started_at, "attached": not created}
+
 
+@app.get("/api/runs/{run_id}", dependencies=[Depends(api_key_auth)])
+async def run_info(run_id: str):
+    run = run_registry.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Run not found")
+    return asdict(run)
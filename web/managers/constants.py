@@ -15,18 +15,65 @@ FIELDS = OrderedDict(
     Category=TableField(key='category')
 )
 
+LOCAL_MATCHING_MODE = 'local'
+CELERY_MATCHING_MODE = 'celery'
+STREAMING_MATCHING_MODE = 'streaming'
+
+DIFF_SHEETS_WRITE_MODE = 'diff'
+APPEND_SHEETS_WRITE_MODE = 'append'
+QUEUE_SHEETS_WRITE_MODE = 'queue'
+NOT_MATCHED_SHEET_NAME = 'Not matched events'
+# exchange and bookmaker events of the same name and bet are both on sheet of not matched events
+NOT_MATCHED_KEY_FIELDS = ('match_name', 'bet', 'exchange', 'bookmaker')
+
 BACK_WATCH_MINUTES = 10  # how many minutes ago you need to get saved matched events
 TASKS_WAIT_MINUTES = 3  # waiting time minutes for all tasks
 MATCHING_WAIT_SECONDS = 10
+MATCHING_SLOTS_TTL_SECONDS = 60 * 60  # slots of matching processes taken by crashed runs are freed after it
 RESULTS_WATCH_MINUTES = 3
 
+RUN_RUNNING_STATUS = 'running'
+RUN_FINISHED_STATUS = 'finished'
+RUN_FAILED_STATUS = 'failed'
+RUN_LOCK_SECONDS = 5 * 60  # lock of running pair run expires without heartbeat
+RUN_QUEUED_LOCK_SECONDS = 60 * 60  # lock of enqueued pair run, pair launch task expires after it in celery queue
+RUN_HEARTBEAT_SECONDS = 30
+RUN_INFO_TTL_SECONDS = 24 * 60 * 60  # how long run info is available by run id
+
 EXCHANGE_EVENTS_QUERY = """
     SELECT DISTINCT ON (first_team, second_team) 
         first_team, second_team, match_name, category, lay, exchange, bet FROM exchangeevent 
-        WHERE created_at >= '%s' AND created_at <= '%s' AND exchange = '%s'
+        WHERE created_at >= %s AND created_at <= %s AND exchange = %s
 """
 BOOKMAKER_EVENTS_QUERY = """
     SELECT DISTINCT ON (first_team, second_team) 
         first_team, second_team, match_name, category, odds, bookmaker, bet FROM bookmakerevent 
-        WHERE created_at >= '%s' AND created_at <= '%s' AND bookmaker = '%s'
+        WHERE created_at >= %s AND created_at <= %s AND bookmaker = %s
+"""
+# columns are in order of FIELDS, matched event of the run window is searched by match name with the same exchange
+# or bookmaker, DISTINCT ON leaves one row of match name
+NOT_MATCHED_EVENTS_QUERY = """
+    (SELECT DISTINCT ON (event.match_name)
+        %(matched_time)s, event.match_name, NULL, NULL, NULL, event.exchange, event.lay, event.category 
+        FROM exchangeevent event
+        WHERE event.created_at >= %(start_time)s AND event.created_at <= %(end_time)s 
+            AND event.exchange = %(exchange)s
+            AND NOT EXISTS (
+                SELECT 1 FROM matchesevent matches 
+                WHERE matches.exchange_match_name = event.match_name AND matches.exchange = event.exchange
+                    AND matches.created_at >= %(start_time)s AND matches.created_at <= %(end_time)s
+            )
+        ORDER BY event.match_name)
+    UNION ALL
+    (SELECT DISTINCT ON (event.match_name)
+        %(matched_time)s, event.match_name, NULL, event.bookmaker, event.odds, NULL, NULL, event.category 
+        FROM bookmakerevent event
+        WHERE event.created_at >= %(start_time)s AND event.created_at <= %(end_time)s 
+            AND event.bookmaker = %(bookmaker)s
+            AND NOT EXISTS (
+                SELECT 1 FROM matchesevent matches 
+                WHERE matches.bookmaker_match_name = event.match_name AND matches.bookmaker = event.bookmaker
+                    AND matches.created_at >= %(start_time)s AND matches.created_at <= %(end_time)s
+            )
+        ORDER BY event.match_name)
 """
@@ -1,20 +1,39 @@
+import json
 import logging
+import multiprocessing
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
+from typing import Iterator
 
-import numpy as np
 import pytz
-import pandas as pd
+from pandas import DataFrame
 from celery.app import task
-from psycopg2 import connect
 from scrapyd_api import ScrapydAPI
 
-from config import SCRAPYD_URL, SCRAPYD_USERNAME, SCRAPYD_PWD, LOG_LEVEL, LOG_FORMAT
-from db.connections import db, DB_PARAMS
-from db.models.event import BookmakerEvent, MatchesEvent, ExchangeEvent
+from config import (
+    SCRAPYD_URL, SCRAPYD_USERNAME, SCRAPYD_PWD, LOG_LEVEL, LOG_FORMAT, MATCHING_MODE, SHEETS_WRITE_MODE,
+    MATCHES_SAVE_LIST_NAME, STREAM_SAVING_WAIT_SECONDS
+)
+from db.connections import db, redis_client
+from db.loaders import iter_record_batches
+from db.operations import copy_rows_to_model
+from db.models.event import MatchesEvent
+from managers.slots import HostMatchingSlots
 from managers.constants import EXCHANGE_EVENTS_QUERY, BOOKMAKER_EVENTS_QUERY, RESULTS_WATCH_MINUTES, \
-    BACK_WATCH_MINUTES, MATCHING_WAIT_SECONDS, TASKS_WAIT_MINUTES, FIELDS
+    BACK_WATCH_MINUTES, MATCHING_WAIT_SECONDS, TASKS_WAIT_MINUTES, FIELDS, LOCAL_MATCHING_MODE, CELERY_MATCHING_MODE, \
+    STREAMING_MATCHING_MODE, NOT_MATCHED_EVENTS_QUERY, DIFF_SHEETS_WRITE_MODE, APPEND_SHEETS_WRITE_MODE, \
+    QUEUE_SHEETS_WRITE_MODE, NOT_MATCHED_SHEET_NAME, NOT_MATCHED_KEY_FIELDS
+from matching.snapshots import publish_snapshot
 from matching.types import Pair
+from matching.matchers import SimilarityExchangeMatcher
+from matching.workers import init_matching_worker, match_exchange_events_chunk, match_exchange_events
+from queues.drain import drain_list_to_model, wait_list_drained
+from queues.latch import CompletionLatch
+from queues.sheets import push_sheet_upsert
+from queues.streams import StreamConsumer
+from queues.transport import is_streams_transport
 
 from google_api.launchers import SpreadSheetWriter
 
@@ -23,7 +42,7 @@ class BaseSpidersLauncher:
     JOB_STATUS_LIMIT: int = 1
     SPIDERS_OVER_STATUSES = ('finished',)
 
-    def __init__(self, project_name: str = 'default'):
+    def __init__(self, project_name: str = 'default', stop_event: threading.Event = None):
         self.logger = logging.Logger(self.__class__.__name__)
         self.logger.setLevel(LOG_LEVEL)
         formatter = logging.Formatter(LOG_FORMAT)
@@ -32,12 +51,17 @@ class BaseSpidersLauncher:
         self.logger.addHandler(console_handler)
 
         self.project_name = project_name
+        self.stop_event = stop_event
         self.scrapyd = ScrapydAPI(SCRAPYD_URL, auth=(SCRAPYD_USERNAME, SCRAPYD_PWD))
 
     def wait_spider(self, job_id: str):
         status = None
 
         while status not in self.SPIDERS_OVER_STATUSES:
+            if self.stop_event is not None and self.stop_event.is_set():
+                self.logger.warning('Cancelling spider job %s' % job_id)
+                self.scrapyd.cancel(self.project_name, job_id)
+                return
             status = self.scrapyd.job_status(self.project_name, job_id)
             time.sleep(self.JOB_STATUS_LIMIT)
 
@@ -76,7 +100,8 @@ class MultySpidersLauncher(BaseSpidersLauncher):
 
 
 class PairSaverLauncher:
-    def __init__(self, start_time: datetime, end_time: datetime, sheet_name: str, pair: Pair, matching_task: task):
+    def __init__(self, start_time: datetime, end_time: datetime, sheet_name: str, pair: Pair, matching_task: task,
+                 matching_mode: str = MATCHING_MODE, sheets_write_mode: str = SHEETS_WRITE_MODE):
         self.logger = logging.Logger(self.__class__.__name__)
         self.logger.setLevel(LOG_LEVEL)
         formatter = logging.Formatter(LOG_FORMAT)
@@ -88,71 +113,191 @@ class PairSaverLauncher:
         self.pair = pair
         self.sheet_name = sheet_name
         self.matching_task = matching_task
-        self.spread_sheet_saver = SpreadSheetWriter(fields=FIELDS)
+        assert matching_mode in (LOCAL_MATCHING_MODE, CELERY_MATCHING_MODE, STREAMING_MATCHING_MODE), \
+            'Invalid matching mode %s' % matching_mode
+        self.matching_mode = matching_mode
+        assert sheets_write_mode in (DIFF_SHEETS_WRITE_MODE, APPEND_SHEETS_WRITE_MODE, QUEUE_SHEETS_WRITE_MODE), \
+            'Invalid sheets write mode %s' % sheets_write_mode
+        self.sheets_write_mode = sheets_write_mode
+        # with queue mode rows are written by the sheet writer, pair run only publishes them
+        self.spread_sheet_saver = SpreadSheetWriter(fields=FIELDS) \
+            if sheets_write_mode != QUEUE_SHEETS_WRITE_MODE else None
 
     def run(self) -> None:
         self.logger.info("Scraping time is %s" % (str(self.end_time - self.start_time)))
         self.logger.info('Start matching scraped results...')
 
-        with connect(**DB_PARAMS) as conn:
-            exchange_query = EXCHANGE_EVENTS_QUERY % (self.start_time, self.end_time, self.pair.exchange.value)
-            exc_df = pd.read_sql_query(exchange_query, conn).replace({np.nan: None})
+        if self.matching_mode == STREAMING_MATCHING_MODE:
+            # events were matched while spiders were running
+            self.write_results(disposable=True)
+        elif self.matching_mode == LOCAL_MATCHING_MODE:
+            self._run_local_matching(self._exchange_events_batches(), self._load_bookmaker_events())
+            self.write_results(disposable=True)
+        else:
+            bm_snapshot_key = publish_snapshot(redis_client, json.dumps(self._load_bookmaker_events()))
+            # run matching tasks, one task per batch of exchange events, finished task counts down the latch
+            latch = CompletionLatch(redis_client, count=0)
+            for exc_events_batch in self._exchange_events_batches():
+                self.matching_task.apply_async(args=(exc_events_batch, bm_snapshot_key, latch.key))
+                latch.count += 1
+
+            if self.sheets_write_mode == QUEUE_SHEETS_WRITE_MODE:
+                self._all_tasks_waited(latch)
+                self.write_results()
+            else:
+                self.write_results()
+                self._all_tasks_waited(latch)
 
-            bookmaker_query = BOOKMAKER_EVENTS_QUERY % (self.start_time, self.end_time, self.pair.bookmaker.value)
-            bm_df = pd.read_sql_query(bookmaker_query, conn).replace({np.nan: None})
-
-        bm_events_json = bm_df.to_json(orient='records')
-        # run matching tasks
-        tasks = [self.matching_task.apply_async(args=(exc_event_data, bm_events_json))
-                 for exc_event_data in exc_df.to_dict(orient='records')]
-
-        self.write_results()
-        self._all_tasks_waited(tasks)
         self._save_not_matched_events(self.start_time, self.end_time)
+        self.logger.info('DB pool: %s' % db.pool_metrics())
         self.logger.info('Over')
 
+    def _exchange_events_batches(self) -> Iterator[list[dict]]:
+        return iter_record_batches(EXCHANGE_EVENTS_QUERY, (self.start_time, self.end_time, self.pair.exchange.value))
+
+    def _load_bookmaker_events(self) -> list[dict]:
+        # every matcher needs all bookmaker events
+        return [bm_event
+                for bm_events_batch in iter_record_batches(BOOKMAKER_EVENTS_QUERY, (
+                    self.start_time, self.end_time, self.pair.bookmaker.value))
+                for bm_event in bm_events_batch]
+
+    def _run_local_matching(self, exc_events_batches: Iterator[list[dict]], bm_events: list[dict]) -> None:
+        # processes of celery prefork pool are daemonic and can't have children
+        if multiprocessing.current_process().daemon:
+            self.logger.warning('Matching in the task process, it can not start matching processes')
+            saved = self._match_in_process(exc_events_batches, bm_events)
+        else:
+            with HostMatchingSlots(redis_client).take() as workers:
+                if workers:
+                    saved = self._match_in_pool(exc_events_batches, bm_events, workers)
+                else:
+                    self.logger.warning('All matching processes of host are busy, matching in the task process')
+                    saved = self._match_in_process(exc_events_batches, bm_events)
+        self.logger.info('Saved matched events %s' % saved)
+
+    def _match_in_process(self, exc_events_batches: Iterator[list[dict]], bm_events: list[dict]) -> int:
+        matcher = SimilarityExchangeMatcher(bm_events_df=DataFrame(bm_events))
+        saved = 0
+        for exc_events_batch in exc_events_batches:
+            saved += self._copy_matches(match_exchange_events(matcher, exc_events_batch))
+        return saved
+
+    def _match_in_pool(self, exc_events_batches: Iterator[list[dict]], bm_events: list[dict], workers: int) -> int:
+        self.logger.info('Matching by %s processes...' % workers)
+        saved = 0
+        # spawned processes, forked ones would share the open postgres connection of loader
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_matching_worker, initargs=(bm_events,)) as executor:
+            in_flight = set()
+            for exc_events_batch in exc_events_batches:
+                in_flight.add(executor.submit(match_exchange_events_chunk, exc_events_batch))
+                # loading of the next batches waits for workers, so memory of launcher is bounded
+                if len(in_flight) >= workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    saved += self._save_matches(done)
+            saved += self._save_matches(wait(in_flight).done)
+        return saved
+
+    def _save_matches(self, done: set[Future]) -> int:
+        return self._copy_matches([matches_event for future in done for matches_event in future.result()])
+
+    @staticmethod
+    def _copy_matches(matches_events: list[dict]) -> int:
+        # every batch is committed, matches saved so far are kept if matching fails later
+        if matches_events:
+            with db:
+                copy_rows_to_model(MatchesEvent, matches_events)
+        return len(matches_events)
+
+    def _search_matches(self) -> list[dict]:
+        matches = []
+        with db:
+            for event in MatchesEvent.select().where(
+                    (MatchesEvent.created_at >= datetime.utcnow() - timedelta(minutes=BACK_WATCH_MINUTES)) &
+                    (MatchesEvent.exchange == self.pair.exchange.value) &
+                    (MatchesEvent.bookmaker == self.pair.bookmaker.value)
+            ).order_by(MatchesEvent.created_at.desc(), MatchesEvent.lay.asc(), MatchesEvent.odds.asc()):
+                teams = event.exchange_match_name.split(' vs ')
+                if len(teams) != 2:
+                    self.logger.error('Unpacked match name %s ' % event.exchange_match_name)
+                    continue
+
+                first_team, second_team = teams
+                matched_time = event.created_at.astimezone(pytz.timezone("Etc/GMT")).strftime('%Y-%m-%dT%H:%M:%S')
+
+                match = dict(
+                    bet=event.bet,
+                    first_team=first_team,
+                    second_team=second_team,
+                    matched_time=matched_time,
+                    match_name=event.exchange_match_name,
+                    category=event.category,
+                    bookmaker=event.bookmaker,
+                    odds=event.odds,
+                    exchange=event.exchange,
+                    lay=event.lay,
+                    similarity_ft=event.similarity_by_first_teams,
+                    similarity_st=event.similarity_by_second_teams,
+                    total_similarity=event.total_similarity
+                )
+                matches.append(match)
+        return matches
+
+    def _wait_matches_saved(self) -> None:
+        # matches of celery tasks and incremental matching are in redis until they are saved to MatchesEvent
+        self.logger.info('Saving matches from %s...' % MATCHES_SAVE_LIST_NAME)
+        if is_streams_transport():
+            StreamConsumer(redis_client, MATCHES_SAVE_LIST_NAME, MatchesEvent).wait_drained(STREAM_SAVING_WAIT_SECONDS)
+        else:
+            drain_list_to_model(redis_client, MATCHES_SAVE_LIST_NAME, MatchesEvent)
+            # batches popped by the matches consumer before the drain may be not committed yet
+            if not wait_list_drained(redis_client, MATCHES_SAVE_LIST_NAME, STREAM_SAVING_WAIT_SECONDS):
+                self.logger.warning('Matches of %s are still in flight, results may be partial'
+                                    % MATCHES_SAVE_LIST_NAME)
+
+    def publish_results(self) -> None:
+        """
+        Publishes matches to the sheet writer once, pair run does not wait for writing to spreadsheet.
+        Every run replaces rows of the previous run, so its upsert is a reset which the writer sends as one
+        batchUpdate rewrite; changed cells of the diff path are written for upserts without reset only
+        """
+        if self.matching_mode != LOCAL_MATCHING_MODE:
+            self._wait_matches_saved()
+
+        matches = self._search_matches()
+        if matches:
+            # the first write of run rewrites the sheet, like reset of diff mode
+            push_sheet_upsert(redis_client, self.sheet_name, matches, reset=True)
+        self.logger.info('Published events %s to sheet writer' % len(matches))
+
     def write_results(self, disposable: bool = False) -> None:
+        if self.sheets_write_mode == QUEUE_SHEETS_WRITE_MODE:
+            self.publish_results()
+            return
+
         last_sheet_row = 0
         first_writing = True
-        match_events, handled_match_names = [], set()
+        handled_match_names = set()
         over_time = datetime.utcnow() + timedelta(minutes=RESULTS_WATCH_MINUTES if disposable is False else 1)
 
         while datetime.utcnow() < over_time:
             self.logger.info('search events for write to spreadsheet...')
-            with db:
-                for event in MatchesEvent.select().where(
-                        (MatchesEvent.created_at >= datetime.utcnow() - timedelta(minutes=BACK_WATCH_MINUTES)) &
-                        (MatchesEvent.exchange == self.pair.exchange.value) &
-                        (MatchesEvent.bookmaker == self.pair.bookmaker.value)
-                ).order_by(MatchesEvent.created_at.desc(), MatchesEvent.lay.asc(), MatchesEvent.odds.asc()):
-                    if event.exchange_match_name in handled_match_names:
-                        continue
-
-                    teams = event.exchange_match_name.split(' vs ')
-                    if len(teams) != 2:
-                        self.logger.error('Unpacked match name %s ' % event.exchange_match_name)
-                        continue
-
-                    first_team, second_team = teams
-                    matched_time = event.created_at.astimezone(pytz.timezone("Etc/GMT")).strftime('%Y-%m-%dT%H:%M:%S')
-
-                    match = dict(
-                        bet=event.bet,
-                        first_team=first_team,
-                        second_team=second_team,
-                        matched_time=matched_time,
-                        match_name=event.exchange_match_name,
-                        category=event.category,
-                        bookmaker=event.bookmaker,
-                        odds=event.odds,
-                        exchange=event.exchange,
-                        lay=event.lay,
-                        similarity_ft=event.similarity_by_first_teams,
-                        similarity_st=event.similarity_by_second_teams,
-                        total_similarity=event.total_similarity
-                    )
-                    match_events.append(match)
-                    handled_match_names.add(event.exchange_match_name)
+            matches = self._search_matches()
+
+            if matches and self.sheets_write_mode == DIFF_SHEETS_WRITE_MODE:
+                # the newest match of every match name and bet, only changed cells and new rows are sent
+                written = self.spread_sheet_saver.upsert_to_sheet(sheet_name=self.sheet_name, data=matches,
+                                                                  reset=first_writing)
+                first_writing = False
+                self.logger.info('Successfully written events %s' % written)
+
+            match_events = []
+            if self.sheets_write_mode == APPEND_SHEETS_WRITE_MODE:
+                for match in matches:
+                    if match['match_name'] not in handled_match_names:
+                        match_events.append(match)
+                        handled_match_names.add(match['match_name'])
 
             if match_events:
                 founded_events_count = len(match_events)
@@ -174,89 +319,43 @@ class PairSaverLauncher:
                     last_sheet_row += founded_events_count
 
                 self.logger.info('Successfully added events %s' % founded_events_count)
-                match_events.clear()
 
             self.logger.info('waiting %s seconds...' % MATCHING_WAIT_SECONDS)
             time.sleep(MATCHING_WAIT_SECONDS)
 
-    def _all_tasks_waited(self, tasks) -> bool:
-        if not tasks:
+    def _all_tasks_waited(self, latch: CompletionLatch) -> bool:
+        if not latch.count:
             return False
 
         self.logger.info('Waiting all started tasks...')
-        over_time = datetime.utcnow() + timedelta(minutes=TASKS_WAIT_MINUTES)
-
-        waited = False
         start_time = time.time()
-        # waiting all tasks completing
-        while tasks:
-            if datetime.utcnow() >= over_time:
-                passed_time = time.time() - start_time
-                self.logger.debug('Over time! %s seconds have passed' % passed_time)
-                break
-
-            for matching_task in tasks:
-                if matching_task.state in ('SUCCESS', 'FAILURE', 'RETRY'):
-                    tasks.remove(matching_task)
-
-        if not tasks:
-            waited = True
+        # blocking on one completion signal instead of polling state of every task
+        waited = latch.wait(timeout_seconds=TASKS_WAIT_MINUTES * 60)
+        if not waited:
+            self.logger.debug('Over time! %s seconds have passed' % (time.time() - start_time))
 
         self.logger.info('Over waiting tasks')
         return waited
 
     def _save_not_matched_events(self, start_time: datetime, end_time: datetime) -> None:
         self.logger.info('Start searching not matched events..')
-        not_matched_data = []
-        with db:
-            exc_not_matches_query = ExchangeEvent.not_matches_query(
-                exchange=str(self.pair.exchange.value),
+        with db.raw_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(NOT_MATCHED_EVENTS_QUERY, dict(
+                matched_time=datetime.utcnow(),
                 start_time=start_time,
                 end_time=end_time,
-            ).where(
-                ExchangeEvent.match_name.not_in(MatchesEvent.select(MatchesEvent.exchange_match_name)
-                                                .where((MatchesEvent.created_at >= start_time) &
-                                                       (MatchesEvent.created_at <= end_time)))
-            )
-            bm_not_matches_query = BookmakerEvent.not_matches_query(
-                bookmaker=str(self.pair.bookmaker.value),
-                start_time=start_time,
-                end_time=end_time
-            ).where(
-                BookmakerEvent.match_name.not_in(
-                    MatchesEvent.select(MatchesEvent.bookmaker_match_name)
-                    .where((MatchesEvent.created_at >= start_time) &
-                           (MatchesEvent.created_at <= end_time))
-                )
-            )
-            not_matched_data.extend(self._get_not_matches_list(exc_not_matches_query))
-            not_matched_data.extend(self._get_not_matches_list(bm_not_matches_query))
-
-        if not_matched_data:
-            self.logger.info('Trying save not matched events %s...' % len(not_matched_data))
-            self.spread_sheet_saver.rewrite_to_sheet(sheet_name='Not matched events', data=not_matched_data)
-
-    @staticmethod
-    def _get_not_matches_list(events) -> list[dict[str, str | datetime | float]]:
-        send_matches = []
-        not_matches = []
-
-        for event in events:
-            if event.match_name in send_matches:
-                continue
-
-            event_data = dict(
-                first_team=event.first_team,
-                secont_team=event.second_team,
-                matched_time=datetime.utcnow(),
-                match_name=event.match_name,
-                category=event.category
-            )
-            if isinstance(event, ExchangeEvent):
-                event_data |= dict(exchange=event.exchange, lay=event.lay)
-            elif isinstance(event, BookmakerEvent):
-                event_data |= dict(bookmaker=event.bookmaker, odds=event.odds)
-
-            send_matches.append(event.match_name)
-            not_matches.append(event_data)
-        return not_matches
+                exchange=self.pair.exchange.value,
+                bookmaker=self.pair.bookmaker.value
+            ))
+            not_matched_rows = cursor.fetchall()
+
+        if not not_matched_rows:
+            return
+
+        self.logger.info('Trying save not matched events %s...' % len(not_matched_rows))
+        if self.sheets_write_mode == QUEUE_SHEETS_WRITE_MODE:
+            fields_keys = [field.key for field in FIELDS.values()]
+            rows = [dict(zip(fields_keys, row)) for row in not_matched_rows]
+            push_sheet_upsert(redis_client, NOT_MATCHED_SHEET_NAME, rows, reset=True, key_fields=NOT_MATCHED_KEY_FIELDS)
+        else:
+            self.spread_sheet_saver.rewrite_to_sheet(sheet_name=NOT_MATCHED_SHEET_NAME, data=not_matched_rows)
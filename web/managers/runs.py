@@ -0,0 +1,163 @@
+import json
+import threading
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict
+from datetime import datetime
+
+from redis import Redis
+
+from managers.constants import RUN_RUNNING_STATUS, RUN_FINISHED_STATUS, RUN_FAILED_STATUS, RUN_LOCK_SECONDS, \
+    RUN_HEARTBEAT_SECONDS, RUN_INFO_TTL_SECONDS
+from managers.types import PairRun
+from matching.types import Pair
+
+
+# extends or deletes (ttl 0) the lock only if it is held by the run
+RUN_LOCK_SCRIPT = """
+local value = redis.call('get', KEYS[1])
+if value and cjson.decode(value)['run_id'] == ARGV[1] then
+    if ARGV[2] == '0' then
+        return redis.call('del', KEYS[1])
+    end
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# takes the lock for the run if it is free, returns 1 when the lock is held by the run
+RUN_CLAIM_SCRIPT = """
+local value = redis.call('get', KEYS[1])
+if not value then
+    redis.call('set', KEYS[1], ARGV[3], 'ex', ARGV[2])
+    return 1
+end
+if cjson.decode(value)['run_id'] == ARGV[1] then
+    redis.call('expire', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+class RunLockLost(Exception):
+    pass
+
+
+class RunLease:
+    """
+    Lock of run held by heartbeat, lost is set when the lock expired or was taken by another run
+    """
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.lost = threading.Event()
+
+    def check(self) -> None:
+        if self.lost.is_set():
+            raise RunLockLost('Lock of run %s is lost' % self.run_id)
+
+
+class PairRunRegistry:
+    """
+    Registry of pair runs in redis: a lock per pair holds the current run (id, start time, sheet), it expires
+    without heartbeat of running task. Run info stays available by run id after the run is over
+    """
+    LOCK_KEY_PREFIX = 'pair_run_lock'
+    INFO_KEY_PREFIX = 'pair_run'
+
+    def __init__(self, redis_client: Redis, lock_seconds: int = RUN_LOCK_SECONDS,
+                 heartbeat_seconds: int = RUN_HEARTBEAT_SECONDS):
+        self.redis_client = redis_client
+        self.lock_seconds = lock_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self._lock_script = redis_client.register_script(RUN_LOCK_SCRIPT)
+        self._claim_script = redis_client.register_script(RUN_CLAIM_SCRIPT)
+
+    def lock_key(self, pair: Pair) -> str:
+        return f'{self.LOCK_KEY_PREFIX}:{pair.exchange.value}:{pair.bookmaker.value}'
+
+    def info_key(self, run_id: str) -> str:
+        return f'{self.INFO_KEY_PREFIX}:{run_id}'
+
+    def current(self, pair: Pair) -> PairRun | None:
+        value = self.redis_client.get(self.lock_key(pair))
+        return PairRun(**json.loads(value)) if value is not None else None
+
+    def get(self, run_id: str) -> PairRun | None:
+        value = self.redis_client.get(self.info_key(run_id))
+        return PairRun(**json.loads(value)) if value is not None else None
+
+    def _save_info(self, run: PairRun) -> None:
+        self.redis_client.set(self.info_key(run.run_id), json.dumps(asdict(run)), ex=RUN_INFO_TTL_SECONDS)
+
+    def start(self, pair: Pair, sheet_name: str, lock_seconds: int = None) -> tuple[PairRun, bool]:
+        """
+        Returns the new run and True, or the in-flight run of pair and False.
+        Run which waits in celery queue takes the lock for lock_seconds of queue waiting
+        """
+        run = PairRun(
+            run_id=uuid.uuid4().hex,
+            exchange=pair.exchange.value,
+            bookmaker=pair.bookmaker.value,
+            sheet_name=sheet_name,
+            started_at=datetime.utcnow().isoformat(),
+            status=RUN_RUNNING_STATUS
+        )
+        while True:
+            if self.redis_client.set(self.lock_key(pair), json.dumps(asdict(run)), nx=True,
+                                   ex=lock_seconds or self.lock_seconds):
+                self._save_info(run)
+                return run, True
+
+            current = self.current(pair)
+            if current is not None:
+                return current, False
+            # lock expired between SET NX and GET
+
+    def claim(self, pair: Pair, run_id: str) -> bool:
+        """
+        Called by task of run on start: the run keeps its lock or takes it again if the lock expired
+        while the task was waiting in queue. False if another run holds the lock
+        """
+        run = self.get(run_id)
+        if run is None:
+            return False
+        return bool(self._claim_script(keys=[self.lock_key(pair)], args=[run_id, self.lock_seconds,
+                                                                         json.dumps(asdict(run))]))
+
+    def extend(self, pair: Pair, run_id: str) -> bool:
+        return bool(self._lock_script(keys=[self.lock_key(pair)], args=[run_id, self.lock_seconds]))
+
+    def finish(self, pair: Pair, run_id: str, failed: bool = False) -> None:
+        run = self.get(run_id)
+        if run is not None:
+            run.status = RUN_FAILED_STATUS if failed else RUN_FINISHED_STATUS
+            run.finished_at = datetime.utcnow().isoformat()
+            self._save_info(run)
+        self._lock_script(keys=[self.lock_key(pair)], args=[run_id, 0])
+
+    @contextmanager
+    def heartbeat(self, pair: Pair, run_id: str):
+        """
+        Extends the lock while the block is running and finishes the run after it.
+        Yields lease of run, the block has to stop by lease.check() when the lock is lost
+        """
+        stopped = threading.Event()
+        lease = RunLease(run_id)
+
+        def beat():
+            while not stopped.wait(self.heartbeat_seconds):
+                if not self.extend(pair, run_id):
+                    lease.lost.set()
+                    return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        failed = True
+        try:
+            yield lease
+            failed = False
+        finally:
+            stopped.set()
+            thread.join()
+            self.finish(pair, run_id, failed=failed)
@@ -0,0 +1,56 @@
+import socket
+from contextlib import contextmanager
+
+from redis import Redis
+
+from config import MATCHING_WORKERS
+from managers.constants import MATCHING_SLOTS_TTL_SECONDS
+
+
+# takes up to the requested count of free slots, returns the taken count
+TAKE_SLOTS_SCRIPT = """
+local used = tonumber(redis.call('get', KEYS[1]) or '0')
+local taken = math.max(0, math.min(tonumber(ARGV[1]) - used, tonumber(ARGV[2])))
+if taken > 0 then
+    redis.call('incrby', KEYS[1], taken)
+    redis.call('expire', KEYS[1], ARGV[3])
+end
+return taken
+"""
+
+RELEASE_SLOTS_SCRIPT = """
+if redis.call('decrby', KEYS[1], ARGV[1]) <= 0 then
+    redis.call('del', KEYS[1])
+end
+return 1
+"""
+
+
+class HostMatchingSlots:
+    """
+    Count of matching processes of host shared by pair runs of all workers of host,
+    so local matching of concurrent runs does not start more than slots_count processes
+    """
+    KEY_PREFIX = 'matching_slots'
+
+    def __init__(self, redis_client: Redis, slots_count: int = MATCHING_WORKERS,
+                 ttl_seconds: int = MATCHING_SLOTS_TTL_SECONDS):
+        self.redis_client = redis_client
+        self.slots_count = slots_count
+        self.ttl_seconds = ttl_seconds
+        self.key = f'{self.KEY_PREFIX}:{socket.gethostname()}'
+        self._take_script = redis_client.register_script(TAKE_SLOTS_SCRIPT)
+        self._release_script = redis_client.register_script(RELEASE_SLOTS_SCRIPT)
+
+    @contextmanager
+    def take(self, count: int = None):
+        """
+        Yields count of taken slots, it is 0 when all slots of host are taken
+        """
+        taken = int(self._take_script(keys=[self.key], args=[self.slots_count, count or self.slots_count,
+                                                             self.ttl_seconds]))
+        try:
+            yield taken
+        finally:
+            if taken:
+                self._release_script(keys=[self.key], args=[taken])
@@ -8,3 +8,14 @@ class TableField:
     key: str
     validator: Callable = None
     default_value: Any = ''
+
+
+@dataclass
+class PairRun:
+    run_id: str
+    exchange: str
+    bookmaker: str
+    sheet_name: str
+    started_at: str
+    status: str
+    finished_at: str | None = None
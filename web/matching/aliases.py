@@ -0,0 +1,172 @@
+import json
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+
+from redis import Redis
+
+from config import ALIASES_TTL_DAYS, ALIASES_NEGATIVE_TTL_HOURS, ALIASES_REDIS_TTL_SECONDS, \
+    ALIASES_MAX_NEGATIVE_ENTRIES
+from db.connections import db
+from db.models.alias import TeamAlias
+
+
+@dataclass
+class TeamAliases:
+    """
+    Aliases of normalized team names loaded once for matching, new decisions of matcher are collected to new_entries.
+    Events without category are kept under empty category
+    """
+    accepted: dict[tuple[str, str], tuple[str, float]] = field(default_factory=dict)
+    rejected: dict[tuple[str, str, str], float] = field(default_factory=dict)
+    new_entries: dict[tuple[str, str, str], tuple[float, bool]] = field(default_factory=dict)
+
+    def get_alias(self, category: str | None, exchange_team: str) -> tuple[str, float] | None:
+        return self.accepted.get((category or '', exchange_team))
+
+    def get_rejected_similarity(self, category: str | None, exchange_team: str, bookmaker_team: str) -> float | None:
+        return self.rejected.get((category or '', exchange_team, bookmaker_team))
+
+    def accept(self, category: str | None, exchange_team: str, bookmaker_team: str, similarity: float) -> None:
+        category = category or ''
+        self.accepted[(category, exchange_team)] = (bookmaker_team, similarity)
+        self.new_entries[(category, exchange_team, bookmaker_team)] = (similarity, True)
+
+    def reject(self, category: str | None, exchange_team: str, bookmaker_team: str, similarity: float) -> None:
+        category = category or ''
+        self.rejected[(category, exchange_team, bookmaker_team)] = similarity
+        self.new_entries[(category, exchange_team, bookmaker_team)] = (similarity, False)
+
+
+class TeamAliasCache:
+    """
+    Read-through cache of TeamAlias table: rows of category are kept in redis hash for redis_ttl seconds
+    and saved rows update only their fields of it. Accepted aliases age out after ttl_days
+    and pairs known not to match after negative_ttl_hours, stale rows are deleted by prune
+    """
+    KEY_PREFIX = 'team_aliases'
+    LOADED_FIELD = '__loaded__'  # hash without it was created by save after expiration, it is loaded again
+
+    def __init__(
+        self,
+        redis_client: Redis,
+        ttl_days: int = ALIASES_TTL_DAYS,
+        negative_ttl_hours: int = ALIASES_NEGATIVE_TTL_HOURS,
+        redis_ttl: int = ALIASES_REDIS_TTL_SECONDS,
+        max_negative_entries: int = ALIASES_MAX_NEGATIVE_ENTRIES
+    ):
+        self.redis_client = redis_client
+        self.ttl = timedelta(days=ttl_days)
+        self.negative_ttl = timedelta(hours=negative_ttl_hours)
+        self.redis_ttl = redis_ttl
+        self.max_negative_entries = max_negative_entries
+
+    def _key(self, category: str) -> str:
+        return f'{self.KEY_PREFIX}:{category}'
+
+    @staticmethod
+    def _field(exchange_team: str, bookmaker_team: str) -> str:
+        return json.dumps([exchange_team, bookmaker_team])
+
+    def _is_stale(self, is_match: bool, updated_at: float, now: datetime) -> bool:
+        return datetime.utcfromtimestamp(updated_at) < now - (self.ttl if is_match else self.negative_ttl)
+
+    def _load_category_rows(self, category: str) -> list[list]:
+        """
+        Not stale rows of category [exchange team, bookmaker team, similarity, is match] ordered by updated_at
+        """
+        now = datetime.utcnow()
+        cached = self.redis_client.hgetall(self._key(category))
+        if cached.pop(self.LOADED_FIELD.encode(), None) is not None:
+            rows = []
+            for field_name, value in cached.items():
+                similarity, is_match, updated_at = json.loads(value)
+                if not self._is_stale(is_match, updated_at, now):
+                    rows.append([*json.loads(field_name), similarity, is_match, updated_at])
+            return [row[:4] for row in sorted(rows, key=lambda row: row[4])]
+
+        with db:
+            aliases = list(TeamAlias.select().where((TeamAlias.category == category) & self._not_stale_condition(now))
+                           .order_by(TeamAlias.updated_at.asc()))
+
+        mapping = {self.LOADED_FIELD: 1}
+        for alias in aliases:
+            mapping[self._field(alias.exchange_team, alias.bookmaker_team)] = json.dumps(
+                [alias.similarity, alias.is_match, alias.updated_at.replace(tzinfo=timezone.utc).timestamp()])
+
+        pipeline = self.redis_client.pipeline(transaction=True)
+        pipeline.hset(self._key(category), mapping=mapping)
+        pipeline.expire(self._key(category), self.redis_ttl)
+        pipeline.execute()
+        return [[alias.exchange_team, alias.bookmaker_team, alias.similarity, alias.is_match] for alias in aliases]
+
+    def _not_stale_condition(self, now: datetime):
+        return (
+            (TeamAlias.is_match & (TeamAlias.updated_at >= now - self.ttl)) |
+            (~TeamAlias.is_match & (TeamAlias.updated_at >= now - self.negative_ttl))
+        )
+
+    def load(self, categories: Iterable[str | None]) -> TeamAliases:
+        aliases = TeamAliases()
+        for category in {category or '' for category in categories}:
+            # ordered by updated_at, so the latest accepted pairing of exchange team wins
+            for exchange_team, bookmaker_team, similarity, is_match in self._load_category_rows(category):
+                if is_match:
+                    aliases.accepted[(category, exchange_team)] = (bookmaker_team, similarity)
+                else:
+                    aliases.rejected[(category, exchange_team, bookmaker_team)] = similarity
+        return aliases
+
+    def _entries_to_save(self, aliases: TeamAliases) -> dict[tuple[str, str, str], tuple[float, bool]]:
+        """
+        Pairs known not to match are needed only for exchange teams without alias, fuzzy matching is skipped
+        for teams with alias, they are bounded by max_negative_entries
+        """
+        entries, negative_entries = {}, 0
+        for (category, exchange_team, bookmaker_team), (similarity, is_match) in aliases.new_entries.items():
+            if not is_match:
+                if (category, exchange_team) in aliases.accepted or negative_entries >= self.max_negative_entries:
+                    continue
+                negative_entries += 1
+            entries[(category, exchange_team, bookmaker_team)] = (similarity, is_match)
+        return entries
+
+    def save(self, aliases: TeamAliases) -> int:
+        entries = self._entries_to_save(aliases)
+        aliases.new_entries.clear()
+        if not entries:
+            return 0
+
+        now = datetime.utcnow()
+        rows = [
+            dict(category=category, exchange_team=exchange_team, bookmaker_team=bookmaker_team,
+                 similarity=similarity, is_match=is_match, updated_at=now)
+            for (category, exchange_team, bookmaker_team), (similarity, is_match) in entries.items()
+        ]
+        with db.atomic():
+            TeamAlias.insert_many(rows).on_conflict(
+                conflict_target=[TeamAlias.category, TeamAlias.exchange_team, TeamAlias.bookmaker_team],
+                preserve=[TeamAlias.similarity, TeamAlias.is_match, TeamAlias.updated_at]
+            ).execute()
+
+        # only saved fields of cached categories are updated, other rows stay cached
+        updated_at = now.replace(tzinfo=timezone.utc).timestamp()
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for row in rows:
+            pipeline.hset(self._key(row['category']), self._field(row['exchange_team'], row['bookmaker_team']),
+                          json.dumps([row['similarity'], row['is_match'], updated_at]))
+        for category in {row['category'] for row in rows}:
+            pipeline.expire(self._key(category), self.redis_ttl)
+        pipeline.execute()
+        return len(rows)
+
+    def prune(self) -> int:
+        """
+        Deletes stale rows of table, called by beat task, stale rows in redis are skipped by load
+        """
+        now = datetime.utcnow()
+        with db.atomic():
+            deleted = TeamAlias.delete().where(TeamAlias.is_match & (TeamAlias.updated_at < now - self.ttl)).execute()
+            deleted += TeamAlias.delete().where(
+                ~TeamAlias.is_match & (TeamAlias.updated_at < now - self.negative_ttl)).execute()
+        return deleted
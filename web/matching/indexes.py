@@ -0,0 +1,149 @@
+from array import array
+from collections import defaultdict, Counter
+from typing import Any, Callable
+
+import numpy as np
+
+
+def char_ngrams(team_name: str, ngram_size: int = 3) -> set[str]:
+    # padding by spaces to keep short names and word edges in signatures
+    padded = ' %s ' % team_name
+    if len(padded) <= ngram_size:
+        return {padded}
+    return {padded[i:i + ngram_size] for i in range(len(padded) - ngram_size + 1)}
+
+
+EMPTY_NAME_TOKEN = ('', 0)
+
+
+def char_tokens(team_name: str) -> set[tuple[str, int]]:
+    """
+    Multiset of characters of name as set of (character, occurrence number) tokens,
+    so common tokens of two names are their common characters
+    """
+    if not team_name:
+        return {EMPTY_NAME_TOKEN}
+
+    occurrences = Counter()
+    tokens = set()
+    for char in team_name:
+        occurrences[char] += 1
+        tokens.add((char, occurrences[char]))
+    return tokens
+
+
+class BlockingIndex:
+    """
+    Inverted index of events by (is draw, team position, character token of team name), built once per run.
+    Candidates of exchange event are found by count filter: common tokens of every team are counted by postings
+    of tokens of exchange event teams, quick ratio of every team (2 * common tokens / sum of lengths) must be
+    >= min_similarity and sum of them >= min_total_similarity (it includes length filter of names,
+    quick ratio is at most 2 * min / sum of lengths).
+    Filter is lossless, quick ratio is the upper bound of sequence ratio, so matches are the same as by the full scan,
+    and only events which can pass minimal similarities are scored
+    """
+
+    def __init__(
+        self,
+        events: list[dict[str, Any]],
+        first_team_field: str = 'first_team',
+        second_team_field: str = 'second_team',
+        normalize: Callable[[str], str] = str.casefold,
+        min_similarity: float = 0.5,
+        min_total_similarity: float = None
+    ):
+        """
+        normalize is applied to team names of events and of exchange events in candidates,
+        pass None if names in team fields are normalized already, they are compared as is by sequence ratio.
+        min_similarity is the minimal sequence ratio of both teams of candidates,
+        min_total_similarity is the minimal sum of them
+        """
+        assert 0 < min_similarity <= 1, 'Invalid min_similarity %s' % min_similarity
+
+        self.events = events
+        self.first_team_field = first_team_field
+        self.second_team_field = second_team_field
+        self.normalize = normalize
+        self.min_similarity = min_similarity
+        self.min_total_similarity = min_total_similarity
+
+        self._groups = set()
+        # postings are appendable arrays, counted by numpy without copying
+        self._postings = defaultdict(lambda: array('q'))
+        self._lengths = (array('q'), array('q'))  # lengths of team names by position, 0 for not indexed events
+        for position in range(len(self.events)):
+            self.index_event(position)
+
+    @staticmethod
+    def is_draw(bet: str) -> bool:
+        return bet.lower() == 'draw'
+
+    def team_tokens(self, team_name: str) -> tuple[set[tuple[str, int]], int]:
+        """
+        Tokens of normalized team name and length of name
+        """
+        if self.normalize is not None:
+            team_name = ' '.join(self.normalize(team_name).split())
+        return char_tokens(team_name), len(team_name)
+
+    def index_event(self, position: int) -> None:
+        """
+        Adds event by position of events list to postings, must be called for events appended to the list
+        after build, in order of positions
+        """
+        for lengths in self._lengths:
+            lengths.extend([0] * (position + 1 - len(lengths)))
+
+        event = self.events[position]
+        first_team, second_team = event.get(self.first_team_field), event.get(self.second_team_field)
+        bet = event.get('bet')
+        if not all(isinstance(value, str) for value in (first_team, second_team, bet)):
+            return
+
+        group = (self.is_draw(bet),)
+        self._groups.add(group)
+
+        for team_position, team_name in enumerate((first_team, second_team)):
+            tokens, self._lengths[team_position][position] = self.team_tokens(team_name)
+            for token in tokens:
+                self._postings[group + (team_position, token)].append(position)
+
+    def _common_tokens(self, group: tuple, team_position: int, tokens: set[tuple[str, int]]) -> np.ndarray:
+        postings = [np.frombuffer(self._postings[key], dtype=np.int64)
+                    for key in (group + (team_position, token) for token in tokens) if key in self._postings]
+        size = len(self._lengths[team_position])
+        if not postings:
+            return np.zeros(size, dtype=np.int64)
+        return np.bincount(np.concatenate(postings), minlength=size)
+
+    def candidate_positions(self, bet: str, first_team: str, second_team: str) -> list[int]:
+        """
+        Positions of events of the same draw flag which pass count filter by both teams.
+        Other events have sequence ratios of teams below minimal similarities, so the full scan never matches them
+        """
+        group = (self.is_draw(bet),)
+        if group not in self._groups:
+            return []
+
+        teams = (self.team_tokens(first_team), self.team_tokens(second_team))
+        common = [self._common_tokens(group, team_position, tokens)
+                  for team_position, (tokens, _) in enumerate(teams)]
+        # events of other groups and not indexed ones have no common tokens
+        positions = np.flatnonzero((common[0] > 0) & (common[1] > 0))
+
+        total_similarity = np.zeros(len(positions))
+        passed = np.ones(len(positions), dtype=bool)
+        for team_position, (_, length) in enumerate(teams):
+            lengths = np.frombuffer(self._lengths[team_position], dtype=np.int64)[positions] + length
+            # names are empty on both sides, quick ratio is 1.0
+            similarity = np.where(lengths > 0, 2.0 * common[team_position][positions] / np.maximum(lengths, 1), 1.0)
+            passed &= similarity >= self.min_similarity
+            total_similarity += similarity
+
+        if self.min_total_similarity is not None:
+            passed &= total_similarity >= self.min_total_similarity
+        # keeping original order, so ties are resolved like in the full scan
+        return positions[passed].tolist()
+
+    def candidates(self, bet: str, first_team: str, second_team: str) -> list[dict[str, Any]]:
+        return [self.events[position] for position in self.candidate_positions(bet, first_team, second_team)]
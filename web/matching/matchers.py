@@ -1,28 +1,56 @@
 import logging
-from typing import Any
+from collections import Counter
+from typing import Any, Iterable, Iterator
 
 from cdifflib import CSequenceMatcher
 from pandas import DataFrame, np
 
-from config import LOG_FORMAT
+from config import LOG_FORMAT, MATCHING_SCORER, TFIDF_SAME_CATEGORY
+from matching.aliases import TeamAliases
+from matching.indexes import BlockingIndex
+from matching.normalizers import normalize_team_name, add_normalized_keys, FIRST_TEAM_KEY, SECOND_TEAM_KEY
+from matching.scorers import TfidfCandidatesSearcher, SCORERS, TFIDF_SCORER, SEQUENCE_SCORER, sparse
 
 
 class SimilarityExchangeMatcher:
     WORDS_TO_REMOVE = ("FC", "City", "United", "(Res)", "Deportivo", "Town", "Atletico")
+    # stages of team pairs pruning, ratio counts pairs with computed full sequence ratio
+    LENGTH_STAGE, QUICK_RATIO_STAGE, RATIO_STAGE = 'length', 'quick_ratio', 'ratio'
 
     def __init__(
         self,
         bm_events_df: DataFrame,
-        exchange_data: dict[str, Any],
+        exchange_data: dict[str, Any] = None,
         total_min_similarity: float = 1.4,
         teams_min_similarity: float = 0.5,
-        words_to_remove: list[str] = None
+        words_to_remove: list[str] = None,
+        use_blocking: bool = True,
+        aliases: TeamAliases = None,
+        scorer: str = MATCHING_SCORER,
+        tfidf_same_category: bool = TFIDF_SAME_CATEGORY
     ):
+        """
+        aliases - known pairings of team names, checked before the fuzzy matching and filled by its results
+        scorer - backend of candidates search: "sequence" scores candidates of blocking index (or all events),
+        "tfidf" scores top-k events by cosine similarity of char n-grams vectors
+        tfidf_same_category - tfidf candidates only of the exchange event category
+        """
+        assert scorer in SCORERS, 'Invalid scorer %s' % scorer
+
         self.bm_events_df = bm_events_df
         self.exchange_data = exchange_data
         self.total_min_similarity = total_min_similarity
         self.teams_min_similarity = teams_min_similarity
-        self.words_to_remove = self.WORDS_TO_REMOVE if not words_to_remove else words_to_remove
+        self.words_to_remove = tuple(self.WORDS_TO_REMOVE if not words_to_remove else words_to_remove)
+        self.use_blocking = use_blocking
+        self._bm_events = None
+        self._bm_index = None
+        self._bm_by_teams = None
+        self.aliases = aliases
+        self.scorer = scorer
+        self.tfidf_same_category = tfidf_same_category
+        self._tfidf_searcher = None
+        self.pruned_pairs = Counter()
 
         self.logger = logging.Logger(self.__class__.__name__, level=logging.NOTSET)
         log_format = logging.Formatter(LOG_FORMAT)
@@ -30,19 +58,142 @@ class SimilarityExchangeMatcher:
         console.setFormatter(log_format)
         self.logger.addHandler(console)
 
-    def _remove_words(self, exc_team_first: str, exc_team_second: str, bm_team_first: str, bm_team_second: str):
-        for word in self.words_to_remove:
-            exc_team_first = exc_team_first.replace(word, "").replace("  ", " ")
-            exc_team_second = exc_team_second.replace(word, "").replace("  ", " ")
+        if self.scorer == TFIDF_SCORER and sparse is None:
+            self.logger.warning('scipy is not installed, using %s scorer' % SEQUENCE_SCORER)
+            self.scorer = SEQUENCE_SCORER
+
+    @property
+    def bm_events(self) -> list[dict[str, Any]]:
+        # converting and normalizing once per matcher, not once per exchange event
+        if self._bm_events is None:
+            self._bm_events = [add_normalized_keys(bm_data, self.words_to_remove)
+                               for bm_data in self.bm_events_df.replace({np.nan: None}).to_dict(orient='records')]
+        return self._bm_events
+
+    @property
+    def bm_index(self) -> BlockingIndex:
+        if self._bm_index is None:
+            self._bm_index = BlockingIndex(self.bm_events, first_team_field=FIRST_TEAM_KEY,
+                                           second_team_field=SECOND_TEAM_KEY, normalize=None,
+                                           min_similarity=self.teams_min_similarity,
+                                           min_total_similarity=self.total_min_similarity)
+        return self._bm_index
+
+    def add_bm_event(self, bm_data: dict[str, Any]) -> None:
+        """
+        Adding bookmaker event to already prepared events and indexes, used by incremental matching
+        """
+        self.bm_events.append(add_normalized_keys(bm_data, self.words_to_remove))
+        if self._bm_index is not None:
+            self._bm_index.index_event(len(self.bm_events) - 1)
+
+        if self._bm_by_teams is not None:
+            self._add_to_bm_by_teams(bm_data)
+
+        # matrices are rebuilt on the next search
+        self._tfidf_searcher = None
+
+    @property
+    def tfidf_searcher(self) -> TfidfCandidatesSearcher:
+        if self._tfidf_searcher is None:
+            self._tfidf_searcher = TfidfCandidatesSearcher(self.bm_events, first_team_field=FIRST_TEAM_KEY,
+                                                           second_team_field=SECOND_TEAM_KEY,
+                                                           same_category=self.tfidf_same_category)
+        return self._tfidf_searcher
+
+    @property
+    def bm_by_teams(self) -> dict[tuple, dict[str, Any]]:
+        if self._bm_by_teams is None:
+            self._bm_by_teams = {}
+            for bm_data in self.bm_events:
+                self._add_to_bm_by_teams(bm_data)
+        return self._bm_by_teams
+
+    def _add_to_bm_by_teams(self, bm_data: dict[str, Any]) -> None:
+        if bm_data[FIRST_TEAM_KEY] is None or bm_data[SECOND_TEAM_KEY] is None or not bm_data.get('bet'):
+            return
+
+        key = (bm_data.get('category'), bm_data['bet'].lower() == 'draw', bm_data[FIRST_TEAM_KEY],
+               bm_data[SECOND_TEAM_KEY])
+        self._bm_by_teams.setdefault(key, bm_data)
+
+    def _get_alias_match(self, exc_bet: str, exc_first: str, exc_second: str, exc_category: str = None) -> dict | None:
+        first_alias = self.aliases.get_alias(exc_category, exc_first)
+        second_alias = self.aliases.get_alias(exc_category, exc_second)
+        if first_alias is None or second_alias is None:
+            return
+
+        (bm_first, similarity_by_first_teams), (bm_second, similarity_by_second_teams) = first_alias, second_alias
+        if min(similarity_by_first_teams, similarity_by_second_teams) < self.teams_min_similarity or \
+                similarity_by_first_teams + similarity_by_second_teams < self.total_min_similarity:
+            return
+
+        bm_data = self.bm_by_teams.get((exc_category, exc_bet.lower() == 'draw', bm_first, bm_second))
+        if bm_data is None:
+            return
+
+        return {
+            "similarity_by_first_teams": similarity_by_first_teams,
+            "similarity_by_second_teams": similarity_by_second_teams,
+            "bm_event_data": bm_data
+        }
+
+    def _is_rejected(self, exc_category: str | None, exc_team: str, bm_team: str) -> bool:
+        similarity = self.aliases.get_rejected_similarity(exc_category, exc_team, bm_team)
+        return similarity is not None and similarity < self.teams_min_similarity
+
+    def _reject(self, exc_category: str | None, exc_team: str, bm_team: str, similarity: float) -> None:
+        if self.aliases is not None:
+            self.aliases.reject(exc_category, exc_team, bm_team, similarity)
+
+    def _exchange_key(self, exchange_data: dict[str, Any]) -> tuple[str | None, str, str, str]:
+        match exchange_data:
+            case {'bet': str() as exc_bet, 'first_team': str() as exc_first_team,
+                  'second_team': str() as exc_second_team}:
+                return (
+                    exchange_data.get('category'),
+                    exc_bet,
+                    normalize_team_name(exc_first_team, self.words_to_remove),
+                    normalize_team_name(exc_second_team, self.words_to_remove)
+                )
+        # never shares a group with bookmaker events
+        return None, '', '', ''
 
-            bm_team_first = bm_team_first.replace(word, "").replace("  ", " ")
-            bm_team_second = bm_team_second.replace(word, "").replace("  ", " ")
+    def _get_candidates(self, exc_category: str | None, exc_bet: str, exc_first_team: str,
+                        exc_second_team: str) -> list[dict[str, Any]]:
+        if self.scorer == TFIDF_SCORER:
+            return self.tfidf_searcher.candidates([(exc_category, exc_bet, exc_first_team, exc_second_team)])[0]
 
-        return exc_team_first, exc_team_second, bm_team_first, bm_team_second
+        if not self.use_blocking:
+            return self.bm_events
+        return self.bm_index.candidates(exc_bet, exc_first_team, exc_second_team)
 
     def make_matching(self) -> dict | None:
+        return self.match_event(self.exchange_data)
+
+    def make_batch_matching(self, exchange_events: Iterable[dict[str, Any]]) -> Iterator[tuple[dict, dict]]:
+        """
+        Matching all exchange events with the same bookmaker events, yields only found pairs
+        (exchange event data, best match)
+        """
+        if self.scorer == TFIDF_SCORER:
+            # candidates of all exchange events are searched by one series of matrix products
+            exchange_events = list(exchange_events)
+            events_candidates = self.tfidf_searcher.candidates(list(map(self._exchange_key, exchange_events)))
+        else:
+            events_candidates = None
+
+        for position, exchange_data in enumerate(exchange_events):
+            candidates = events_candidates[position] if events_candidates is not None else None
+            best_match = self.match_event(exchange_data, candidates=candidates)
+            if best_match is not None:
+                yield exchange_data, best_match
+
+        self.logger.info('Team pairs by pruning stages: %s' % dict(self.pruned_pairs))
+
+    def match_event(self, exchange_data: dict[str, Any], candidates: list[dict[str, Any]] = None) -> dict | None:
         best_match = None
-        match self.exchange_data:
+        match exchange_data:
             case {
                 'bet': str() as exc_bet,
                 'match_name': str() as exc_match_name,
@@ -51,45 +202,97 @@ class SimilarityExchangeMatcher:
                 **exc_other_fields
             }:
                 self.logger.debug('Start matching for event %s' % exc_match_name)
-                best_match = self._get_best_match(exc_bet, exc_first_team, exc_second_team)
+                best_match = self._get_best_match(
+                    exc_bet=exc_bet,
+                    exc_first=normalize_team_name(exc_first_team, self.words_to_remove),
+                    exc_second=normalize_team_name(exc_second_team, self.words_to_remove),
+                    exc_category=exc_other_fields.get('category'),
+                    candidates=candidates
+                )
 
                 if best_match is not None:
                     self.logger.debug('Match for event %s is %s' % (' vs '.join([exc_first_team, exc_second_team]),
                                                                     best_match['bm_event_data']['match_name']))
         return best_match
 
-    def _get_best_match(self, exc_bet, exc_first_team, exc_second_team) -> dict | None:
+    def _get_best_match(self, exc_bet: str, exc_first: str, exc_second: str, exc_category: str = None,
+                        candidates: list[dict[str, Any]] = None) -> dict | None:
+        """
+        exc_first and exc_second are normalized team names of exchange event,
+        candidates are searched by scorer if not passed
+        """
+        if self.aliases is not None:
+            alias_match = self._get_alias_match(exc_bet, exc_first, exc_second, exc_category)
+            if alias_match is not None:
+                return alias_match
+
+        if candidates is None:
+            candidates = self._get_candidates(exc_category, exc_bet, exc_first, exc_second)
+
+        best_match = self._get_fuzzy_best_match(exc_bet, exc_first, exc_second, candidates, exc_category)
+        if best_match is not None and self.aliases is not None:
+            bm_data = best_match['bm_event_data']
+            self.aliases.accept(exc_category, exc_first, bm_data[FIRST_TEAM_KEY],
+                                best_match['similarity_by_first_teams'])
+            self.aliases.accept(exc_category, exc_second, bm_data[SECOND_TEAM_KEY],
+                                best_match['similarity_by_second_teams'])
+        return best_match
+
+    def _team_similarity(self, exc_team: str, bm_team: str, min_similarity: float) -> float | None:
+        """
+        Sequence ratio of team names or None, if cheap upper bounds of ratio are below min_similarity
+        """
+        length = len(exc_team) + len(bm_team)
+        if length and 2.0 * min(len(exc_team), len(bm_team)) / length < min_similarity:
+            self.pruned_pairs[self.LENGTH_STAGE] += 1
+            return
+
+        sequence_matcher = CSequenceMatcher(None, exc_team, bm_team)
+        if sequence_matcher.quick_ratio() < min_similarity:
+            self.pruned_pairs[self.QUICK_RATIO_STAGE] += 1
+            return
+
+        self.pruned_pairs[self.RATIO_STAGE] += 1
+        return sequence_matcher.ratio()
+
+    def _get_fuzzy_best_match(self, exc_bet: str, exc_first: str, exc_second: str,
+                              candidates: list[dict[str, Any]], exc_category: str = None) -> dict | None:
         best_match = None
         best_similarity = 0.0
         exc_is_draw = (exc_bet.lower() == 'draw')
 
-        for bm_data in self.bm_events_df.replace({np.nan: None}).to_dict(orient='records'):
-            match bm_data:
-                case {
-                    'first_team': str() as bm_first_team,
-                    'second_team': str() as bm_second_team,
-                    'bet': str() as bm_bet,
-                    **bm_other_fields
-                }:
+        for bm_data in candidates:
+            match bm_data[FIRST_TEAM_KEY], bm_data[SECOND_TEAM_KEY], bm_data.get('bet'):
+                case str() as bm_first, str() as bm_second, str() as bm_bet:
                     bm_is_draw = (bm_bet.lower() == 'draw')
                     if exc_is_draw != bm_is_draw:
                         continue
 
-                    # if (exc_is_draw is False and bm_is_draw is True) or (exc_is_draw is True and bm_is_draw is False):
-                    #     continue
+                    if self.aliases is not None and (self._is_rejected(exc_category, exc_first, bm_first) or
+                                                     self._is_rejected(exc_category, exc_second, bm_second)):
+                        continue
+
+                    # similarity of a team is at most 1.0, so the pair can't reach total minimum or beat the best
+                    # if the first team similarity is below these bounds
+                    first_min_similarity = max(self.teams_min_similarity, self.total_min_similarity - 1.0,
+                                               best_similarity - 1.0)
+                    similarity_by_first_teams = self._team_similarity(exc_first, bm_first, first_min_similarity)
+                    if similarity_by_first_teams is None:
+                        continue
 
-                    exc_first, exc_second, bm_first, bm_second = self._remove_words(
-                        exc_team_first=exc_first_team,
-                        exc_team_second=exc_second_team,
-                        bm_team_first=bm_first_team,
-                        bm_team_second=bm_second_team
-                    )
-                    similarity_by_first_teams = CSequenceMatcher(None, exc_first, bm_first).ratio()
                     if similarity_by_first_teams < self.teams_min_similarity:
+                        self._reject(exc_category, exc_first, bm_first, similarity_by_first_teams)
+                        continue
+
+                    second_min_similarity = max(self.teams_min_similarity,
+                                                self.total_min_similarity - similarity_by_first_teams,
+                                                best_similarity - similarity_by_first_teams)
+                    similarity_by_second_teams = self._team_similarity(exc_second, bm_second, second_min_similarity)
+                    if similarity_by_second_teams is None:
                         continue
 
-                    similarity_by_second_teams = CSequenceMatcher(None, exc_second, bm_second).ratio()
                     if similarity_by_second_teams < self.teams_min_similarity:
+                        self._reject(exc_category, exc_second, bm_second, similarity_by_second_teams)
                         continue
 
                     similarity_score = similarity_by_first_teams + similarity_by_second_teams
@@ -0,0 +1,33 @@
+import re
+from functools import lru_cache
+
+from config import NORMALIZED_NAMES_CACHE_SIZE
+
+
+FIRST_TEAM_KEY = 'first_team_key'
+SECOND_TEAM_KEY = 'second_team_key'
+
+
+@lru_cache(maxsize=32)
+def _words_regex(words_to_remove: tuple[str, ...]) -> re.Pattern:
+    # longer words first, so they are not cut by their shorter prefixes
+    words = sorted(words_to_remove, key=len, reverse=True)
+    return re.compile(r'(?<!\w)(?:%s)(?!\w)' % '|'.join(map(re.escape, words)), re.IGNORECASE)
+
+
+@lru_cache(maxsize=NORMALIZED_NAMES_CACHE_SIZE)
+def normalize_team_name(team_name: str, words_to_remove: tuple[str, ...] = ()) -> str:
+    """
+    Removing words by one regex pass, collapsing whitespaces and casefolding.
+    Cached, because the same team names come with every event of the team
+    """
+    if words_to_remove:
+        team_name = _words_regex(words_to_remove).sub(' ', team_name)
+    return ' '.join(team_name.split()).casefold()
+
+
+def add_normalized_keys(event: dict, words_to_remove: tuple[str, ...] = ()) -> dict:
+    for team_field, key_field in (('first_team', FIRST_TEAM_KEY), ('second_team', SECOND_TEAM_KEY)):
+        team_name = event.get(team_field)
+        event[key_field] = normalize_team_name(team_name, words_to_remove) if isinstance(team_name, str) else None
+    return event
@@ -0,0 +1,136 @@
+import math
+from collections import Counter
+from typing import Any
+
+import numpy as np
+
+try:
+    from scipy import sparse
+except ImportError:  # optional, required only by tfidf scorer
+    sparse = None
+
+from config import TFIDF_TOP_K, TFIDF_SAME_CATEGORY
+from matching.indexes import char_ngrams
+
+
+SEQUENCE_SCORER = 'sequence'
+TFIDF_SCORER = 'tfidf'
+SCORERS = (SEQUENCE_SCORER, TFIDF_SCORER)
+
+
+class CharNgramTfidf:
+    """
+    Sparse TF-IDF vectors of char n-grams of team names, rows are L2 normalized, so dot product is cosine similarity
+    """
+
+    def __init__(self, ngram_size: int = 3):
+        if sparse is None:
+            raise ImportError('scipy is required for %s scorer' % TFIDF_SCORER)
+
+        self.ngram_size = ngram_size
+        self.vocabulary = {}
+        self.idf = None
+
+    def _names_ngrams(self, names: list[str | None]) -> list[Counter]:
+        return [Counter(char_ngrams(name, self.ngram_size)) if name else Counter() for name in names]
+
+    def fit(self, names: list[str | None]) -> 'CharNgramTfidf':
+        document_frequency = Counter()
+        for ngrams in self._names_ngrams(names):
+            document_frequency.update(ngrams.keys())
+
+        self.vocabulary = {ngram: column for column, ngram in enumerate(document_frequency)}
+        # smooth idf like in sklearn
+        self.idf = np.array([math.log((1 + len(names)) / (1 + document_frequency[ngram])) + 1
+                             for ngram in self.vocabulary], dtype=np.float32)
+        return self
+
+    def transform(self, names: list[str | None]) -> 'sparse.csr_matrix':
+        rows, columns, values = [], [], []
+        for row, ngrams in enumerate(self._names_ngrams(names)):
+            for ngram, count in ngrams.items():
+                column = self.vocabulary.get(ngram)
+                if column is None:
+                    continue
+
+                rows.append(row)
+                columns.append(column)
+                values.append(count * self.idf[column])
+
+        matrix = sparse.csr_matrix((values, (rows, columns)), shape=(len(names), len(self.vocabulary)),
+                                   dtype=np.float32)
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.diags(1 / norms).dot(matrix).tocsr()
+
+
+class TfidfCandidatesSearcher:
+    """
+    Top-k bookmaker events for all exchange events by sum of cosine similarities of first and second teams,
+    computed by sparse matrix products in chunks of exchange events. Candidates are re-ranked by sequence ratio,
+    so thresholds of matcher keep their meaning. Like the full scan, only draw and not draw bets are separated,
+    same_category limits candidates to the category of exchange event too
+    """
+
+    def __init__(
+        self,
+        events: list[dict[str, Any]],
+        first_team_field: str = 'first_team',
+        second_team_field: str = 'second_team',
+        top_k: int = TFIDF_TOP_K,
+        max_chunk_cells: int = 4_000_000,
+        same_category: bool = TFIDF_SAME_CATEGORY
+    ):
+        self.events = events
+        self.first_team_field = first_team_field
+        self.second_team_field = second_team_field
+        self.top_k = top_k
+        self.max_chunk_cells = max_chunk_cells
+        self.same_category = same_category
+
+        self._groups = {}
+        self._events_groups = np.array([self._event_group(event) for event in events], dtype=np.int64)
+
+        first_names = [event.get(first_team_field) for event in events]
+        second_names = [event.get(second_team_field) for event in events]
+        self.vectorizer = CharNgramTfidf().fit(first_names + second_names)
+        self._first_matrix = self.vectorizer.transform(first_names).T.tocsr()
+        self._second_matrix = self.vectorizer.transform(second_names).T.tocsr()
+
+    def _group_key(self, category: str | None, bet: str) -> tuple[str | None, bool]:
+        return category if self.same_category else None, bet.lower() == 'draw'
+
+    def _event_group(self, event: dict[str, Any]) -> int:
+        first_team, second_team = event.get(self.first_team_field), event.get(self.second_team_field)
+        bet = event.get('bet')
+        if not all(isinstance(value, str) for value in (first_team, second_team, bet)):
+            return -1
+        return self._groups.setdefault(self._group_key(event.get('category'), bet), len(self._groups))
+
+    def candidates(self, exchange_keys: list[tuple[str | None, str, str, str]]) -> list[list[dict[str, Any]]]:
+        """
+        exchange_keys - (category, bet, normalized first team, normalized second team) of exchange events
+        """
+        if not exchange_keys or not self.events:
+            return [[] for _ in exchange_keys]
+
+        exchange_groups = np.array([self._groups.get(self._group_key(category, bet), -2)
+                                    for category, bet, _, _ in exchange_keys], dtype=np.int64)
+        first_vectors = self.vectorizer.transform([first for _, _, first, _ in exchange_keys])
+        second_vectors = self.vectorizer.transform([second for _, _, _, second in exchange_keys])
+
+        top_k = min(self.top_k, len(self.events))
+        chunk_size = max(1, self.max_chunk_cells // len(self.events))
+        found = []
+
+        for start in range(0, len(exchange_keys), chunk_size):
+            end = start + chunk_size
+            scores = (first_vectors[start:end].dot(self._first_matrix) +
+                      second_vectors[start:end].dot(self._second_matrix)).toarray()
+            scores[exchange_groups[start:end, None] != self._events_groups[None, :]] = 0.0
+
+            top_positions = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            for row, positions in enumerate(top_positions):
+                # keeping original order, so ties are resolved like in the full scan
+                found.append([self.events[position] for position in sorted(positions) if scores[row, position] > 0])
+        return found
@@ -0,0 +1,43 @@
+import hashlib
+from collections import OrderedDict
+from io import StringIO
+
+from pandas import read_json
+from redis import Redis
+
+from config import BM_SNAPSHOT_TTL_SECONDS, BM_SNAPSHOTS_CACHE_SIZE
+from matching.matchers import SimilarityExchangeMatcher
+
+
+SNAPSHOT_KEY_PREFIX = 'bm_events_snapshot'
+
+# matchers with parsed and normalized bookmaker events of worker process by snapshot key
+_snapshots_matchers: OrderedDict[str, SimilarityExchangeMatcher] = OrderedDict()
+
+
+def publish_snapshot(redis_client: Redis, bm_events_json: str, ttl: int = BM_SNAPSHOT_TTL_SECONDS) -> str:
+    """
+    Saves bookmaker events once per run under the key by content hash, tasks receive only the key
+    """
+    key = '%s:%s' % (SNAPSHOT_KEY_PREFIX, hashlib.sha1(bm_events_json.encode()).hexdigest())
+    redis_client.set(key, bm_events_json, ex=ttl)
+    return key
+
+
+def get_snapshot_matcher(redis_client: Redis, key: str) -> SimilarityExchangeMatcher:
+    matcher = _snapshots_matchers.get(key)
+    if matcher is not None:
+        _snapshots_matchers.move_to_end(key)
+        return matcher
+
+    bm_events_json = redis_client.get(key)
+    if bm_events_json is None:
+        raise ValueError('Snapshot %s is expired or not published' % key)
+
+    matcher = SimilarityExchangeMatcher(bm_events_df=read_json(StringIO(bm_events_json.decode())))
+    matcher.bm_events  # parsing and normalizing once per worker process
+
+    _snapshots_matchers[key] = matcher
+    while len(_snapshots_matchers) > BM_SNAPSHOTS_CACHE_SIZE:
+        _snapshots_matchers.popitem(last=False)
+    return matcher
@@ -0,0 +1,169 @@
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+from pandas import DataFrame
+from redis import Redis
+
+from config import LOG_FORMAT, EXCHANGE_EVENTS_LIST, BOOKMAKER_EVENTS_LIST, MATCHES_SAVE_LIST_NAME, \
+    STREAMING_POLL_SECONDS, STREAMING_MAX_MINUTES
+from matching.indexes import BlockingIndex
+from matching.matchers import SimilarityExchangeMatcher
+from matching.normalizers import add_normalized_keys, FIRST_TEAM_KEY, SECOND_TEAM_KEY
+from matching.scorers import SEQUENCE_SCORER
+from matching.types import Pair
+from matching.workers import matches_event_data
+from queues.transport import push_items, last_offset, read_items_after, is_streams_transport
+
+
+class IncrementalMatcher:
+    """
+    Matching events as spiders push them to redis streams: new exchange event is matched with bookmaker events
+    received so far, new bookmaker event re-matches exchange events which share blocks with it.
+    The best match of exchange event is published to matches list every time it changes
+    """
+    STOP_KEY_PREFIX = 'streaming_matching_stop'
+    RUNNING_KEY_PREFIX = 'streaming_matching_running'
+
+    def __init__(
+        self,
+        redis_client: Redis,
+        pair: Pair,
+        exchange_list: str = EXCHANGE_EVENTS_LIST,
+        bookmaker_list: str = BOOKMAKER_EVENTS_LIST,
+        matches_list: str = MATCHES_SAVE_LIST_NAME,
+        poll_interval: float = STREAMING_POLL_SECONDS
+    ):
+        # positions of lists are shifted by drain of saving tasks, entries of streams keep their ids
+        assert is_streams_transport(), 'Streaming matching requires REDIS_TRANSPORT=streams'
+        self.redis_client = redis_client
+        self.pair = pair
+        self.exchange_list = exchange_list
+        self.bookmaker_list = bookmaker_list
+        self.matches_list = matches_list
+        self.poll_interval = poll_interval
+
+        self.matcher = SimilarityExchangeMatcher(bm_events_df=DataFrame(), scorer=SEQUENCE_SCORER)
+        self.exc_events = []
+        self.exc_index = BlockingIndex(self.exc_events, first_team_field=FIRST_TEAM_KEY,
+                                       second_team_field=SECOND_TEAM_KEY, normalize=None,
+                                       min_similarity=self.matcher.teams_min_similarity,
+                                       min_total_similarity=self.matcher.total_min_similarity)
+        self._published = {}  # exchange event position: bookmaker match name of published match
+        self._offsets = {}
+
+        self.logger = logging.Logger(self.__class__.__name__, level=logging.NOTSET)
+        log_format = logging.Formatter(LOG_FORMAT)
+        console = logging.StreamHandler()
+        console.setFormatter(log_format)
+        self.logger.addHandler(console)
+
+    @classmethod
+    def stop_key(cls, pair: Pair) -> str:
+        return f'{cls.STOP_KEY_PREFIX}:{pair.exchange.value}:{pair.bookmaker.value}'
+
+    @classmethod
+    def running_key(cls, pair: Pair) -> str:
+        return f'{cls.RUNNING_KEY_PREFIX}:{pair.exchange.value}:{pair.bookmaker.value}'
+
+    def _read_new_events(self, redis_list: str) -> list[dict[str, Any]]:
+        # entries are read by ids after the last offset, saving consumers do not remove them from stream
+        items, self._offsets[redis_list] = read_items_after(self.redis_client, redis_list,
+                                                            self._offsets.get(redis_list, 0))
+        return [json.loads(item) for item in items]
+
+    def _publish(self, exc_position: int, best_match: dict | None) -> bool:
+        if best_match is None:
+            return False
+
+        bm_match_name = best_match['bm_event_data']['match_name']
+        if self._published.get(exc_position) == bm_match_name:
+            return False
+
+        self._published[exc_position] = bm_match_name
+        matches_event = matches_event_data(self.exc_events[exc_position], best_match)
+        # the newest match of exchange event wins in results
+        matches_event['created_at'] = datetime.utcnow().isoformat()
+        push_items(self.redis_client, self.matches_list, [json.dumps(matches_event)])
+        return True
+
+    def add_exchange_event(self, exc_event_data: dict[str, Any]) -> bool:
+        self.exc_events.append(add_normalized_keys(exc_event_data, self.matcher.words_to_remove))
+        exc_position = len(self.exc_events) - 1
+        self.exc_index.index_event(exc_position)
+        return self._publish(exc_position, self.matcher.match_event(exc_event_data))
+
+    def add_bookmaker_event(self, bm_event_data: dict[str, Any]) -> int:
+        self.matcher.add_bm_event(bm_event_data)
+        if not isinstance(bm_event_data.get('bet'), str) or bm_event_data[FIRST_TEAM_KEY] is None or \
+                bm_event_data[SECOND_TEAM_KEY] is None:
+            return 0
+
+        published = 0
+        for exc_position in self.exc_index.candidate_positions(bm_event_data['bet'], bm_event_data[FIRST_TEAM_KEY],
+                                                               bm_event_data[SECOND_TEAM_KEY]):
+            published += self._publish(exc_position, self.matcher.match_event(self.exc_events[exc_position]))
+        return published
+
+    def poll(self) -> int:
+        published = 0
+        for bm_event_data in self._read_new_events(self.bookmaker_list):
+            if bm_event_data.get('bookmaker') == self.pair.bookmaker.value:
+                published += self.add_bookmaker_event(bm_event_data)
+
+        for exc_event_data in self._read_new_events(self.exchange_list):
+            if exc_event_data.get('exchange') == self.pair.exchange.value:
+                published += self.add_exchange_event(exc_event_data)
+        return published
+
+    def current_offsets(self) -> dict[str, str]:
+        return {redis_list: last_offset(self.redis_client, redis_list)
+                for redis_list in (self.exchange_list, self.bookmaker_list)}
+
+    def prepare(self) -> dict[str, str]:
+        """
+        Called by launcher before spiders start, returns offsets of streams, events before them belong to previous runs
+        """
+        self.redis_client.delete(self.stop_key(self.pair))
+        self.redis_client.set(self.running_key(self.pair), 1, ex=STREAMING_MAX_MINUTES * 60)
+        return self.current_offsets()
+
+    def stop(self) -> None:
+        self.redis_client.set(self.stop_key(self.pair), 1, ex=STREAMING_MAX_MINUTES * 60)
+
+    def is_running(self) -> bool:
+        return bool(self.redis_client.exists(self.running_key(self.pair)))
+
+    def wait(self, timeout_seconds: int = 60) -> bool:
+        over_time = datetime.utcnow() + timedelta(seconds=timeout_seconds)
+        while self.is_running():
+            if datetime.utcnow() >= over_time:
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    def run(self, offsets: dict[str, str] = None, max_minutes: int = STREAMING_MAX_MINUTES) -> None:
+        """
+        Polling streams from offsets until stop key of pair is set (after spiders finish) or max_minutes passed
+        """
+        stop_key, running_key = self.stop_key(self.pair), self.running_key(self.pair)
+        self._offsets = dict(offsets) if offsets is not None else self.current_offsets()
+
+        over_time = datetime.utcnow() + timedelta(minutes=max_minutes)
+        try:
+            while datetime.utcnow() < over_time:
+                stopping = bool(self.redis_client.exists(stop_key))
+                published = self.poll()
+                if published:
+                    self.logger.info('Published matches %s' % published)
+
+                if stopping:
+                    break
+
+                time.sleep(self.poll_interval)
+        finally:
+            self.redis_client.delete(stop_key, running_key)
+        self.logger.info('Over incremental matching, exchange events: %s, bookmaker events: %s' % (
+            len(self.exc_events), len(self.matcher.bm_events)))
@@ -0,0 +1,50 @@
+from typing import Any
+
+from pandas import DataFrame
+
+from db.connections import redis_client
+from matching.aliases import TeamAliasCache
+from matching.matchers import SimilarityExchangeMatcher
+
+
+# matcher of the pool worker process, created once by init_matching_worker
+_matcher: SimilarityExchangeMatcher | None = None
+
+
+def matches_event_data(exc_event_data: dict[str, Any], matched_data: dict[str, Any]) -> dict[str, Any]:
+    matched_bm_event = matched_data['bm_event_data']
+    return dict(
+        bet=exc_event_data['bet'],
+        category=exc_event_data['category'],
+        exchange=exc_event_data['exchange'],
+        exchange_match_name=exc_event_data['match_name'],
+        lay=exc_event_data['lay'],
+        bookmaker=matched_bm_event['bookmaker'],
+        bookmaker_match_name=matched_bm_event['match_name'],
+        odds=matched_bm_event['odds'],
+        similarity_by_first_teams=matched_data['similarity_by_first_teams'],
+        similarity_by_second_teams=matched_data['similarity_by_second_teams']
+    )
+
+
+def match_exchange_events(matcher: SimilarityExchangeMatcher, exc_events_data: list[dict]) -> list[dict[str, Any]]:
+    alias_cache = TeamAliasCache(redis_client)
+    matcher.aliases = alias_cache.load(exc_event_data.get('category') for exc_event_data in exc_events_data)
+
+    matches_events = [matches_event_data(exc_event_data, matched_data)
+                      for exc_event_data, matched_data in matcher.make_batch_matching(exc_events_data)]
+    alias_cache.save(matcher.aliases)
+    return matches_events
+
+
+def init_matching_worker(bm_events_data: list[dict[str, Any]]) -> None:
+    """
+    Initializer of process pool, bookmaker events are converted and indexed once per worker process
+    """
+    global _matcher
+    _matcher = SimilarityExchangeMatcher(bm_events_df=DataFrame(bm_events_data))
+
+
+def match_exchange_events_chunk(exc_events_data: list[dict]) -> list[dict[str, Any]]:
+    assert _matcher is not None, 'Matching worker is not initialized'
+    return match_exchange_events(_matcher, exc_events_data)
@@ -0,0 +1,28 @@
+import argparse
+
+from config import MATCHES_SAVE_LIST_NAME
+from db.connections import redis_client
+from db.models.event import MatchesEvent
+from queues.consumer import MicroBatchConsumer
+from queues.sheets import SheetWriterConsumer
+from queues.streams import StreamConsumer
+from queues.transport import is_streams_transport
+
+
+MATCHES_CONSUMER = 'matches'
+SHEETS_CONSUMER = 'sheets'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Long-running consumers of redis queues')
+    parser.add_argument('--consumer', default=MATCHES_CONSUMER, choices=(MATCHES_CONSUMER, SHEETS_CONSUMER))
+    args = parser.parse_args()
+
+    if args.consumer == SHEETS_CONSUMER:
+        # one writer per spreadsheet, it keeps shadow copies of sheets
+        SheetWriterConsumer(redis_client).run()
+    elif is_streams_transport():
+        # several savers can be run, they share stream entries by consumer group
+        StreamConsumer(redis_client, MATCHES_SAVE_LIST_NAME, MatchesEvent).run()
+    else:
+        MicroBatchConsumer(redis_client, MATCHES_SAVE_LIST_NAME, MatchesEvent).run()
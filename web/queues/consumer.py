@@ -0,0 +1,113 @@
+import json
+import logging
+import signal
+import time
+
+from peewee import Model
+from redis import Redis
+
+from config import LOG_FORMAT, MATCHES_BATCH_SIZE, MATCHES_BATCH_MAX_WAIT_SECONDS, MATCHES_CONSUMER_IDLE_SECONDS
+from db.connections import db
+from db.operations import copy_rows_to_model
+from queues.drain import pop_chunk, requeue, settle
+
+
+class MicroBatchConsumer:
+    """
+    Long-running saver of redis list items to the model table: blocks on BLMOVE while list is empty
+    and flushes a batch as soon as it has batch_size items or max_wait_seconds passed since its first item
+    """
+    # minimal BLMOVE timeout, zero timeout blocks forever
+    MIN_BLOCK_SECONDS = 0.01
+    # pause after a failed flush doubles with every failure in a row
+    FAILED_FLUSH_PAUSE_SECONDS = 5
+    FAILED_FLUSH_MAX_PAUSE_SECONDS = 60
+
+    def __init__(
+        self,
+        redis_client: Redis,
+        redis_list: str,
+        model: type[Model],
+        batch_size: int = MATCHES_BATCH_SIZE,
+        max_wait_seconds: float = MATCHES_BATCH_MAX_WAIT_SECONDS,
+        idle_seconds: float = MATCHES_CONSUMER_IDLE_SECONDS
+    ):
+        self.redis_client = redis_client
+        self.redis_list = redis_list
+        self.model = model
+        self.batch_size = batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.idle_seconds = idle_seconds
+        self._stopped = False
+        self._failed_flushes = 0
+
+        self.logger = logging.Logger(self.__class__.__name__, level=logging.NOTSET)
+        log_format = logging.Formatter(LOG_FORMAT)
+        console = logging.StreamHandler()
+        console.setFormatter(log_format)
+        self.logger.addHandler(console)
+
+    def stop(self, *args) -> None:
+        self.logger.info('Stopping after the current batch...')
+        self._stopped = True
+
+    def _destination(self) -> str:
+        return self.model.__name__
+
+    def _wait_items(self, timeout: float) -> bool:
+        # BLMOVE of the head to the head of the same list blocks like BLPOP but leaves the item in list,
+        # it is popped by pop_chunk which counts it in flight until the batch is settled
+        item = self.redis_client.blmove(self.redis_list, self.redis_list, max(timeout, self.MIN_BLOCK_SECONDS),
+                                        src='LEFT', dest='LEFT')
+        return item is not None
+
+    def collect_batch(self) -> list[bytes]:
+        if not self._wait_items(self.idle_seconds):
+            return []
+
+        batch = []
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.batch_size:
+            # items already in list are taken at once, waiting only when list is empty
+            batch.extend(pop_chunk(self.redis_client, self.redis_list, self.batch_size - len(batch)))
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self.batch_size or remaining <= 0 or self._stopped:
+                break
+
+            if not self._wait_items(remaining):
+                break
+        return batch
+
+    def _pause_after_failure(self) -> None:
+        pause = min(self.FAILED_FLUSH_PAUSE_SECONDS * 2 ** self._failed_flushes, self.FAILED_FLUSH_MAX_PAUSE_SECONDS)
+        self._failed_flushes += 1
+        time.sleep(pause)
+
+    def flush(self, batch: list[bytes]) -> int:
+        try:
+            saved = copy_rows_to_model(self.model, [json.loads(item) for item in batch])
+        except Exception as e:
+            requeue(self.redis_client, self.redis_list, batch)
+            self.logger.error('Batch of %s items is requeued: %s' % (len(batch), e))
+            # connection may be broken (postgres restart), it is thrown away and the next flush connects again
+            db.manual_close()
+            self._pause_after_failure()
+            return 0
+
+        self._failed_flushes = 0
+        self.logger.info('Saved to %s count: %s' % (self.model.__name__, saved))
+        return saved
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.logger.info('Consuming %s to %s...' % (self.redis_list, self._destination()))
+        while not self._stopped:
+            batch = self.collect_batch()
+            if batch:
+                try:
+                    self.flush(batch)
+                finally:
+                    settle(self.redis_client, self.redis_list, len(batch))
+        self.logger.info('Consumer is stopped')
@@ -0,0 +1,106 @@
+import json
+import time
+
+from peewee import Model
+from redis import Redis
+
+from config import REDIS_DRAIN_CHUNK_SIZE, REDIS_IN_FLIGHT_TTL_SECONDS
+from db.operations import copy_rows_to_model
+
+
+# pops the head of list and counts popped items as in flight until they are settled
+POP_CHUNK_SCRIPT = """
+local items = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('ltrim', KEYS[1], #items, -1)
+    redis.call('incrby', KEYS[2], #items)
+    redis.call('expire', KEYS[2], ARGV[2])
+end
+return items
+"""
+
+SETTLE_SCRIPT = """
+if redis.call('decrby', KEYS[1], ARGV[1]) <= 0 then
+    redis.call('del', KEYS[1])
+end
+return 1
+"""
+
+
+def import_model(model_path: str) -> type[Model]:
+    assert '.' in model_path
+
+    package = model_path.split('.')
+    model_name = package[-1]
+    mod = __import__('.'.join(package[:-1]), fromlist=[model_name])
+    return getattr(mod, model_name)
+
+
+def in_flight_key(redis_list: str) -> str:
+    return f'{redis_list}:in_flight'
+
+
+def pop_chunk(redis_client: Redis, redis_list: str, size: int = REDIS_DRAIN_CHUNK_SIZE) -> list[bytes]:
+    """
+    Reads and removes the head of list atomically, items pushed meanwhile stay in list.
+    Popped items are in flight until settle, the counter expires if the popping process died
+    """
+    script = redis_client.register_script(POP_CHUNK_SCRIPT)
+    return script(keys=[redis_list, in_flight_key(redis_list)], args=[size, REDIS_IN_FLIGHT_TTL_SECONDS])
+
+
+def settle(redis_client: Redis, redis_list: str, count: int) -> None:
+    # popped items are saved or requeued
+    if count:
+        redis_client.register_script(SETTLE_SCRIPT)(keys=[in_flight_key(redis_list)], args=[count])
+
+
+def requeue(redis_client: Redis, redis_list: str, items: list[bytes]) -> None:
+    # back to the head of list in the same order, so they are popped first by the next drain
+    if items:
+        redis_client.lpush(redis_list, *reversed(items))
+
+
+def drain_list_to_model(
+    redis_client: Redis,
+    redis_list: str,
+    model: type[Model],
+    chunk_size: int = REDIS_DRAIN_CHUNK_SIZE
+) -> int:
+    """
+    Moves json items of redis list to the model table by chunks, chunk which failed to save is requeued
+    """
+    saved = 0
+    while True:
+        items = pop_chunk(redis_client, redis_list, chunk_size)
+        if not items:
+            return saved
+
+        try:
+            saved += copy_rows_to_model(model, [json.loads(item) for item in items])
+        except Exception:
+            requeue(redis_client, redis_list, items)
+            raise
+        finally:
+            settle(redis_client, redis_list, len(items))
+
+        if len(items) < chunk_size:
+            return saved
+
+
+def wait_list_drained(redis_client: Redis, redis_list: str, timeout: float, poll_seconds: float = 0.5) -> bool:
+    """
+    Waits until list is empty and no popped items are in flight of other drainers (consumers),
+    returns False on timeout
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        pipeline = redis_client.pipeline(transaction=True)
+        pipeline.llen(redis_list)
+        pipeline.get(in_flight_key(redis_list))
+        length, in_flight = pipeline.execute()
+        if not length and not int(in_flight or 0):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(poll_seconds)
@@ -0,0 +1,43 @@
+import time
+import uuid
+
+from redis import Redis
+
+
+LATCH_KEY_PREFIX = 'latch'
+LATCH_TTL_SECONDS = 60 * 60
+
+
+class CompletionLatch:
+    """
+    Countdown latch on redis list: every finished task pushes to the list, waiter blocks on BLPOP
+    until count of signals is received, without polling states of tasks
+    """
+    def __init__(self, redis_client: Redis, count: int, key: str = None, ttl: int = LATCH_TTL_SECONDS):
+        self.redis_client = redis_client
+        self.count = count
+        self.key = key or '%s:%s' % (LATCH_KEY_PREFIX, uuid.uuid4().hex)
+        self.ttl = ttl
+
+    @staticmethod
+    def count_down(redis_client: Redis, key: str, ttl: int = LATCH_TTL_SECONDS) -> None:
+        pipeline = redis_client.pipeline(transaction=True)
+        pipeline.rpush(key, 1)
+        pipeline.expire(key, ttl)
+        pipeline.execute()
+
+    def wait(self, timeout_seconds: float) -> bool:
+        over_time = time.monotonic() + timeout_seconds
+        received = 0
+        try:
+            while received < self.count:
+                remaining = over_time - time.monotonic()
+                if remaining <= 0:
+                    return False
+
+                # at least one second, zero timeout of BLPOP blocks forever
+                if self.redis_client.blpop(self.key, timeout=max(int(remaining), 1)) is not None:
+                    received += 1
+            return True
+        finally:
+            self.redis_client.delete(self.key)
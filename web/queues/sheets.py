@@ -0,0 +1,116 @@
+import json
+from typing import Any
+
+from redis import Redis
+
+from config import SPREADSHEET_ID, SHEET_WRITES_LIST_PREFIX, SHEET_WRITES_BATCH_SIZE, SHEET_WRITES_MAX_WAIT_SECONDS, \
+    SHEET_WRITER_IDLE_SECONDS, SHEET_WRITES_MAX_ATTEMPTS
+from google_api.launchers import SpreadSheetWriter, ROW_KEY_FIELDS
+from managers.constants import FIELDS
+from queues.consumer import MicroBatchConsumer
+from queues.drain import requeue
+
+
+def sheet_writes_list(spreadsheet_id: str = SPREADSHEET_ID) -> str:
+    return f'{SHEET_WRITES_LIST_PREFIX}:{spreadsheet_id}'
+
+
+def sheet_writes_dead_list(spreadsheet_id: str = SPREADSHEET_ID) -> str:
+    return f'{sheet_writes_list(spreadsheet_id)}:dead'
+
+
+def push_sheet_upsert(redis_client: Redis, sheet_name: str, rows: list[dict[str, Any]], reset: bool = False,
+                      key_fields: tuple[str, ...] = ROW_KEY_FIELDS, spreadsheet_id: str = SPREADSHEET_ID) -> None:
+    """
+    Publishes rows to the sheet writer of spreadsheet, rows of the same key_fields are updated on sheet,
+    reset rewrites the sheet by rows
+    """
+    upsert = dict(sheet_name=sheet_name, rows=rows, reset=reset, key_fields=list(key_fields))
+    redis_client.rpush(sheet_writes_list(spreadsheet_id), json.dumps(upsert, default=str))
+
+
+def coalesce_upserts(
+    upserts: list[dict[str, Any]]
+) -> tuple[dict[str, list[dict[str, Any]]], set[str], dict[str, tuple[str, ...]]]:
+    """
+    Merges upserts in order of publishing to rows by sheets, sheets to rewrite and key fields by sheets.
+    Rows of the newer upsert go first, because the first row of the same key wins in upsert to sheet,
+    reset drops rows of the previous upserts of sheet
+    """
+    rows_lists, reset_sheets, key_fields = {}, set(), {}
+    for upsert in upserts:
+        sheet_name = upsert['sheet_name']
+        if upsert.get('reset'):
+            rows_lists[sheet_name] = []
+            reset_sheets.add(sheet_name)
+        rows_lists.setdefault(sheet_name, []).append(upsert['rows'])
+        key_fields[sheet_name] = tuple(upsert.get('key_fields') or ROW_KEY_FIELDS)
+
+    rows_by_sheets = {sheet_name: [row for rows in reversed(sheet_rows_lists) for row in rows]
+                      for sheet_name, sheet_rows_lists in rows_lists.items()}
+    return rows_by_sheets, reset_sheets, key_fields
+
+
+class SheetWriterConsumer(MicroBatchConsumer):
+    """
+    Long-running writer of spreadsheet, the only one per spreadsheet because it keeps shadow copies of sheets.
+    Row upserts of any producers are collected to batch and written by one values batch update
+    for all sheets of batch (sheets to rewrite take their own request)
+    """
+    def __init__(
+        self,
+        redis_client: Redis,
+        spreadsheet_id: str = SPREADSHEET_ID,
+        batch_size: int = SHEET_WRITES_BATCH_SIZE,
+        max_wait_seconds: float = SHEET_WRITES_MAX_WAIT_SECONDS,
+        idle_seconds: float = SHEET_WRITER_IDLE_SECONDS,
+        max_attempts: int = SHEET_WRITES_MAX_ATTEMPTS
+    ):
+        super().__init__(redis_client, sheet_writes_list(spreadsheet_id), model=None, batch_size=batch_size,
+                         max_wait_seconds=max_wait_seconds, idle_seconds=idle_seconds)
+        self.spreadsheet_id = spreadsheet_id
+        self.max_attempts = max_attempts
+        self.dead_list = sheet_writes_dead_list(spreadsheet_id)
+        self.writer = SpreadSheetWriter(fields=FIELDS, spreadsheet_id=spreadsheet_id)
+
+    def _destination(self) -> str:
+        return 'spreadsheet %s' % self.spreadsheet_id
+
+    def _load_upserts(self, batch: list[bytes]) -> list[dict[str, Any]]:
+        upserts = []
+        for item in batch:
+            try:
+                upserts.append(json.loads(item))
+            except ValueError as e:
+                self.redis_client.rpush(self.dead_list, item)
+                self.logger.error('Invalid upsert is moved to %s: %s' % (self.dead_list, e))
+        return upserts
+
+    def _requeue_failed(self, upserts: list[dict[str, Any]]) -> None:
+        """
+        Failed upserts go back to the head of list with counted attempt, ones out of attempts to the dead letter list
+        """
+        retried, dead = [], []
+        for upsert in upserts:
+            upsert['attempts'] = upsert.get('attempts', 0) + 1
+            (retried if upsert['attempts'] < self.max_attempts else dead).append(json.dumps(upsert))
+
+        requeue(self.redis_client, self.redis_list, retried)
+        if dead:
+            self.redis_client.rpush(self.dead_list, *dead)
+        self.logger.error('Failed upserts: %s requeued, %s moved to %s' % (len(retried), len(dead), self.dead_list))
+
+    def flush(self, batch: list[bytes]) -> int:
+        upserts = self._load_upserts(batch)
+        rows_by_sheets, reset_sheets, key_fields = coalesce_upserts(upserts)
+        try:
+            written = self.writer.upsert_to_sheets(rows_by_sheets, reset_sheets=reset_sheets, key_fields=key_fields)
+        except Exception as e:
+            self.logger.error('Batch of %s upserts failed: %s' % (len(batch), e))
+            self._requeue_failed(upserts)
+            self._pause_after_failure()
+            return 0
+
+        self._failed_flushes = 0
+        self.logger.info('Written rows by sheets: %s' % written)
+        return sum(written.values())
@@ -0,0 +1,185 @@
+import logging
+import signal
+import time
+from typing import Any
+
+from peewee import Model
+from redis import Redis
+from redis.exceptions import ResponseError
+
+from config import LOG_FORMAT, STREAM_GROUP, STREAM_BLOCK_MS, STREAM_CLAIM_IDLE_MS, STREAM_MAX_DELIVERIES, \
+    MATCHES_BATCH_SIZE
+from db.operations import copy_rows_to_model
+from queues.transport import STREAM_START_ID, consumer_name, entry_data
+
+
+def ensure_group(redis_client: Redis, stream: str, group: str = STREAM_GROUP) -> None:
+    try:
+        # entries already in stream are consumed by new group too
+        redis_client.xgroup_create(stream, group, id=STREAM_START_ID, mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def _decoded(value: bytes | str | None) -> str | None:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _entry_id_key(entry_id: str) -> tuple[int, ...]:
+    return tuple(int(part) for part in entry_id.split('-'))
+
+
+def stream_lag(redis_client: Redis, stream: str, group: str = STREAM_GROUP) -> dict[str, Any]:
+    """
+    Length of stream, entries delivered but not acknowledged (pending) and not delivered yet (lag) of group.
+    Lag is reported by redis since 7, with older redis it is only known whether the tail of stream is delivered
+    """
+    metrics = dict(stream=stream, group=group, length=redis_client.xlen(stream), pending=None, lag=None,
+                   last_delivered_id=None, last_id=None, delivered=None)
+    try:
+        groups = redis_client.xinfo_groups(stream)
+    except ResponseError:  # stream does not exist
+        return metrics
+
+    for group_info in groups:
+        if _decoded(group_info['name']) == group:
+            metrics['pending'] = group_info['pending']
+            metrics['lag'] = group_info.get('lag')
+            metrics['last_delivered_id'] = _decoded(group_info.get('last-delivered-id'))
+
+    entries = redis_client.xrevrange(stream, count=1)
+    metrics['last_id'] = _decoded(entries[0][0]) if entries else None
+    if metrics['last_delivered_id'] is not None:
+        # entries after the last delivered id are not delivered to group yet
+        metrics['delivered'] = metrics['last_id'] is None or \
+            _entry_id_key(metrics['last_id']) <= _entry_id_key(metrics['last_delivered_id'])
+    return metrics
+
+
+class StreamConsumer:
+    """
+    Saver of stream entries to the model table as a member of consumer group: entries are acknowledged
+    after they are saved, entries pending longer than claim_idle_ms (consumer died or saving failed)
+    are redelivered by XPENDING/XCLAIM, entries delivered more than max_deliveries times are dropped
+    """
+    LAG_LOG_SECONDS = 60
+
+    def __init__(
+        self,
+        redis_client: Redis,
+        stream: str,
+        model: type[Model],
+        group: str = STREAM_GROUP,
+        consumer: str = None,
+        batch_size: int = MATCHES_BATCH_SIZE,
+        block_ms: int = STREAM_BLOCK_MS,
+        claim_idle_ms: int = STREAM_CLAIM_IDLE_MS,
+        max_deliveries: int = STREAM_MAX_DELIVERIES
+    ):
+        self.redis_client = redis_client
+        self.stream = stream
+        self.model = model
+        self.group = group
+        self.consumer = consumer or consumer_name()
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self._stopped = False
+
+        self.logger = logging.Logger(self.__class__.__name__, level=logging.NOTSET)
+        log_format = logging.Formatter(LOG_FORMAT)
+        console = logging.StreamHandler()
+        console.setFormatter(log_format)
+        self.logger.addHandler(console)
+
+        ensure_group(self.redis_client, self.stream, self.group)
+
+    def stop(self, *args) -> None:
+        self.logger.info('Stopping after the current batch...')
+        self._stopped = True
+
+    def claim_stale(self) -> list[tuple[bytes, dict]]:
+        pending = self.redis_client.xpending_range(self.stream, self.group, min='-', max='+', count=self.batch_size,
+                                                   idle=self.claim_idle_ms)
+        if not pending:
+            return []
+
+        dropped = [entry['message_id'] for entry in pending if entry['times_delivered'] > self.max_deliveries]
+        if dropped:
+            self.redis_client.xack(self.stream, self.group, *dropped)
+            self.logger.error('Dropped %s entries of %s delivered more than %s times: %s' % (
+                len(dropped), self.stream, self.max_deliveries, dropped))
+
+        stale_ids = [entry['message_id'] for entry in pending if entry['times_delivered'] <= self.max_deliveries]
+        if not stale_ids:
+            return []
+
+        entries = self.redis_client.xclaim(self.stream, self.group, self.consumer, self.claim_idle_ms, stale_ids)
+        # entries deleted from stream by MAXLEN are claimed without fields and stay pending before redis 7
+        deleted = [entry_id for entry_id, fields in entries if not fields]
+        if deleted:
+            self.redis_client.xack(self.stream, self.group, *deleted)
+            self.logger.warning('Acknowledged %s pending entries deleted from %s' % (len(deleted), self.stream))
+        return [(entry_id, fields) for entry_id, fields in entries if fields]
+
+    def read_new(self, block_ms: int | None = None) -> list[tuple[bytes, dict]]:
+        response = self.redis_client.xreadgroup(self.group, self.consumer, {self.stream: '>'}, count=self.batch_size,
+                                                block=block_ms)
+        return response[0][1] if response else []
+
+    def flush(self, entries: list[tuple[bytes, dict]]) -> int:
+        rows = [data for data in (entry_data(fields) for _, fields in entries) if data is not None]
+        try:
+            saved = copy_rows_to_model(self.model, rows) if rows else 0
+        except Exception as e:
+            # not acknowledged entries stay pending and are claimed again after claim_idle_ms
+            self.logger.error('Failed to save %s entries of %s: %s' % (len(entries), self.stream, e))
+            return 0
+
+        self.redis_client.xack(self.stream, self.group, *[entry_id for entry_id, _ in entries])
+        return saved
+
+    def drain(self) -> int:
+        """
+        Saves stale pending and new entries until stream has nothing to deliver, without blocking
+        """
+        saved = 0
+        while not self._stopped:
+            entries = self.claim_stale() or self.read_new()
+            if not entries:
+                break
+            saved += self.flush(entries)
+        return saved
+
+    def wait_drained(self, timeout_seconds: int) -> bool:
+        """
+        Drains stream until no entries of group are pending, also ones delivered to other consumers
+        """
+        over_time = time.monotonic() + timeout_seconds
+        while time.monotonic() < over_time:
+            self.drain()
+            metrics = stream_lag(self.redis_client, self.stream, self.group)
+            if metrics['pending'] == 0 and metrics['delivered']:
+                return True
+            time.sleep(1)
+        return False
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.logger.info('Consuming stream %s by %s/%s to %s...' % (
+            self.stream, self.group, self.consumer, self.model.__name__))
+        lag_logged = time.monotonic()
+        while not self._stopped:
+            entries = self.claim_stale() or self.read_new(block_ms=self.block_ms)
+            if entries:
+                saved = self.flush(entries)
+                self.logger.info('Saved to %s count: %s' % (self.model.__name__, saved))
+
+            if time.monotonic() - lag_logged >= self.LAG_LOG_SECONDS:
+                self.logger.info('Stream metrics: %s' % stream_lag(self.redis_client, self.stream, self.group))
+                lag_logged = time.monotonic()
+        self.logger.info('Consumer is stopped')
@@ -0,0 +1,64 @@
+import json
+import os
+import socket
+from typing import Any
+
+from redis import Redis
+
+from config import REDIS_TRANSPORT, STREAM_MAXLEN
+
+
+LISTS_TRANSPORT = 'lists'
+STREAMS_TRANSPORT = 'streams'
+TRANSPORTS = (LISTS_TRANSPORT, STREAMS_TRANSPORT)
+STREAM_DATA_FIELD = 'data'  # json of item in stream entry fields
+STREAM_START_ID = '0-0'
+
+assert REDIS_TRANSPORT in TRANSPORTS, 'Unknown REDIS_TRANSPORT %s' % REDIS_TRANSPORT
+
+
+def is_streams_transport() -> bool:
+    return REDIS_TRANSPORT == STREAMS_TRANSPORT
+
+
+def consumer_name() -> str:
+    return '%s-%s' % (socket.gethostname(), os.getpid())
+
+
+def push_items(redis_client: Redis, name: str, items_json: list[str]) -> None:
+    """
+    Appends json items to redis list or stream with the name, depending on REDIS_TRANSPORT
+    """
+    if not items_json:
+        return
+
+    if not is_streams_transport():
+        redis_client.rpush(name, *items_json)
+        return
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for item_json in items_json:
+        pipeline.xadd(name, {STREAM_DATA_FIELD: item_json}, maxlen=STREAM_MAXLEN, approximate=True)
+    pipeline.execute()
+
+
+def last_offset(redis_client: Redis, name: str) -> str:
+    # id of the last stream entry, entries after it are new
+    entries = redis_client.xrevrange(name, count=1)
+    return entries[0][0].decode() if entries else STREAM_START_ID
+
+
+def read_items_after(redis_client: Redis, name: str, offset: str) -> tuple[list[bytes], str]:
+    """
+    Items of stream appended after entry id offset without consuming them, returns items and the new offset.
+    Ids of entries do not change when savers consume the stream, unlike positions of lists trimmed by drain
+    """
+    entries = redis_client.xrange(name, min='(%s' % offset)
+    if not entries:
+        return [], offset
+    return [fields[STREAM_DATA_FIELD.encode()] for _, fields in entries], entries[-1][0].decode()
+
+
+def entry_data(fields: dict[bytes, bytes]) -> dict[str, Any] | None:
+    data = fields.get(STREAM_DATA_FIELD.encode())
+    return json.loads(data) if data is not None else None
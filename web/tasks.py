@@ -1,113 +1,171 @@
 import json
 from datetime import datetime
 
-import redis
 from celery import Celery
 from celery.schedules import crontab
-from pandas import read_json
 
-from config import REDIS_URL, REDIS_HOST, REDIS_PORT, REDIS_PASSWORD
-from db.connections import db
-from matching.matchers import SimilarityExchangeMatcher
+from config import REDIS_URL, MATCHING_MODE, MATCHES_SAVE_LIST_NAME, EXCHANGE_EVENTS_LIST, BOOKMAKER_EVENTS_LIST, \
+    MATCHES_CONSUMER_ENABLED, STREAM_SAVERS, STREAM_SAVING_WAIT_SECONDS
+from db.connections import db, redis_client
+from db.partitions import PartitionManager
+from matching.aliases import TeamAliasCache
+from matching.snapshots import get_snapshot_matcher
+from matching.streaming import IncrementalMatcher
 from matching.types import Pair
+from matching.workers import match_exchange_events
+from managers.constants import STREAMING_MATCHING_MODE
 from managers.launchers import PairSaverLauncher, MultySpidersLauncher
+from managers.runs import PairRunRegistry, RunLease
+from queues.drain import drain_list_to_model, import_model
+from queues.latch import CompletionLatch
+from queues.streams import StreamConsumer
+from queues.transport import push_items, is_streams_transport, consumer_name
 
 
 app = Celery('OddsTasks', broker=REDIS_URL, backend=REDIS_URL)
-redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=1, password=REDIS_PASSWORD)
-MATCHES_SAVE_LIST_NAME = 'matched_events_to_save'
+run_registry = PairRunRegistry(redis_client)
 
 
-@app.task()
+@app.task(ignore_result=True)
 def saving_items_to_model_from_redis_list(redis_list, model_path: str) -> bool:
-    data_json = redis_client.lrange(redis_list, 0, -1)
-    if not data_json:
+    model = import_model(model_path)
+    saved = drain_list_to_model(redis_client, redis_list, model)
+    if not saved:
         print('Not found data for saving!')
         return False
 
-    assert '.' in model_path
+    print('Saved to %s count: %s' % (model.__name__, saved))
+    return True
 
-    package = model_path.split('.')
-    model_name = package[-1]
-    mod = __import__('.'.join(package[:-1]), fromlist=[model_name])
-    model = getattr(mod, model_name)
 
-    data_source = [model(**json.loads(event)) for event in data_json]
-    with db.atomic():
-        model.bulk_create(data_source)
-        # model.insert_many(data_source).execute()
+@app.task(ignore_result=True)
+def saving_items_to_model_from_redis_stream(stream: str, model_path: str, consumer: str = None) -> int:
+    model = import_model(model_path)
+    saved = StreamConsumer(redis_client, stream, model, consumer=consumer).drain()
+    print('Saved to %s count: %s' % (model.__name__, saved))
+    return saved
 
-    redis_client.delete(redis_list)
-    print('Saved to %s count: %s' % (model_name, len(data_source)))
-    return True
 
+@app.task(ignore_result=True)
+def matching_exchange_events(exc_events_data: list[dict], bm_snapshot_key: str, latch_key: str = None) -> int:
+    try:
+        matcher = get_snapshot_matcher(redis_client, bm_snapshot_key)
+        matches_events_json = [json.dumps(matches_event)
+                               for matches_event in match_exchange_events(matcher, exc_events_data)]
+        push_items(redis_client, MATCHES_SAVE_LIST_NAME, matches_events_json)
+        return len(matches_events_json)
+    finally:
+        if latch_key is not None:
+            CompletionLatch.count_down(redis_client, latch_key)
 
-@app.task()
-def matching_exchange_event(exc_event_data: dict, bm_events_json: str):
-    bm_events_df = read_json(bm_events_json)
-    matcher = SimilarityExchangeMatcher(exchange_data=exc_event_data, bm_events_df=bm_events_df)
-    matched_data = matcher.make_matching()
-    if matched_data is None:
-        return
 
-    matched_bm_event = matched_data['bm_event_data']
-    matches_event_json = json.dumps(dict(
-        bet=exc_event_data['bet'],
-        category=exc_event_data['category'],
-        exchange=exc_event_data['exchange'],
-        exchange_match_name=exc_event_data['match_name'],
-        lay=exc_event_data['lay'],
-        bookmaker=matched_bm_event['bookmaker'],
-        bookmaker_match_name=matched_bm_event['match_name'],
-        odds=matched_bm_event['odds'],
-        similarity_by_first_teams=matched_data['similarity_by_first_teams'],
-        similarity_by_second_teams=matched_data['similarity_by_second_teams']
-    ))
-
-    redis_client.rpush(MATCHES_SAVE_LIST_NAME, matches_event_json)
-
-
-@app.task()
-def pair_launch(sheet_name: str, exchange: str, bookmaker: str, save_from_redis: bool = False):
+@app.task(ignore_result=True)
+def streaming_matching(exchange: str, bookmaker: str, offsets: dict[str, str]):
+    IncrementalMatcher(redis_client, Pair(exchange=exchange, bookmaker=bookmaker)).run(offsets=offsets)
+
+
+@app.task(ignore_result=True)
+def pair_launch(sheet_name: str, exchange: str, bookmaker: str, save_from_redis: bool = False, run_id: str = None):
     pair = Pair(exchange=exchange, bookmaker=bookmaker)
-    spiders_launcher = MultySpidersLauncher(spiders={exchange, bookmaker})
+    if run_id is None:
+        run, created = run_registry.start(pair, sheet_name)
+        if not created:
+            print('Pair %s-%s is already running by %s' % (exchange, bookmaker, run.run_id))
+            return
+        run_id = run.run_id
+    elif not run_registry.claim(pair, run_id):
+        # lock of the enqueued run expired and another run of pair took it
+        print('Run %s of pair %s-%s lost its lock' % (run_id, exchange, bookmaker))
+        run_registry.finish(pair, run_id, failed=True)
+        return
+
+    with run_registry.heartbeat(pair, run_id) as lease:
+        _launch_pair(pair, sheet_name, save_from_redis, lease)
+
+
+def _launch_pair(pair: Pair, sheet_name: str, save_from_redis: bool, lease: RunLease) -> None:
+    exchange, bookmaker = pair.exchange.value, pair.bookmaker.value
+    spiders_launcher = MultySpidersLauncher(spiders={exchange, bookmaker}, stop_event=lease.lost)
+
+    incremental_matcher = None
+    if MATCHING_MODE == STREAMING_MATCHING_MODE:
+        incremental_matcher = IncrementalMatcher(redis_client, pair)
+        streaming_matching.delay(exchange, bookmaker, incremental_matcher.prepare())
 
     start_time, end_time = spiders_launcher.run()
 
+    if incremental_matcher is not None:
+        # matching the last pushed events before they are saved
+        incremental_matcher.stop()
+        incremental_matcher.wait()
+    # another run of pair is started after the lock is lost, results of this one are dropped
+    lease.check()
+
     if save_from_redis:
         for redis_list, model_path in {
-            'bookmaker_events': 'db.models.event.BookmakerEvent',
-            'exchange_events': 'db.models.event.ExchangeEvent'
+            BOOKMAKER_EVENTS_LIST: 'db.models.event.BookmakerEvent',
+            EXCHANGE_EVENTS_LIST: 'db.models.event.ExchangeEvent'
         }.items():
-            saving_items_to_model_from_redis_list(redis_list, model_path)
+            if is_streams_transport():
+                # savers of other workers drain the stream in parallel by consumer group
+                for saver in range(1, STREAM_SAVERS):
+                    saving_items_to_model_from_redis_stream.delay(redis_list, model_path, f'{consumer_name()}-{saver}')
+                StreamConsumer(redis_client, redis_list, import_model(model_path)).wait_drained(
+                    STREAM_SAVING_WAIT_SECONDS)
+            else:
+                saving_items_to_model_from_redis_list(redis_list, model_path)
 
         end_time = datetime.utcnow()
+        lease.check()
 
     PairSaverLauncher(
         start_time=start_time,
         end_time=end_time,
         sheet_name=sheet_name,
         pair=pair,
-        matching_task=matching_exchange_event
+        matching_task=matching_exchange_events
     ).run()
 
 
-@app.task()
+@app.task(ignore_result=True)
 def update_spiders_maps(map_spiders: list[str]):
     MultySpidersLauncher(spiders=set(map_spiders)).run()
 
 
+@app.task(ignore_result=True)
+def prune_team_aliases():
+    print('Deleted stale team aliases: %s' % TeamAliasCache(redis_client).prune())
+
+
+@app.task(ignore_result=True)
+def maintain_partitions():
+    with db:
+        PartitionManager().maintain()
+
+
 app.conf.beat_schedule = {
-    'saving_matches_task': {
-        'schedule': 3.0,
-        'task': 'tasks.saving_items_to_model_from_redis_list',
-        'args': (MATCHES_SAVE_LIST_NAME, 'db.models.event.MatchesEvent')
-    },
     'spiders_maps_update_task': {
         'schedule': crontab(minute=0, hour='*/3'),
         'task': 'tasks.update_spiders_maps',
         'args': (['bet99_map'],)
+    },
+    'partitions_maintenance_task': {
+        'schedule': crontab(minute=30),
+        'task': 'tasks.maintain_partitions'
+    },
+    'team_aliases_pruning_task': {
+        'schedule': crontab(minute=45),
+        'task': 'tasks.prune_team_aliases'
     }
 }
 
+if not MATCHES_CONSUMER_ENABLED:
+    # matches are saved by the long-running consumer (python -m queues), polling only without it
+    app.conf.beat_schedule['saving_matches_task'] = {
+        'schedule': 3.0,
+        'task': 'tasks.saving_items_to_model_from_redis_stream' if is_streams_transport() else
+                'tasks.saving_items_to_model_from_redis_list',
+        'args': (MATCHES_SAVE_LIST_NAME, 'db.models.event.MatchesEvent')
+    }
+
 app.conf.timezone = 'UTC'
@@ -0,0 +1,28 @@
+class FakeRedis:
+    """
+    Lists of redis in memory, enough for producers and requeue of queues
+    """
+    def __init__(self):
+        self.lists = {}
+
+    def rpush(self, name: str, *values) -> int:
+        self.lists.setdefault(name, []).extend(values)
+        return len(self.lists[name])
+
+    def lpush(self, name: str, *values) -> int:
+        for value in values:
+            self.lists.setdefault(name, []).insert(0, value)
+        return len(self.lists[name])
+
+    def lrange(self, name: str, start: int, end: int) -> list:
+        items = self.lists.get(name, [])
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def llen(self, name: str) -> int:
+        return len(self.lists.get(name, []))
+
+    def pop_chunk(self, name: str, size: int) -> list:
+        # pop_chunk of queues.drain without its lua script
+        items = self.lists.get(name, [])
+        chunk, self.lists[name] = items[:size], items[size:]
+        return chunk
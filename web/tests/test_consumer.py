@@ -0,0 +1,27 @@
+import json
+from unittest import mock
+
+from db.models.event import MatchesEvent
+from queues.consumer import MicroBatchConsumer
+from tests.fakes import FakeRedis
+
+
+def test_failed_flush_reconnects_and_backs_off():
+    consumer = MicroBatchConsumer(FakeRedis(), 'items', MatchesEvent)
+    batch = [json.dumps(dict(n=1)).encode()]
+    with mock.patch('queues.consumer.copy_rows_to_model', side_effect=ConnectionError) as copy_rows_to_model, \
+            mock.patch('queues.consumer.db') as db, mock.patch('queues.consumer.time.sleep') as sleep:
+        assert consumer.flush(batch) == 0
+        assert consumer.flush(consumer.redis_client.pop_chunk('items', 1)) == 0
+
+        copy_rows_to_model.side_effect = None
+        copy_rows_to_model.return_value = 1
+        assert consumer.flush(batch) == 1
+        copy_rows_to_model.side_effect = ConnectionError
+        # pause starts over after a saved batch
+        consumer.flush(batch)
+
+    assert db.manual_close.call_count == 3
+    pause = MicroBatchConsumer.FAILED_FLUSH_PAUSE_SECONDS
+    assert [call.args[0] for call in sleep.call_args_list] == [pause, pause * 2, pause]
+    assert consumer.redis_client.lrange('items', 0, -1) == batch * 2
@@ -0,0 +1,37 @@
+import json
+from unittest import mock
+
+import pytest
+
+from queues.drain import drain_list_to_model, requeue
+from tests.fakes import FakeRedis
+
+
+def test_requeue_keeps_order_before_pushed_items():
+    redis_client = FakeRedis()
+    redis_client.rpush('items', b'3')
+    requeue(redis_client, 'items', [b'1', b'2'])
+    assert redis_client.lrange('items', 0, -1) == [b'1', b'2', b'3']
+
+
+def test_failed_chunk_is_requeued_in_order():
+    redis_client = FakeRedis()
+    redis_client.rpush('items', *[json.dumps(dict(n=n)) for n in range(5)])
+
+    def copy_rows(model, rows):
+        if rows[0]['n'] == 2:
+            # pushed by producers while the chunk is copied
+            redis_client.rpush('items', json.dumps(dict(n=5)))
+            raise ValueError('copy failed')
+        return len(rows)
+
+    with mock.patch('queues.drain.pop_chunk', side_effect=lambda client, name, size: client.pop_chunk(name, size)), \
+            mock.patch('queues.drain.settle') as settle, \
+            mock.patch('queues.drain.copy_rows_to_model', side_effect=copy_rows) as copy_rows_to_model:
+        with pytest.raises(ValueError):
+            drain_list_to_model(redis_client, 'items', model=None, chunk_size=2)
+
+    assert copy_rows_to_model.call_count == 2
+    assert [json.loads(item)['n'] for item in redis_client.lrange('items', 0, -1)] == [2, 3, 4, 5]
+    # popped items are not in flight after save and after requeue
+    assert [call.args[2] for call in settle.call_args_list] == [2, 2]
@@ -0,0 +1,51 @@
+import random
+
+from cdifflib import CSequenceMatcher
+from pandas import DataFrame
+
+from benchmarks.corpora import generate_synthetic_corpus, add_noise
+from matching.indexes import BlockingIndex
+from matching.matchers import SimilarityExchangeMatcher
+
+
+NAMES = ('Disoi United', 'Dosol', 'Atlético Mineiro', 'Atletico Mineiro', 'Ab', 'Ba', 'A', 'Inter', 'Real Madrid',
+         'Madrid Real', 'Rio Ave', 'Ávila', 'Avila', 'Zz', '')
+
+
+def test_blocking_index_keeps_every_similar_pair():
+    rnd = random.Random(0)
+    names = list(NAMES) + [add_noise(name, rnd) for name in NAMES for _ in range(5)]
+    events = [dict(first_team=name, second_team=name, bet='Home') for name in names]
+    index = BlockingIndex(events, normalize=None, min_similarity=0.5)
+
+    for name in names:
+        candidates = set(index.candidate_positions('Home', name, name))
+        for position, event in enumerate(events):
+            if CSequenceMatcher(None, name, event['first_team']).ratio() >= 0.5:
+                assert position in candidates, (name, event['first_team'])
+
+
+def test_blocking_index_candidates_are_few():
+    corpus = generate_synthetic_corpus(400, seed=0)
+    matcher = SimilarityExchangeMatcher(bm_events_df=DataFrame(corpus.bookmaker_events), scorer='sequence')
+    candidates, events = 0, 0
+    for exc_event in corpus.exchange_events:
+        _, bet, first_team, second_team = matcher._exchange_key(exc_event)
+        candidates += len(matcher.bm_index.candidate_positions(bet, first_team, second_team))
+        events += sum(1 for bm_event in matcher.bm_events
+                      if BlockingIndex.is_draw(bm_event['bet']) == BlockingIndex.is_draw(bet))
+    assert candidates / events < 0.01
+
+
+def _matches(corpus, use_blocking: bool) -> dict:
+    matcher = SimilarityExchangeMatcher(bm_events_df=DataFrame(corpus.bookmaker_events), use_blocking=use_blocking,
+                                        scorer='sequence')
+    return {
+        (exc_event['match_name'], exc_event['bet']): matched_data['bm_event_data']['match_name']
+        for exc_event, matched_data in matcher.make_batch_matching(corpus.exchange_events)
+    }
+
+
+def test_blocking_matches_are_the_same_as_full_scan():
+    corpus = generate_synthetic_corpus(150, seed=1)
+    assert _matches(corpus, use_blocking=True) == _matches(corpus, use_blocking=False)
@@ -0,0 +1,37 @@
+from datetime import datetime
+from unittest import mock
+
+from db.models.event import ExchangeEvent
+from db.operations import copy_rows_to_model
+
+
+def _copied_rows(rows: list[dict]) -> list[dict[str, str]]:
+    # values of COPY text format by column
+    with mock.patch('db.operations.db') as db:
+        assert copy_rows_to_model(ExchangeEvent, rows) == len(rows)
+    sql, buffer = db.connection().cursor().copy_expert.call_args[0]
+    columns = [column.strip('"') for column in sql[sql.index('(') + 1:sql.index(')')].split(', ')]
+
+    lines = buffer.read().split('\n')
+    assert lines.pop() == ''
+    return [dict(zip(columns, line.split('\t'), strict=True)) for line in lines]
+
+
+def test_copy_escapes_text_format_separators():
+    copied = _copied_rows([dict(first_team='Tab\tTeam', second_team='New\nLine', match_name='Back\\slash',
+                                category='Cr\rLf', bet='Home', exchange='bf', lay=1.5)])
+    assert len(copied) == 1
+    assert copied[0]['first_team'] == 'Tab\\tTeam'
+    assert copied[0]['second_team'] == 'New\\nLine'
+    assert copied[0]['match_name'] == 'Back\\\\slash'
+    assert copied[0]['category'] == 'Cr\\rLf'
+    assert copied[0]['lay'] == '1.5'
+
+
+def test_copy_writes_null_and_model_defaults():
+    copied = _copied_rows([dict(first_team='A', second_team='B', match_name='A - B', category='c', bet='Draw',
+                                exchange='bf', unknown='ignored')])
+    assert 'id' not in copied[0] and 'unknown' not in copied[0]
+    assert copied[0]['url'] == copied[0]['lay'] == r'\N'
+    # callable default of created_at
+    assert datetime.fromisoformat(copied[0]['created_at']) <= datetime.utcnow()
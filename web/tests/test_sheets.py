@@ -0,0 +1,75 @@
+import json
+from unittest import mock
+
+import pytest
+
+from queues.sheets import SheetWriterConsumer, coalesce_upserts
+from tests.fakes import FakeRedis
+
+
+def _upsert(sheet_name: str, *match_names: str, reset: bool = False, **fields) -> dict:
+    return dict(sheet_name=sheet_name, rows=[dict(match_name=name, bet='Home') for name in match_names],
+                reset=reset, **fields)
+
+
+def test_coalesce_puts_newer_rows_first():
+    rows_by_sheets, reset_sheets, key_fields = coalesce_upserts([
+        _upsert('A', 'old'), _upsert('B', 'other'), _upsert('A', 'new', key_fields=['match_name'])
+    ])
+    assert [row['match_name'] for row in rows_by_sheets['A']] == ['new', 'old']
+    assert [row['match_name'] for row in rows_by_sheets['B']] == ['other']
+    assert reset_sheets == set()
+    assert key_fields == {'A': ('match_name',), 'B': ('match_name', 'bet')}
+
+
+def test_coalesce_reset_drops_previous_rows():
+    rows_by_sheets, reset_sheets, _ = coalesce_upserts([
+        _upsert('A', 'before'), _upsert('A', 'reset', reset=True), _upsert('A', 'after')
+    ])
+    assert [row['match_name'] for row in rows_by_sheets['A']] == ['after', 'reset']
+    assert reset_sheets == {'A'}
+
+
+@pytest.fixture
+def consumer() -> SheetWriterConsumer:
+    with mock.patch('queues.sheets.SpreadSheetWriter'):
+        consumer = SheetWriterConsumer(FakeRedis(), spreadsheet_id='spreadsheet', max_attempts=2)
+    consumer.writer.upsert_to_sheets.side_effect = ConnectionError('sheets api is down')
+    return consumer
+
+
+def _flush(consumer: SheetWriterConsumer, batch: list[bytes]) -> int:
+    with mock.patch('queues.consumer.time.sleep'):
+        return consumer.flush(batch)
+
+
+def test_failed_upserts_are_requeued_with_attempts(consumer):
+    consumer.redis_client.rpush(consumer.redis_list, b'pushed meanwhile')
+    assert _flush(consumer, [json.dumps(_upsert('A', 'first')), json.dumps(_upsert('A', 'second'))]) == 0
+
+    requeued = consumer.redis_client.lrange(consumer.redis_list, 0, -1)
+    assert requeued[-1] == b'pushed meanwhile'
+    upserts = [json.loads(item) for item in requeued[:-1]]
+    assert [upsert['rows'][0]['match_name'] for upsert in upserts] == ['first', 'second']
+    assert [upsert['attempts'] for upsert in upserts] == [1, 1]
+    assert consumer.redis_client.llen(consumer.dead_list) == 0
+
+
+def test_upserts_out_of_attempts_go_to_dead_list(consumer):
+    _flush(consumer, [json.dumps(_upsert('A', 'retried', attempts=1)), json.dumps(_upsert('A', 'first'))])
+
+    assert [json.loads(item)['rows'][0]['match_name']
+            for item in consumer.redis_client.lrange(consumer.redis_list, 0, -1)] == ['first']
+    dead = [json.loads(item) for item in consumer.redis_client.lrange(consumer.dead_list, 0, -1)]
+    assert [(upsert['rows'][0]['match_name'], upsert['attempts']) for upsert in dead] == [('retried', 2)]
+
+
+def test_invalid_upsert_goes_to_dead_list(consumer):
+    consumer.writer.upsert_to_sheets.side_effect = None
+    consumer.writer.upsert_to_sheets.return_value = {'A': 1}
+    assert _flush(consumer, [b'not json', json.dumps(_upsert('A', 'valid'))]) == 1
+
+    assert consumer.redis_client.lrange(consumer.dead_list, 0, -1) == [b'not json']
+    assert consumer.redis_client.llen(consumer.redis_list) == 0
+    rows_by_sheets = consumer.writer.upsert_to_sheets.call_args[0][0]
+    assert [row['match_name'] for row in rows_by_sheets['A']] == ['valid']
@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from unittest import mock
+
+import pytest
+
+from google_api.launchers import SpreadSheetWriter
+from google_api.shadow import SheetShadow
+from managers.types import TableField
+
+
+FIELDS = OrderedDict(Event=TableField(key='match_name'), Bet=TableField(key='bet'),
+                     Odds=TableField(key='odds', default_value='-'), Lay=TableField(key='lay', default_value='-'))
+
+
+class FakeShadowStore:
+    # shadows of SheetShadowStore without redis, conflict makes the next set fail like a newer version in redis
+    def __init__(self):
+        self.shadows = {}
+        self.conflict = False
+
+    def get(self, sheet_name: str) -> SheetShadow | None:
+        return self.shadows.get(sheet_name)
+
+    def set(self, sheet_name: str, shadow: SheetShadow) -> bool:
+        if self.conflict:
+            self.shadows.pop(sheet_name, None)
+            return False
+        self.shadows[sheet_name] = shadow
+        return True
+
+    def delete(self, sheet_name: str) -> None:
+        self.shadows.pop(sheet_name, None)
+
+
+@pytest.fixture
+def writer() -> SpreadSheetWriter:
+    with mock.patch('google_api.launchers.SpreadSheetClient'), \
+            mock.patch('google_api.launchers.SheetShadowStore', return_value=FakeShadowStore()):
+        writer = SpreadSheetWriter(fields=FIELDS, spreadsheet_id='spreadsheet')
+    writer.gsp_client.get_sheet_meta.return_value = {'gridProperties': {'rowCount': 1000}}
+    return writer
+
+
+def _written_ranges(writer: SpreadSheetWriter) -> dict[str, list]:
+    body = writer.gsp_client.batch_update_values.call_args.kwargs['body']
+    return {value_range['range']: value_range['values'] for value_range in body.data}
+
+
+def test_changed_ranges_are_runs_of_changed_cells():
+    assert SpreadSheetWriter._changed_ranges(['a', 1, 2, 3, 'b'], ['a', 0, 0, 3, 'c']) == [(1, 2), (4, 4)]
+    assert SpreadSheetWriter._changed_ranges(['a', 1], ['a', 1, 2]) == [(2, 2)]
+    assert SpreadSheetWriter._changed_ranges(['a'], ['a']) == []
+
+
+def test_unknown_shadow_rewrites_sheet(writer):
+    rows = [dict(match_name='A - B', bet='Home', odds=1.5, lay=1.6), dict(match_name='A - B', bet='Home', odds=9)]
+    assert writer.upsert_to_sheet('Sheet', rows) == 1
+
+    writer.gsp_client.rewrite_sheet.assert_called_once()
+    assert writer.gsp_client.rewrite_sheet.call_args[0][1][1:] == [['A - B', 'Home', 1.5, 1.6]]
+    writer.gsp_client.batch_update_values.assert_not_called()
+    assert writer.shadows.get('Sheet').rows == [['A - B', 'Home', 1.5, 1.6]]
+
+
+def test_shadow_diff_writes_changed_cells_and_appends_rows(writer):
+    writer.upsert_to_sheet('Sheet', [dict(match_name='A - B', bet='Home', odds=1.5, lay=1.6),
+                                     dict(match_name='C - D', bet='Away', odds=2.5, lay=2.6),
+                                     dict(match_name='E - F', bet='Draw', odds=3.5, lay=3.6)])
+    written = writer.upsert_to_sheet('Sheet', [dict(match_name='C - D', bet='Away', odds=2.5, lay=2.7),
+                                               dict(match_name='A - B', bet='Home', odds=1.4, lay=1.7),
+                                               dict(match_name='E - F', bet='Draw', odds=3.5, lay=3.6),
+                                               dict(match_name='G - H', bet='Home', odds=4.5)])
+
+    assert written == 3
+    assert _written_ranges(writer) == {
+        'Sheet!C2:D2': [[1.4, 1.7]],
+        'Sheet!D3:D3': [[2.7]],
+        'Sheet!A5:D5': [['G - H', 'Home', 4.5, '-']],
+    }
+    writer.gsp_client.rewrite_sheet.assert_called_once()
+    assert writer.shadows.get('Sheet').rows[3] == ['G - H', 'Home', 4.5, '-']
+
+
+def test_version_conflict_drops_shadow_and_rewrites_next_time(writer):
+    writer.upsert_to_sheet('Sheet', [dict(match_name='A - B', bet='Home', odds=1.5, lay=1.6)])
+    writer.shadows.conflict = True
+    with mock.patch.object(writer.logger, 'warning') as warning:
+        writer.upsert_to_sheet('Sheet', [dict(match_name='A - B', bet='Home', odds=1.4, lay=1.6)])
+    warning.assert_called_once()
+    assert writer.shadows.get('Sheet') is None
+
+    writer.shadows.conflict = False
+    writer.upsert_to_sheet('Sheet', [dict(match_name='A - B', bet='Home', odds=1.3, lay=1.6)])
+    assert writer.gsp_client.rewrite_sheet.call_count == 2
+
+
+def test_failed_write_drops_shadow(writer):
+    writer.upsert_to_sheet('Sheet', [dict(match_name='A - B', bet='Home', odds=1.5, lay=1.6)])
+    writer.gsp_client.batch_update_values.side_effect = ConnectionError
+    with pytest.raises(ConnectionError):
+        writer.upsert_to_sheet('Sheet', [dict(match_name='A - B', bet='Home', odds=1.4, lay=1.6)])
+    assert writer.shadows.get('Sheet') is None
+    writer.gsp_client.invalidate_metadata.assert_called_once()